@@ -9,19 +9,38 @@ Flask 後端 API 伺服器
 import os
 import json
 import time
-import threading
+import atexit
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, request, jsonify, send_file, send_from_directory, g, Response
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import logging
 import re
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 
 # 導入遊戲核心模組
 from rhythm_game.src.downloader import YouTubeDownloader
-from rhythm_game.src.analyzer import AudioAnalyzer
-from rhythm_game.src.utils import ChartManager, ConfigManager, ScoreCalculator, GameStats
+from rhythm_game.src.download_manager import DownloadManager, DownloadQueueFull
+from rhythm_game.src.utils import ChartManager, ConfigManager, ScoreCalculator, GameStats, get_audio_duration
+from rhythm_game.src.sessions import SessionRegistry
+from rhythm_game.src.session_store import create_session_store
+from rhythm_game.src.jobs import (
+    AnalysisExecutor, generate_chart_job, pipeline_chart_job, section_chart_job, practice_clips
+)
+from rhythm_game.src.detectors import ANALYSIS_PROFILES
+from rhythm_game.src.metrics import MetricsRegistry, JOB_BUCKETS
+from rhythm_game.src.clock_sync import ClockSync
+from rhythm_game.src.calibration import (
+    OffsetEstimator, CalibrationStore, CALIBRATION_CHART_ID, CALIBRATION_WINDOW, create_calibration_chart,
+    is_valid_device_id
+)
+from rhythm_game.src.replay import ReplayWriter, replay_filename, KIND_HIT, KIND_AUTO_MISS
+from rhythm_game.src.scores import ScoreStore
+from rhythm_game.src.chart_stream import ChartStreamer
+from rhythm_game.src.progress import ProgressBroadcaster, job_room
+from rhythm_game.src.preview import PreviewCache
+from rhythm_game.src.waveform import generate_peaks, peaks_path, is_stale as peaks_stale
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
@@ -32,66 +51,326 @@ app = Flask(__name__, static_folder='static', static_url_path='')
 app.config['SECRET_KEY'] = 'rhythm_game_secret_key_2024'
 
 # 啟用 CORS 和 SocketIO
+# 多 worker 部署時設定 RHYTHM_MESSAGE_QUEUE（例如 redis://localhost:6379/0），
+# 讓任何 worker 發出的事件都能送達連在其他 worker 上的客戶端。
+# RHYTHM_ASYNC_MODE 由 server.py 設定（eventlet），開發伺服器使用 threading
+# RHYTHM_SOCKET_SERIALIZER=msgpack 改以二進位 msgpack 編碼封包，客戶端由
+# /api/server/transport 偵測後改用相同的 parser
+SOCKET_SERIALIZER = 'msgpack' if os.environ.get('RHYTHM_SOCKET_SERIALIZER') == 'msgpack' else 'default'
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    async_mode=os.environ.get('RHYTHM_ASYNC_MODE') or 'threading',
+    message_queue=os.environ.get('RHYTHM_MESSAGE_QUEUE') or None,
+    ping_interval=float(os.environ.get('RHYTHM_PING_INTERVAL', 25)),
+    ping_timeout=float(os.environ.get('RHYTHM_PING_TIMEOUT', 20)),
+    max_http_buffer_size=int(os.environ.get('RHYTHM_MAX_HTTP_BUFFER_SIZE', 1000000)),
+    serializer=SOCKET_SERIALIZER,
+    # long-polling 回應超過此大小才壓縮；WebSocket 的 permessage-deflate 由瀏覽器與伺服器自動協商
+    http_compression=True,
+    compression_threshold=int(os.environ.get('RHYTHM_COMPRESSION_THRESHOLD', 1024))
+)
 
 # 初始化遊戲組件
 downloader = YouTubeDownloader()
-analyzer = AudioAnalyzer(debug=True)
+# 下載工作佇列：限制同時下載數，同一部影片的重複請求共用工作，已下載的影片依影片 ID 重複使用
+download_manager = DownloadManager(
+    max_workers=int(os.environ.get('RHYTHM_DOWNLOAD_WORKERS', 2)),
+    max_pending=int(os.environ.get('RHYTHM_DOWNLOAD_QUEUE', 16)),
+    spawn=socketio.start_background_task
+)
+# 譜面分析在獨立行程執行，避免阻塞 Socket.IO 事件迴圈
+# 分析行程啟動時先暖機（編譯 numba 函數），編譯結果存於共用的磁碟快取
+analysis_executor = AnalysisExecutor(
+    max_workers=int(os.environ.get('RHYTHM_ANALYSIS_WORKERS', 0)),
+    sleep=socketio.sleep,
+    warm_up=os.environ.get('RHYTHM_ANALYSIS_WARMUP', '1') != '0',
+    numba_cache_dir=os.environ.get('RHYTHM_NUMBA_CACHE_DIR', 'rhythm_game/numba_cache') or None
+)
+# 長音訊的 onset 包絡線分段平行計算使用的行程數（每個分析行程各自擁有），0 或 1 為停用
+SEGMENT_WORKERS = int(os.environ.get('RHYTHM_SEGMENT_WORKERS', 0))
+# 預設的分析設定檔（onset 與節拍檢測後端），請求可用 profile 覆寫
+ANALYSIS_PROFILE = os.environ.get('RHYTHM_ANALYSIS_PROFILE', 'accurate')
+if ANALYSIS_PROFILE not in ANALYSIS_PROFILES:
+    logger.warning(f"Unknown RHYTHM_ANALYSIS_PROFILE '{ANALYSIS_PROFILE}', using 'accurate'")
+    ANALYSIS_PROFILE = 'accurate'
 chart_manager = ChartManager()
+# 譜面音符依時間視窗分段傳送（play.js 於播放前請求下一段）
+chart_streamer = ChartStreamer(chart_manager)
 config_manager = ConfigManager()
+# 裝置延遲校準（JSON 檔，背景合併寫入）
+calibration_store = CalibrationStore(max_devices=int(os.environ.get('RHYTHM_CALIBRATION_MAX_DEVICES', 10000)))
+atexit.register(calibration_store.close)
+# 每場遊戲的輸入記錄為重播檔，可用 tools/rescore.py 批次重新計分；設為空字串停用
+REPLAY_DIR = os.environ.get('RHYTHM_REPLAY_DIR', 'rhythm_game/replays')
+# 成績與排行榜（SQLite，背景批次寫入）；設為空字串停用
+# 匯入時不開啟資料庫，start_services() 或第一次送出 / 查詢時才建立
+SCORE_DB = os.environ.get('RHYTHM_SCORE_DB', 'rhythm_game/scores.db')
+score_store = ScoreStore(SCORE_DB) if SCORE_DB else None
+if score_store is not None:
+    atexit.register(score_store.close)
 
-# 全域遊戲狀態
-game_sessions = {}
+# 選曲試聽片段（依音訊內容雜湊快取的短 MP3）
+preview_cache = PreviewCache(os.environ.get('RHYTHM_PREVIEW_DIR', 'rhythm_game/previews'))
+
+# 下載與譜面產生進度：只送給訂閱該工作的客戶端，並限制每個工作的發送頻率
+progress = ProgressBroadcaster(
+    emit=lambda event, payload, room: socketio.emit(event, payload, to=room),
+    max_rate=float(os.environ.get('RHYTHM_PROGRESS_RATE', 5)),
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep
+)
+
+# Prometheus 指標（GET /metrics）；事件速率可由各 histogram 的 _count 計算
+metrics = MetricsRegistry(prefix='rhythm_')
+http_request_duration = metrics.histogram(
+    'http_request_duration_seconds', 'HTTP 路由處理時間', ('route', 'method', 'status'))
+socket_event_duration = metrics.histogram(
+    'socket_event_duration_seconds', 'Socket.IO 事件處理時間', ('event',))
+chart_job_duration = metrics.histogram(
+    'chart_job_duration_seconds', '譜面產生工作時間', ('method', 'status'), buckets=JOB_BUCKETS)
+chart_stage_duration = metrics.histogram(
+    'chart_stage_duration_seconds', '譜面產生各步驟時間（同時執行的步驟分別計時）', ('stage',), buckets=JOB_BUCKETS)
+download_duration = metrics.histogram(
+    'download_duration_seconds', '下載工作時間', ('status',), buckets=JOB_BUCKETS)
+downloads_total = metrics.counter('downloads_total', '下載工作次數', ('status',))
+pipeline_duration = metrics.histogram(
+    'pipeline_duration_seconds', '一鍵產生譜面從請求到譜面可遊玩的時間', ('status',), buckets=JOB_BUCKETS)
+pipeline_stage_duration = metrics.histogram(
+    'pipeline_stage_duration_seconds', '一鍵產生譜面各步驟時間', ('stage',), buckets=JOB_BUCKETS)
+cache_requests = metrics.counter('cache_requests_total', '快取查詢次數', ('cache', 'result'))
+
+
+def _cache_hit_ratios():
+    """由 cache_requests_total 計算各快取的命中率"""
+    totals = {}
+    for (cache, result), count in cache_requests.items().items():
+        hits, total = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (count if result == 'hit' else 0), total + count)
+    return {(cache,): hits / total for cache, (hits, total) in totals.items() if total}
+
+
+metrics.gauge('cache_hit_ratio', '快取命中率', ('cache',), function=_cache_hit_ratios)
+metrics.gauge('analysis_workers_ready', '已完成暖機的分析行程數',
+              function=lambda: analysis_executor.get_status()['warm_workers'])
+metrics.gauge('chart_jobs_pending', '等待中或執行中的譜面產生工作數',
+              function=lambda: analysis_executor.pending)
+metrics.gauge('downloads_pending', '等待中或執行中的下載數',
+              function=lambda: download_manager.pending)
+metrics.counter('download_requests_total', '下載請求的處理方式', ('result',),
+                function=lambda: {
+                    (result,): download_manager.get_metrics()[result]
+                    for result in ('queued', 'joined', 'cached', 'rejected')
+                })
+metrics.counter('progress_events_total', '下載與譜面產生進度事件數', ('result',),
+                function=lambda: {
+                    ('emitted',): progress.get_metrics()['emitted'],
+                    ('coalesced',): progress.get_metrics()['coalesced']
+                })
+if score_store is not None:
+    metrics.gauge('score_writes_pending', '等待寫入資料庫的成績數',
+                  function=lambda: score_store.get_metrics()['pending'])
+    metrics.counter('score_writes_total', '成績寫入結果', ('result',),
+                    function=lambda: {
+                        ('written',): score_store.get_metrics()['written'],
+                        ('dropped',): score_store.get_metrics()['dropped']
+                    })
 
 class WebGameSession:
     """Web 遊戲會話管理"""
     
     def __init__(self, session_id):
         self.session_id = session_id
+        self.chart_path = None
         self.chart_data = None
         self.game_stats = GameStats()
         self.score_calculator = ScoreCalculator()
         self.start_time = None
+        # 遊戲時間軸以伺服器單調時鐘為準，扣除暫停時間
+        self.start_mono = None
+        self.paused_total = 0.0
+        self.pause_started = None
+        self.start_anchor = None
         self.is_playing = False
         self.is_paused = False
         self.current_time = 0
+        self.clock = ClockSync(max_lag=float(os.environ.get('RHYTHM_MAX_INPUT_LAG', 0.5)))
+        # 延遲校準：記錄每次擊中的帶正負號時間差，input_offset 為套用中的補償
+        self.device_id = None
+        self.player_name = None
+        self.timing = OffsetEstimator()
+        self.input_offset = 0.0
+        # 輸入重播（序號、軌道、校正後時間）
+        self.replay = None
+        self.input_seq = 0
+        
+    @property
+    def is_calibration(self):
+        return self.chart_path == CALIBRATION_CHART_ID
         
     def load_chart(self, chart_path):
         """載入譜面"""
-        self.chart_data = chart_manager.load_chart(chart_path)
+        self.chart_path = chart_path
+        if chart_path == CALIBRATION_CHART_ID:
+            self.chart_data = create_calibration_chart()
+        else:
+            self.chart_data = chart_manager.load_chart(chart_path)
         return self.chart_data is not None
+    
+    def to_state(self):
+        """轉換為可序列化的狀態（譜面只記錄路徑與已判定的音符）"""
+        judged_notes = {}
+        if self.chart_data:
+            for index, note in enumerate(self.chart_data['notes']):
+                if note.get('hit', False):
+                    judged_notes[index] = note.get('judgment')
+        
+        return {
+            'session_id': self.session_id,
+            'chart_path': self.chart_path,
+            'judged_notes': judged_notes,
+            'game_stats': self.game_stats.get_state(),
+            'start_time': self.start_time,
+            # 單調時鐘只在同一行程內有效，跨行程以已經過的遊戲時間重建
+            'elapsed': self.get_current_time(),
+            'paused_total': self.paused_total,
+            'device_id': self.device_id,
+            'player_name': self.player_name,
+            'timing': self.timing.get_state(),
+            'clock': self.clock.get_state(),
+            'input_offset': self.input_offset,
+            'replay_path': str(self.replay.path) if self.replay else None,
+            'input_seq': self.input_seq,
+            'is_playing': self.is_playing,
+            'is_paused': self.is_paused
+        }
+    
+    @classmethod
+    def from_state(cls, state):
+        """由 to_state() 的結果重建會話"""
+        session = cls(state['session_id'])
+        if state.get('chart_path') and session.load_chart(state['chart_path']):
+            notes = session.chart_data['notes']
+            for index, judgment in state.get('judged_notes', {}).items():
+                index = int(index)
+                if 0 <= index < len(notes):
+                    notes[index]['hit'] = True
+                    notes[index]['judgment'] = judgment
+        
+        session.game_stats.load_state(state.get('game_stats', {}))
+        session.start_time = state.get('start_time')
+        session.is_playing = state.get('is_playing', False)
+        session.is_paused = state.get('is_paused', False)
+        session.device_id = state.get('device_id')
+        session.player_name = state.get('player_name')
+        session.timing.load_state(state.get('timing', {}))
+        session.clock.load_state(state.get('clock', {}))
+        session.input_offset = state.get('input_offset', 0.0)
+        session.input_seq = state.get('input_seq', 0)
+        if session.is_playing and state.get('replay_path'):
+            session.replay = ReplayWriter(state['replay_path'])
+        if session.is_playing:
+            now = time.monotonic()
+            session.start_mono = now - state.get('elapsed', 0) - state.get('paused_total', 0)
+            session.paused_total = state.get('paused_total', 0)
+            session.pause_started = now if session.is_paused else None
+        return session
         
     def start_game(self):
         """開始遊戲"""
         self.game_stats.reset()
         self.game_stats.start_game()
         self.start_time = time.time()
+        self.start_mono = time.monotonic()
+        self.paused_total = 0.0
+        self.pause_started = None
+        self.start_anchor = None
         self.is_playing = True
         self.is_paused = False
+        self.input_seq = 0
+        if REPLAY_DIR:
+            self.replay = ReplayWriter(Path(REPLAY_DIR) / replay_filename(self.session_id, self.start_time), {
+                'session_id': self.session_id,
+                'chart_path': self.chart_path,
+                'device_id': self.device_id,
+                'input_offset': self.input_offset,
+                'tolerances': config_manager.get('judgment_tolerances', {}),
+                'started_at': self.start_time
+            })
+    
+    def record_input(self, lane, kind, game_time):
+        """將輸入附加到重播檔"""
+        if self.replay is not None:
+            self.input_seq += 1
+            self.replay.append(self.input_seq, lane, kind, game_time)
+    
+    def anchor_start(self, client_ts, received_at):
+        """
+        以客戶端音樂實際開始播放的時間重新校準遊戲起點
+        
+        起點與按鍵時間使用同一個 offset 換算，offset 的估計誤差會互相抵銷
+        """
+        if self.is_playing:
+            self.start_anchor = (client_ts, received_at)
+            self.start_mono = self.clock.to_server_time(client_ts, received_at)
+    
+    def refresh_anchor(self):
+        """時鐘估計更新後重新換算遊戲起點"""
+        if self.is_playing and self.start_anchor is not None:
+            self.start_mono = self.clock.to_server_time(*self.start_anchor)
         
-    def pause_game(self):
+    def pause_game(self, client_ts=None, received_at=None):
         """暫停遊戲"""
+        if self.is_playing and not self.is_paused:
+            received_at = time.monotonic() if received_at is None else received_at
+            self.pause_started = self.clock.to_server_time(client_ts, received_at)
         self.is_paused = True
         
-    def resume_game(self):
+    def resume_game(self, client_ts=None, received_at=None):
         """恢復遊戲"""
+        if self.is_paused and self.pause_started is not None:
+            received_at = time.monotonic() if received_at is None else received_at
+            resumed_at = self.clock.to_server_time(client_ts, received_at)
+            self.paused_total += max(0.0, resumed_at - self.pause_started)
+            self.pause_started = None
         self.is_paused = False
         
     def end_game(self):
         """結束遊戲"""
         self.is_playing = False
         self.game_stats.end_game()
+        if self.replay is not None:
+            self.replay.close()
+            self.replay = None
         
     def get_current_time(self):
         """獲取目前遊戲時間"""
-        if not self.is_playing or self.start_time is None:
+        if not self.is_playing or self.start_mono is None:
             return 0
-        return time.time() - self.start_time
-        
-    def hit_note(self, lane, hit_time):
-        """處理音符擊中"""
-        current_time = self.get_current_time()
+        now = self.pause_started if self.is_paused and self.pause_started is not None else time.monotonic()
+        return self.game_time_at(now)
+    
+    def game_time_at(self, server_time):
+        """將伺服器單調時鐘時間換算為遊戲時間（扣除暫停）"""
+        return server_time - self.start_mono - self.paused_total
+        
+    def hit_note(self, lane, hit_time, client_ts=None, received_at=None):
+        """
+        處理音符擊中
+        
+        以客戶端按鍵時間戳記（經時鐘同步換算）判定，網路延遲不影響判定結果；
+        未提供時間戳記時退回以伺服器收到時間估計
+        """
+        if received_at is None:
+            received_at = time.monotonic()
+        if self.is_playing and self.start_mono is not None:
+            raw_time = self.game_time_at(self.clock.to_server_time(client_ts, received_at))
+        else:
+            raw_time = self.get_current_time()
+        # 套用裝置的延遲補償（自動校準開啟時）
+        current_time = raw_time - self.input_offset
+        self.record_input(lane, KIND_HIT, raw_time)
         
         # 尋找對應的音符
         best_note = None
@@ -103,11 +382,14 @@ class WebGameSession:
         tolerance_perfect = tolerances.get('perfect', 0.08)  # 增加到 80ms
         tolerance_great = tolerances.get('great', 0.15)     # 增加到 150ms
         tolerance_good = tolerances.get('good', 0.25)       # 增加到 250ms
+        if self.is_calibration:
+            # 校準時玩家可按任意鍵，並放寬可配對的範圍以量測偏移
+            tolerance_good = max(tolerance_good, CALIBRATION_WINDOW)
         
         # 尋找該 lane 中最適合的音符
         for note in self.chart_data['notes']:
-            if note['lane'] == lane and not note.get('hit', False):
-                # 計算時間差 - 使用目前時間而不是 hit_time 以提高準確性
+            if (note['lane'] == lane or self.is_calibration) and not note.get('hit', False):
+                # 計算時間差 - 使用校正後的按鍵時間而不是客戶端回報的 hit_time
                 time_diff = abs(current_time - note['time'])
                 
                 # 判定邏輯
@@ -130,6 +412,9 @@ class WebGameSession:
             best_note['hit'] = True
             best_note['judgment'] = best_judgment
             self.game_stats.add_judgment(best_judgment)
+            # 正值表示按得太晚；估計器記錄未補償的偏移，建議值才是絕對的延遲
+            offset = current_time - best_note['time']
+            self.timing.add(raw_time - best_note['time'])
             
             # 計算分數
             score = self.score_calculator.calculate_note_score(
@@ -144,7 +429,8 @@ class WebGameSession:
                 'judgment': best_judgment,
                 'score': score,
                 'combo': self.game_stats.combo,
-                'time_diff': best_time_diff
+                'time_diff': best_time_diff,
+                'offset': offset
             }
         
         # 如果沒有擊中任何音符，記錄為miss
@@ -160,8 +446,92 @@ class WebGameSession:
             'score': self.game_stats.score   # 返回目前分數
         }
 
+# 全域遊戲狀態（容量與存活時間可用環境變數調整）
+# RHYTHM_SESSION_STORE 為 redis:// 網址時，會話存放在 Redis 供多個 worker 共用
+game_sessions = SessionRegistry(
+    max_sessions=int(os.environ.get('RHYTHM_MAX_SESSIONS', 1000)),
+    idle_ttl=float(os.environ.get('RHYTHM_SESSION_IDLE_TTL', 600)),
+    max_age=float(os.environ.get('RHYTHM_SESSION_MAX_AGE', 3600)),
+    reap_interval=float(os.environ.get('RHYTHM_SESSION_REAP_INTERVAL', 30)),
+    # 遊戲中的判定只標記為待寫入，每隔此秒數批次寫回；暫停與結束時立即寫入
+    save_interval=float(os.environ.get('RHYTHM_SESSION_SAVE_INTERVAL', 1)),
+    store=create_session_store(
+        os.environ.get('RHYTHM_SESSION_STORE'),
+        factory=WebGameSession.from_state
+    )
+)
+
+metrics.gauge('active_sessions', '目前的遊戲會話數', function=lambda: len(game_sessions))
+metrics.gauge('session_memory_bytes', '遊戲會話估計記憶體用量',
+              function=lambda: game_sessions.get_metrics()['memory_bytes_total'])
+metrics.counter('sessions_rejected_total', '因容量上限被拒絕的會話數',
+                function=lambda: game_sessions.get_metrics()['rejected'])
+metrics.counter('sessions_evicted_total', '被回收的會話數', ('reason',),
+                function=lambda: {
+                    ('idle',): game_sessions.get_metrics()['evicted_idle'],
+                    ('max_age',): game_sessions.get_metrics()['evicted_age']
+                })
+
+# 音訊長度快取：{路徑: (修改時間, 檔案大小, 長度)}
+_audio_duration_cache = {}
+
+def get_cached_audio_duration(file_path):
+    """取得音訊長度，檔案未變更時使用快取"""
+    stat = file_path.stat()
+    key = str(file_path)
+    cached = _audio_duration_cache.get(key)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        cache_requests.inc(cache='audio_duration', result='hit')
+        return cached[2]
+    
+    cache_requests.inc(cache='audio_duration', result='miss')
+    duration = get_audio_duration(file_path)
+    _audio_duration_cache[key] = (stat.st_mtime_ns, stat.st_size, duration)
+    return duration
+
+@app.before_request
+def start_request_timer():
+    """記錄請求開始時間"""
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """記錄路由處理時間"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_duration.observe(
+            time.perf_counter() - start,
+            route=route, method=request.method, status=response.status_code
+        )
+    return response
+
+def start_services():
+    """
+    啟動背景服務：分析行程暖機與成績資料庫
+
+    由 server.py 或開發伺服器在 monkey patch 之後呼叫，匯入 app 本身不會建立行程或檔案。
+    重複呼叫不會再次啟動。
+    """
+    analysis_executor.start()
+    if score_store is not None:
+        score_store.start()
+
 # API 路由
 
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 指標"""
+    return Response(metrics.render(), mimetype=None, content_type=MetricsRegistry.CONTENT_TYPE)
+
+@app.route('/api/ready')
+def get_readiness():
+    """就緒檢查：分析行程全部暖機完成前回傳 503"""
+    # 以其他 WSGI 伺服器載入 app 時，第一次就緒檢查才啟動分析行程
+    analysis_executor.start()
+    status = analysis_executor.get_status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 @app.route('/')
 def index():
     """主頁面"""
@@ -197,6 +567,229 @@ def update_config():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+@app.route('/api/calibration/<device_id>', methods=['GET'])
+def get_calibration(device_id):
+    """獲取裝置的延遲校準結果"""
+    if not is_valid_device_id(device_id):
+        return jsonify({'success': False, 'error': '無效的裝置 ID'}), 400
+    record = calibration_store.get(device_id)
+    if record is None:
+        return jsonify({'success': False, 'error': '尚未校準'}), 404
+    return jsonify({'success': True, 'calibration': record})
+
+@app.route('/api/calibration/<device_id>', methods=['POST'])
+def update_calibration(device_id):
+    """手動設定偏移或切換自動套用"""
+    if not is_valid_device_id(device_id):
+        return jsonify({'success': False, 'error': '無效的裝置 ID'}), 400
+    try:
+        data = request.get_json() or {}
+        offset = data.get('offset')
+        if offset is not None:
+            offset = float(offset)
+            if abs(offset) > 1.0:
+                return jsonify({'success': False, 'error': '偏移必須介於 -1 到 1 秒之間'}), 400
+        auto_apply = data.get('auto_apply')
+        record = calibration_store.update(
+            device_id,
+            offset=offset,
+            auto_apply=bool(auto_apply) if auto_apply is not None else None
+        )
+        return jsonify({'success': True, 'calibration': record})
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/calibration/<device_id>', methods=['DELETE'])
+def delete_calibration(device_id):
+    """清除裝置的延遲校準結果"""
+    if not is_valid_device_id(device_id):
+        return jsonify({'success': False, 'error': '無效的裝置 ID'}), 400
+    if calibration_store.delete(device_id):
+        return jsonify({'success': True, 'message': '校準資料已清除'})
+    return jsonify({'success': False, 'error': '尚未校準'}), 404
+
+def _download_completed_payload(audio_path, title):
+    """下載完成事件的內容"""
+    # 獲取音訊時長
+    duration = None
+    duration_seconds = get_audio_duration(audio_path)
+    if duration_seconds:
+        duration = f"{int(duration_seconds//60)}:{int(duration_seconds%60):02d}"
+    
+    return {
+        'status': 'completed',
+        'title': title,
+        'path': audio_path,
+        'audio_path': audio_path,  # 添加 audio_path 字段
+        'filename': os.path.basename(audio_path),  # 添加 filename 字段
+        'duration': duration,  # 添加 duration 字段
+        'progress': 100
+    }
+
+# 接受的 YouTube 連結格式
+YOUTUBE_URL_PATTERNS = [
+    r'(?:https?://)?(?:www\.)?youtube\.com/watch\?v=[\w-]+',
+    r'(?:https?://)?(?:www\.)?youtu\.be/[\w-]+',
+    r'(?:https?://)?(?:www\.)?youtube\.com/embed/[\w-]+',
+    r'(?:https?://)?(?:www\.)?youtube\.com/v/[\w-]+',
+]
+
+# 支援的譜面產生方法
+CHART_METHODS = ['balanced_beat', 'energy', 'energy_analysis']
+
+def resolve_profile(profile):
+    """驗證請求指定的分析設定檔，未指定或不支援時使用預設值"""
+    if profile is None:
+        return ANALYSIS_PROFILE
+    if profile not in ANALYSIS_PROFILES:
+        logger.warning(f"Unsupported analysis profile '{profile}', using default '{ANALYSIS_PROFILE}'")
+        return ANALYSIS_PROFILE
+    return profile
+
+def is_youtube_url(url):
+    """驗證 URL 格式"""
+    return any(re.match(pattern, url) for pattern in YOUTUBE_URL_PATTERNS)
+
+def _download_progress_hook(job_id, scale=1.0, finished_message='下載完成，正在轉換音頻格式...', **fields):
+    """
+    建立 yt-dlp 進度回調，將下載進度送往工作頻道
+
+    Args:
+        job_id (str): 工作 ID
+        scale (float): 進度百分比的縮放比例（下載只是整個工作的一部分時使用）
+        finished_message (str): 下載完成時顯示的訊息
+        **fields: 每筆進度額外附帶的欄位
+    """
+    def progress_hook(d):
+        if d['status'] == 'downloading':
+            # 計算下載進度
+            if 'total_bytes' in d and d['total_bytes']:
+                percent = (d['downloaded_bytes'] / d['total_bytes']) * 100
+                percent = min(percent, 90)  # 最多顯示90%，留10%給後處理
+            elif 'total_bytes_estimate' in d and d['total_bytes_estimate']:
+                percent = (d['downloaded_bytes'] / d['total_bytes_estimate']) * 100
+                percent = min(percent, 90)
+            else:
+                # 如果沒有總大小資訊，使用下載速度作為進度指示
+                percent = min(d.get('downloaded_bytes', 0) / (1024 * 1024) * 10, 90)
+
+            # 格式化下載速度
+            speed = d.get('speed', 0)
+            if speed:
+                if speed > 1024 * 1024:
+                    speed_str = f"{speed / (1024 * 1024):.1f} MB/s"
+                elif speed > 1024:
+                    speed_str = f"{speed / 1024:.1f} KB/s"
+                else:
+                    speed_str = f"{speed:.0f} B/s"
+            else:
+                speed_str = "計算中..."
+
+            # 發送進度更新
+            progress.publish(job_id, {
+                'status': 'progress',
+                'progress': int(percent * scale),
+                'message': f'下載中... {int(percent)}% ({speed_str})',
+                **fields
+            })
+
+        elif d['status'] == 'finished':
+            # 下載完成，開始後處理
+            progress.publish(job_id, {
+                'status': 'progress',
+                'progress': int(95 * scale),
+                'message': finished_message,
+                **fields
+            })
+
+    return progress_hook
+
+def _download_error_message(error_msg):
+    """根據錯誤類型提供更詳細的錯誤資訊"""
+    if 'HTTP Error 403' in error_msg or 'Forbidden' in error_msg:
+        return '無法存取該影片，可能是私人影片或地區限制'
+    elif 'HTTP Error 404' in error_msg:
+        return '找不到該影片，請檢查連結是否正確'
+    elif 'blocked' in error_msg.lower() or 'restricted' in error_msg.lower():
+        return '該影片在您的地區被封鎖或受到限制'
+    elif 'timeout' in error_msg.lower() or 'connection' in error_msg.lower():
+        return '網路連接問題，請檢查網路狀態後重試'
+    elif 'unavailable' in error_msg.lower():
+        return '該影片目前無法使用'
+    return f'下載失敗: {error_msg}'
+
+def _create_download_job():
+    """建立下載工作；下載工作者都在忙時先顯示排隊中"""
+    job_id = progress.create_job('download_progress')
+    progress.publish(job_id, {
+        'status': 'progress',
+        'progress': 0,
+        'message': '排隊等待下載...'
+    })
+    return job_id
+
+def download_task(job_id, youtube_url):
+    """在下載工作者中執行下載並回報進度；成功時回傳 (音訊路徑, 標題)"""
+    started = time.perf_counter()
+
+    def record_download(status):
+        downloads_total.inc(status=status)
+        download_duration.observe(time.perf_counter() - started, status=status)
+
+    try:
+        # 發送開始下載的進度更新
+        progress.publish(job_id, {
+            'status': 'progress',
+            'progress': 0,
+            'message': '正在準備下載...'
+        })
+
+        # 發送分析進度
+        progress.publish(job_id, {
+            'status': 'progress',
+            'progress': 5,
+            'message': '正在分析影片資訊...'
+        })
+
+        # 執行下載，傳入進度回調
+        audio_path, title = downloader.download_audio(youtube_url, _download_progress_hook(job_id))
+
+        if audio_path:
+            # 發送完成進度
+            progress.publish(job_id, {
+                'status': 'progress',
+                'progress': 98,
+                'message': '正在驗證檔案...'
+            })
+
+            # 驗證檔案
+            if os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
+                record_download('completed')
+                progress.publish(job_id, _download_completed_payload(audio_path, title))
+                socketio.start_background_task(_generate_peaks_task, audio_path)
+                logger.info(f"Download completed successfully: {title} -> {audio_path}")
+                return audio_path, title
+            else:
+                record_download('failed')
+                progress.publish(job_id, {
+                    'status': 'failed',
+                    'error': '下載的檔案無效或損壞'
+                })
+        else:
+            record_download('failed')
+            progress.publish(job_id, {
+                'status': 'failed',
+                'error': '下載失敗，請檢查 YouTube 連結是否正確'
+            })
+
+    except Exception as e:
+        logger.error(f"Download error: {str(e)}")
+        record_download('failed')
+        progress.publish(job_id, {
+            'status': 'failed',
+            'error': _download_error_message(str(e))
+        })
+
 @app.route('/api/download', methods=['POST'])
 def download_music():
     """下載音樂"""
@@ -208,160 +801,184 @@ def download_music():
             return jsonify({'success': False, 'error': '缺少 YouTube URL'}), 400
         
         # 驗證 URL 格式
-        youtube_patterns = [
-            r'(?:https?://)?(?:www\.)?youtube\.com/watch\?v=[\w-]+',
-            r'(?:https?://)?(?:www\.)?youtu\.be/[\w-]+',
-            r'(?:https?://)?(?:www\.)?youtube\.com/embed/[\w-]+',
-            r'(?:https?://)?(?:www\.)?youtube\.com/v/[\w-]+',
-        ]
-        
-        if not any(re.match(pattern, youtube_url) for pattern in youtube_patterns):
+        if not is_youtube_url(youtube_url):
             return jsonify({'success': False, 'error': '請輸入有效的 YouTube 連結'}), 400
             
-        # 開始下載任務
-        def download_task():
-            try:
-                # 發送開始下載的進度更新
-                socketio.emit('download_progress', {
-                    'status': 'progress',
-                    'progress': 0,
-                    'message': '正在準備下載...'
-                })
-                
-                # 定義進度回調函數
-                def progress_hook(d):
-                    if d['status'] == 'downloading':
-                        # 計算下載進度
-                        if 'total_bytes' in d and d['total_bytes']:
-                            percent = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                            percent = min(percent, 90)  # 最多顯示90%，留10%給後處理
-                        elif 'total_bytes_estimate' in d and d['total_bytes_estimate']:
-                            percent = (d['downloaded_bytes'] / d['total_bytes_estimate']) * 100
-                            percent = min(percent, 90)
-                        else:
-                            # 如果沒有總大小資訊，使用下載速度作為進度指示
-                            percent = min(d.get('downloaded_bytes', 0) / (1024 * 1024) * 10, 90)
-                        
-                        # 格式化下載速度
-                        speed = d.get('speed', 0)
-                        if speed:
-                            if speed > 1024 * 1024:
-                                speed_str = f"{speed / (1024 * 1024):.1f} MB/s"
-                            elif speed > 1024:
-                                speed_str = f"{speed / 1024:.1f} KB/s"
-                            else:
-                                speed_str = f"{speed:.0f} B/s"
-                        else:
-                            speed_str = "計算中..."
-                        
-                        # 發送進度更新
-                        socketio.emit('download_progress', {
-                            'status': 'progress',
-                            'progress': int(percent),
-                            'message': f'下載中... {int(percent)}% ({speed_str})'
-                        })
-                        
-                    elif d['status'] == 'finished':
-                        # 下載完成，開始後處理
-                        socketio.emit('download_progress', {
-                            'status': 'progress',
-                            'progress': 95,
-                            'message': '下載完成，正在轉換音頻格式...'
-                        })
-                
-                # 測試連接
-                logger.info(f"Testing connection before download: {youtube_url}")
-                if not downloader.test_connection():
-                    socketio.emit('download_progress', {
-                        'status': 'failed',
-                        'error': '無法連接到 YouTube，請檢查網路連接'
-                    })
-                    return
-                
-                # 發送分析進度
-                socketio.emit('download_progress', {
-                    'status': 'progress',
-                    'progress': 5,
-                    'message': '正在分析影片資訊...'
-                })
-                
-                # 執行下載，傳入進度回調
-                audio_path, title = downloader.download_audio(youtube_url, progress_hook)
-                
-                if audio_path:
-                    # 發送完成進度
-                    socketio.emit('download_progress', {
-                        'status': 'progress',
-                        'progress': 98,
-                        'message': '正在驗證檔案...'
-                    })
-                    
-                    # 驗證檔案
-                    if os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
-                        # 獲取音訊時長
-                        duration = None
-                        try:
-                            import librosa
-                            y, sr = librosa.load(audio_path, sr=None)
-                            duration_seconds = len(y) / sr
-                            duration = f"{int(duration_seconds//60)}:{int(duration_seconds%60):02d}"
-                        except:
-                            duration = None
-                        
-                        socketio.emit('download_progress', {
-                            'status': 'completed',
-                            'title': title,
-                            'path': audio_path,
-                            'audio_path': audio_path,  # 添加 audio_path 字段
-                            'filename': os.path.basename(audio_path),  # 添加 filename 字段
-                            'duration': duration,  # 添加 duration 字段
-                            'progress': 100
-                        })
-                        logger.info(f"Download completed successfully: {title} -> {audio_path}")
-                    else:
-                        socketio.emit('download_progress', {
-                            'status': 'failed',
-                            'error': '下載的檔案無效或損壞'
-                        })
-                else:
-                    socketio.emit('download_progress', {
-                        'status': 'failed',
-                        'error': '下載失敗，請檢查 YouTube 連結是否正確'
-                    })
-                    
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"Download error: {error_msg}")
-                
-                # 根據錯誤類型提供更詳細的錯誤資訊
-                if 'HTTP Error 403' in error_msg or 'Forbidden' in error_msg:
-                    user_error = '無法存取該影片，可能是私人影片或地區限制'
-                elif 'HTTP Error 404' in error_msg:
-                    user_error = '找不到該影片，請檢查連結是否正確'
-                elif 'blocked' in error_msg.lower() or 'restricted' in error_msg.lower():
-                    user_error = '該影片在您的地區被封鎖或受到限制'
-                elif 'timeout' in error_msg.lower() or 'connection' in error_msg.lower():
-                    user_error = '網路連接問題，請檢查網路狀態後重試'
-                elif 'unavailable' in error_msg.lower():
-                    user_error = '該影片目前無法使用'
-                else:
-                    user_error = f'下載失敗: {error_msg}'
-                
-                socketio.emit('download_progress', {
-                    'status': 'failed',
-                    'error': user_error
-                })
-        
-        thread = threading.Thread(target=download_task)
-        thread.daemon = True
-        thread.start()
+        # 已下載過的影片直接回報完成，不再重新下載
+        cached = download_manager.get_cached(youtube_url)
+        if cached is not None:
+            cache_requests.inc(cache='download', result='hit')
+            job_id = progress.create_job('download_progress')
+            progress.publish(job_id, _download_completed_payload(cached['audio_path'], cached['title']))
+            return jsonify({'success': True, 'message': '已下載過此影片', 'job_id': job_id, 'cached': True})
+        cache_requests.inc(cache='download', result='miss')
+        
+        # 開始下載任務（進度送往此工作的頻道，客戶端以 subscribe_job 訂閱）；
+        # 同一部影片正在下載時回傳原本的 job_id
+        try:
+            job_id, created = download_manager.submit(youtube_url, _create_download_job, download_task)
+        except DownloadQueueFull:
+            return jsonify({'success': False, 'error': '目前下載工作過多，請稍後再試'}), 503
         
-        return jsonify({'success': True, 'message': '開始下載，請稍候...'})
+        message = '開始下載，請稍候...' if created else '此影片正在下載中，已加入相同的下載工作'
+        return jsonify({'success': True, 'message': message, 'job_id': job_id})
         
     except Exception as e:
         logger.error(f"Download API error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _create_pipeline_job():
+    """建立一鍵產生譜面工作；下載工作者都在忙時先顯示排隊中"""
+    job_id = progress.create_job('pipeline_progress')
+    progress.publish(job_id, {
+        'status': 'progress',
+        'stage': 'queued',
+        'progress': 0,
+        'message': '排隊等待下載...'
+    })
+    return job_id
+
+def pipeline_task(job_id, youtube_url, method='balanced_beat', song_title=None, requested=None, profile=None):
+    """
+    一鍵產生譜面的下載階段（在下載工作者中執行）
+
+    保留原始音訊格式不轉 wav，下載完成後交給分析階段；
+    回傳 (原始音訊路徑, 標題) 供下載記錄使用，失敗時回傳 None
+    """
+    requested = requested or time.perf_counter()
+    started = time.perf_counter()
+    error = '下載失敗，請檢查 YouTube 連結是否正確'
+    try:
+        progress.publish(job_id, {
+            'status': 'progress',
+            'stage': 'download',
+            'progress': 2,
+            'message': '正在分析影片資訊...'
+        })
+        # 下載佔整體進度的 60%
+        hook = _download_progress_hook(job_id, scale=0.6, finished_message='下載完成', stage='download')
+        audio_path, title = downloader.download_audio(youtube_url, hook, extract_audio=False)
+    except Exception as e:
+        logger.error(f"Pipeline download error: {str(e)}")
+        audio_path, title = None, None
+        error = _download_error_message(str(e))
+    
+    status = 'completed' if audio_path else 'failed'
+    downloads_total.inc(status=status)
+    download_duration.observe(time.perf_counter() - started, status=status)
+    if not audio_path:
+        progress.publish(job_id, {'status': 'failed', 'stage': 'download', 'error': error})
+        pipeline_duration.observe(time.perf_counter() - requested, status='failed')
+        return None
+    
+    socketio.start_background_task(
+        _run_pipeline_analysis, job_id, youtube_url, audio_path, song_title or title, method, requested,
+        {'download': time.perf_counter() - started}, profile or ANALYSIS_PROFILE)
+    return audio_path, title
+
+def _run_pipeline_analysis(job_id, youtube_url, audio_path, title, method, requested, timings, profile=None):
+    """一鍵產生譜面的分析階段：解碼、分析、轉檔與儲存都在同一個分析工作中完成"""
+    status = 'failed'
+    try:
+        progress.publish(job_id, {
+            'status': 'progress',
+            'stage': 'analyze',
+            'progress': 65,
+            'message': f'正在使用 {method} 方法分析音訊...'
+        })
+        
+        chart_data, chart_path, served_path, stage_timings = analysis_executor.run(
+            pipeline_chart_job,
+            audio_path,
+            song_title=title,
+            method=method,
+            preview_cache=preview_cache,
+            segment_workers=SEGMENT_WORKERS,
+            profile=profile or ANALYSIS_PROFILE
+        )
+        timings.update(stage_timings)
+        if served_path != audio_path:
+            # 原始檔已轉檔並刪除，下載記錄改指向轉檔後的檔案
+            download_manager.remember(youtube_url, served_path, title)
+        
+        if chart_data:
+            status = 'completed'
+            duration = chart_data.get('duration')
+            progress.publish(job_id, {
+                'status': 'completed',
+                'stage': 'done',
+                'progress': 100,
+                'title': title,
+                'chart_path': chart_path,
+                'audio_path': served_path,
+                'filename': os.path.basename(served_path),
+                'duration': f"{int(duration//60)}:{int(duration%60):02d}" if duration else None,
+                'note_count': chart_data.get('note_count'),
+                'method_used': method,
+                'profile': chart_data.get('analysis_profile'),
+                'timings': {stage: round(seconds, 3) for stage, seconds in timings.items()},
+                'elapsed': round(time.perf_counter() - requested, 3)
+            })
+            logger.info(f"Pipeline completed: {title} -> {chart_path}")
+        else:
+            progress.publish(job_id, {'status': 'failed', 'stage': 'analyze', 'error': '譜面產生失敗'})
+            
+    except Exception as e:
+        logger.error(f"Pipeline analysis error: {str(e)}")
+        progress.publish(job_id, {'status': 'failed', 'stage': 'analyze', 'error': str(e)})
+    finally:
+        for stage, seconds in timings.items():
+            pipeline_stage_duration.observe(seconds, stage=stage)
+        pipeline_duration.observe(time.perf_counter() - requested, status=status)
+
+@app.route('/api/pipeline', methods=['POST'])
+def chart_pipeline():
+    """一鍵產生譜面：下載 → 解碼 → 分析 → 儲存譜面，整個流程只有一個進度頻道"""
+    try:
+        data = request.get_json() or {}
+        youtube_url = data.get('url')
+        song_title = data.get('song_title')
+        method = data.get('method', 'balanced_beat')
+        profile = resolve_profile(data.get('profile'))
+        
+        if not youtube_url:
+            return jsonify({'success': False, 'error': '缺少 YouTube URL'}), 400
+        if not is_youtube_url(youtube_url):
+            return jsonify({'success': False, 'error': '請輸入有效的 YouTube 連結'}), 400
+        if method not in CHART_METHODS:
+            logger.warning(f"Unsupported method '{method}', using default 'balanced_beat'")
+            method = 'balanced_beat'
+        
+        requested = time.perf_counter()
+        
+        # 已下載過的影片跳過下載，直接分析
+        cached = download_manager.get_cached(youtube_url)
+        if cached is not None:
+            cache_requests.inc(cache='download', result='hit')
+            job_id = progress.create_job('pipeline_progress')
+            socketio.start_background_task(
+                _run_pipeline_analysis, job_id, youtube_url, cached['audio_path'],
+                song_title or cached['title'], method, requested, {}, profile)
+            return jsonify({'success': True, 'message': '已下載過此影片，開始產生譜面...', 'job_id': job_id, 'cached': True})
+        cache_requests.inc(cache='download', result='miss')
+        
+        try:
+            job_id, created = download_manager.submit(
+                youtube_url,
+                _create_pipeline_job,
+                lambda job_id, url: pipeline_task(job_id, url, method, song_title, requested, profile),
+                kind='pipeline'
+            )
+        except DownloadQueueFull:
+            return jsonify({'success': False, 'error': '目前下載工作過多，請稍後再試'}), 503
+        
+        message = '開始下載並產生譜面...' if created else '此影片正在處理中，已加入相同的工作'
+        return jsonify({'success': True, 'message': message, 'job_id': job_id})
+        
+    except Exception as e:
+        logger.error(f"Pipeline API error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/upload_music', methods=['POST'])
 def upload_music():
     """上傳音樂檔案"""
@@ -417,19 +1034,17 @@ def upload_music():
         
         # 嘗試獲取音訊資訊
         duration = None
-        try:
-            import librosa
-            y, sr = librosa.load(str(file_path), sr=None)
-            duration_seconds = len(y) / sr
+        duration_seconds = get_audio_duration(file_path)
+        if duration_seconds:
             duration = f"{int(duration_seconds//60)}:{int(duration_seconds%60):02d}"
-        except Exception as e:
-            logger.warning(f"無法獲取音訊時長: {e}")
-            duration = None
+        else:
+            logger.warning(f"無法獲取音訊時長: {file_path}")
         
         # 生成標題（去除副檔名）
         title = file_path.stem
         
         logger.info(f"File uploaded successfully: {filename} -> {file_path}")
+        socketio.start_background_task(_generate_peaks_task, file_path.as_posix())
         
         return jsonify({
             'success': True,
@@ -457,13 +1072,7 @@ def get_audio_files():
             file_size = file_path.stat().st_size if file_path.exists() else 0
             
             # 嘗試獲取音訊時長
-            duration = None
-            try:
-                import librosa
-                y, sr = librosa.load(str(file_path), sr=None)
-                duration = len(y) / sr
-            except:
-                duration = None
+            duration = get_cached_audio_duration(file_path) if file_path.exists() else None
             
             files_info.append({
                 'title': file_path.stem,  # 使用檔案名稱作為標題
@@ -482,58 +1091,94 @@ def get_audio_files():
 
 @app.route('/api/generate_chart', methods=['POST'])
 def generate_chart():
-    """產生譜面"""
+    """
+    產生譜面
+
+    同時提供 start 與 end（秒）時只產生該範圍的練習譜面（只解碼該範圍，附帶練習音訊片段）
+    """
     try:
         data = request.get_json()
         audio_path = data.get('audio_path')
         song_title = data.get('song_title')
         method = data.get('method', 'balanced_beat')  # 預設使用新的平衡節拍方法
+        profile = resolve_profile(data.get('profile'))
         
         if not audio_path:
             return jsonify({'success': False, 'error': '缺少音訊檔案路徑'}), 400
+        
+        section = None
+        if data.get('start') is not None or data.get('end') is not None:
+            try:
+                section = (float(data.get('start', 0)), float(data['end']))
+            except (KeyError, TypeError, ValueError):
+                return jsonify({'success': False, 'error': '練習範圍需要數字的 start 與 end（秒）'}), 400
+            if section[0] < 0 or section[1] <= section[0]:
+                return jsonify({'success': False, 'error': '練習範圍的 end 必須大於 start'}), 400
             
         # 驗證方法是否支援
-        supported_methods = ['balanced_beat', 'energy', 'energy_analysis']
-        if method not in supported_methods:
+        if method not in CHART_METHODS:
             logger.warning(f"Unsupported method '{method}', using default 'balanced_beat'")
             method = 'balanced_beat'
             
+        job_id = progress.create_job('chart_progress')
+        
         def generate_task():
+            started = time.perf_counter()
+            status = 'failed'
             try:
-                socketio.emit('chart_progress', {'status': 'analyzing', 'message': f'正在使用 {method} 方法分析音訊...'})
+                progress.publish(job_id, {'status': 'analyzing', 'message': f'正在使用 {method} 方法分析音訊...'})
                 
-                chart_data = analyzer.generate_chart(
-                    audio_path,
-                    song_title=song_title,
-                    method=method
-                )
+                if section is not None:
+                    chart_data, chart_path, stage_timings = analysis_executor.run(
+                        section_chart_job,
+                        audio_path,
+                        *section,
+                        song_title=song_title,
+                        method=method,
+                        segment_workers=SEGMENT_WORKERS,
+                        profile=profile
+                    )
+                else:
+                    chart_data, chart_path, stage_timings = analysis_executor.run(
+                        generate_chart_job,
+                        audio_path,
+                        song_title=song_title,
+                        method=method,
+                        preview_cache=preview_cache,
+                        segment_workers=SEGMENT_WORKERS,
+                        profile=profile
+                    )
+                for stage, seconds in stage_timings.items():
+                    chart_stage_duration.observe(seconds, stage=stage)
                 
                 if chart_data:
-                    chart_path = analyzer.save_chart(chart_data)
-                    socketio.emit('chart_progress', {
+                    status = 'completed'
+                    progress.publish(job_id, {
                         'status': 'completed',
                         'chart_data': chart_data,
                         'chart_path': chart_path,
-                        'method_used': method
+                        'method_used': method,
+                        'profile': profile,
+                        'timings': {stage: round(seconds, 3) for stage, seconds in stage_timings.items()}
                     })
                 else:
-                    socketio.emit('chart_progress', {
+                    progress.publish(job_id, {
                         'status': 'failed',
                         'error': '譜面產生失敗'
                     })
                     
             except Exception as e:
                 logger.error(f"Chart generation error: {str(e)}")
-                socketio.emit('chart_progress', {
+                progress.publish(job_id, {
                     'status': 'failed',
                     'error': str(e)
                 })
+            finally:
+                chart_job_duration.observe(time.perf_counter() - started, method=method, status=status)
         
-        thread = threading.Thread(target=generate_task)
-        thread.daemon = True
-        thread.start()
+        socketio.start_background_task(generate_task)
         
-        return jsonify({'success': True, 'message': f'開始使用 {method} 方法產生譜面...'})
+        return jsonify({'success': True, 'message': f'開始使用 {method} 方法產生譜面...', 'job_id': job_id})
         
     except Exception as e:
         logger.error(f"Generate chart error: {str(e)}")
@@ -548,15 +1193,44 @@ def get_charts():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def resolve_chart_path(chart_id):
+    """
+    將譜面 ID 轉為譜面檔案路徑
+
+    接受完整路徑（rhythm_game/charts/...）或檔名；路徑必須位於譜面資料夾內，否則回傳 None
+    """
+    if chart_id == CALIBRATION_CHART_ID:
+        return chart_id
+    # 如果傳入的是完整路徑，直接使用；否則建構路徑
+    if chart_id.startswith('rhythm_game/charts/'):
+        chart_path = chart_id
+    else:
+        chart_path = f"rhythm_game/charts/{chart_id}"
+    charts_dir = chart_manager.charts_dir.resolve()
+    if charts_dir not in Path(chart_path).resolve().parents:
+        return None
+    return chart_path
+
 @app.route('/api/chart/<path:chart_id>', methods=['GET'])
 def get_chart(chart_id):
-    """獲取特定譜面資料"""
+    """
+    獲取特定譜面資料
+
+    加上 ?notes=0 時只回傳譜面標頭，音符改由 Socket.IO request_notes 分段取得
+    """
     try:
-        # 如果傳入的是完整路徑，直接使用；否則建構路徑
-        if chart_id.startswith('rhythm_game/charts/'):
-            chart_path = chart_id
-        else:
-            chart_path = f"rhythm_game/charts/{chart_id}"
+        chart_path = resolve_chart_path(chart_id)
+        if chart_path is None:
+            return jsonify({'success': False, 'error': '譜面不存在'}), 404
+        
+        if request.args.get('notes') == '0':
+            header = chart_streamer.get_header(chart_path)
+            if header is None:
+                return jsonify({'success': False, 'error': '譜面不存在'}), 404
+            return jsonify({'success': True, 'chart': header})
+        
+        if chart_path == CALIBRATION_CHART_ID:
+            return jsonify({'success': True, 'chart': create_calibration_chart()})
         
         logger.info(f"Loading chart from path: {chart_path}")
         chart_data = chart_manager.load_chart(chart_path)
@@ -571,6 +1245,71 @@ def get_chart(chart_id):
         logger.error(f"Error loading chart: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _page_args():
+    """分頁參數：limit（1-100，預設 20）與 cursor"""
+    limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    return limit, request.args.get('cursor') or None
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """譜面排行榜（每位玩家的最佳成績）"""
+    if score_store is None:
+        return jsonify({'success': False, 'error': '成績記錄已停用'}), 503
+    chart_id = request.args.get('chart')
+    if not chart_id:
+        return jsonify({'success': False, 'error': '缺少譜面參數 chart'}), 400
+    try:
+        limit, cursor = _page_args()
+        return jsonify({'success': True, **score_store.get_leaderboard(chart_id, limit, cursor)})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/scores/recent', methods=['GET'])
+def get_recent_scores():
+    """最近的遊玩紀錄，可依譜面（chart）或玩家（player）篩選"""
+    if score_store is None:
+        return jsonify({'success': False, 'error': '成績記錄已停用'}), 503
+    try:
+        limit, cursor = _page_args()
+        page = score_store.get_recent_plays(
+            chart_id=request.args.get('chart'),
+            player_id=request.args.get('player'),
+            limit=limit,
+            cursor=cursor
+        )
+        return jsonify({'success': True, **page})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/scores/best', methods=['GET'])
+def get_personal_bests():
+    """玩家在各譜面的最佳成績與名次"""
+    if score_store is None:
+        return jsonify({'success': False, 'error': '成績記錄已停用'}), 503
+    player_id = request.args.get('player')
+    if not player_id:
+        return jsonify({'success': False, 'error': '缺少玩家參數 player'}), 400
+    try:
+        limit, cursor = _page_args()
+        page = score_store.get_personal_bests(player_id, request.args.get('chart'), limit, cursor)
+        return jsonify({'success': True, **page})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/server/transport', methods=['GET'])
+def get_transport():
+    """Socket.IO 封包格式，客戶端據此選擇 parser"""
+    return jsonify({
+        'serializer': 'msgpack' if SOCKET_SERIALIZER == 'msgpack' else 'json',
+        # msgpack 以 bin 型別傳送位元組，音符可直接打包為 typed array
+        'packed_notes': SOCKET_SERIALIZER == 'msgpack'
+    })
+
+@app.route('/api/server/sessions', methods=['GET'])
+def get_session_metrics():
+    """獲取遊戲會話統計"""
+    return jsonify({'success': True, 'sessions': game_sessions.get_metrics()})
+
 @app.route('/api/audio/<path:filename>')
 def serve_audio(filename):
     """提供音樂檔案"""
@@ -580,6 +1319,69 @@ def serve_audio(filename):
     except FileNotFoundError:
         return jsonify({'error': 'File not found'}), 404
 
+def _delete_audio_sidecars(audio_path):
+    """刪除音訊檔旁的衍生檔案（波形峰值、練習音訊片段）"""
+    peaks_path(audio_path).unlink(missing_ok=True)
+    for clip in practice_clips(audio_path):
+        clip.unlink(missing_ok=True)
+
+def _generate_peaks_task(audio_path):
+    """在分析行程中產生波形峰值檔（失敗只記錄，不影響上傳或下載結果）"""
+    try:
+        analysis_executor.run(generate_peaks, audio_path)
+    except Exception as e:
+        logger.warning(f"Waveform peaks failed for {audio_path}: {e}")
+
+@app.route('/api/waveform/<path:filename>')
+def serve_waveform(filename):
+    """
+    提供音訊的多解析度波形峰值（二進位，格式見 rhythm_game/src/waveform.py）
+
+    支援 Range 與 ETag：客戶端可先取得標頭與層級表，再只請求需要的層級。
+    峰值檔不存在或比音訊舊時當場產生。
+    """
+    audio_dir = Path("rhythm_game/assets")
+    audio_path = safe_join(str(audio_dir), filename)
+    if audio_path is None or not os.path.isfile(audio_path) or filename.endswith('.peaks'):
+        return jsonify({'error': 'File not found'}), 404
+    
+    if peaks_stale(audio_path):
+        cache_requests.inc(cache='waveform', result='miss')
+        try:
+            analysis_executor.run(generate_peaks, audio_path)
+        except Exception as e:
+            logger.error(f"Waveform peaks error: {str(e)}")
+            return jsonify({'error': '無法產生波形資料'}), 500
+    else:
+        cache_requests.inc(cache='waveform', result='hit')
+    
+    return send_from_directory(audio_dir, peaks_path(filename).as_posix(), mimetype='application/octet-stream')
+
+@app.route('/api/preview/<path:filename>')
+def serve_preview(filename):
+    """
+    提供音訊的試聽片段（約 20 秒的 MP3，選在能量與 onset 最強的段落）
+
+    片段依音訊內容雜湊快取，沒有時當場產生；支援 Range 與 ETag。
+    """
+    audio_dir = Path("rhythm_game/assets")
+    audio_path = safe_join(str(audio_dir), filename)
+    if audio_path is None or not os.path.isfile(audio_path) or filename.endswith('.peaks'):
+        return jsonify({'error': 'File not found'}), 404
+    
+    preview_path = preview_cache.get(audio_path)
+    if preview_path is not None:
+        cache_requests.inc(cache='preview', result='hit')
+    else:
+        cache_requests.inc(cache='preview', result='miss')
+        try:
+            preview_path = analysis_executor.run(preview_cache.generate, audio_path)
+        except Exception as e:
+            logger.error(f"Preview error: {str(e)}")
+            return jsonify({'error': '無法產生試聽片段'}), 500
+    
+    return send_from_directory(preview_cache.cache_dir, preview_path.name, mimetype='audio/mpeg', max_age=3600)
+
 @app.route('/api/delete_audio', methods=['DELETE'])
 def delete_audio():
     """刪除音樂檔案及其相關譜面"""
@@ -600,6 +1402,7 @@ def delete_audio():
         
         # 刪除音樂檔案
         full_audio_path.unlink()
+        _delete_audio_sidecars(full_audio_path)
         
         # 查找並刪除相關的譜面檔案
         audio_filename = os.path.splitext(os.path.basename(audio_path))[0]
@@ -637,9 +1440,10 @@ def delete_all_audio():
         # 刪除所有音樂檔案
         if music_dir.exists():
             for audio_file in music_dir.glob("*"):
-                if audio_file.suffix.lower() in ['.mp3', '.wav', '.m4a', '.webm']:
+                if audio_file.suffix.lower() in ['.mp3', '.wav', '.m4a', '.webm', '.flac']:
                     try:
                         audio_file.unlink()
+                        _delete_audio_sidecars(audio_file)
                         deleted_count += 1
                     except OSError:
                         pass
@@ -688,6 +1492,7 @@ def delete_audio_files():
                 if full_audio_path.exists():
                     # 刪除音樂檔案
                     full_audio_path.unlink()
+                    _delete_audio_sidecars(full_audio_path)
                     deleted_count += 1
                     logger.info(f"Deleted audio file: {full_audio_path}")
                     
@@ -823,21 +1628,38 @@ def delete_all_charts():
 # SocketIO 事件處理
 
 @socketio.on('connect')
-def handle_connect():
+@socket_event_duration.time(event='connect')
+def handle_connect(auth=None):
     """客戶端連接"""
     logger.info(f"Client connected: {request.sid}")
     emit('connected', {'message': '連接成功'})
 
 @socketio.on('disconnect')
+@socket_event_duration.time(event='disconnect')
 def handle_disconnect():
     """客戶端斷開連接"""
     logger.info(f"Client disconnected: {request.sid}")
     
-    # 清理遊戲會話
-    if request.sid in game_sessions:
-        del game_sessions[request.sid]
+    # 清理遊戲會話（寫出尚未寫入的重播紀錄）
+    session = game_sessions.remove(request.sid)
+    if session is not None and session.replay is not None:
+        session.replay.close()
+
+@socketio.on('subscribe_job')
+@socket_event_duration.time(event='subscribe_job')
+def handle_subscribe_job(data):
+    """訂閱下載 / 譜面產生工作的進度，並立即送出目前狀態"""
+    job_id = (data or {}).get('job_id')
+    if not job_id:
+        return
+    join_room(job_room(job_id))
+    snapshot = progress.snapshot(job_id)
+    if snapshot is not None:
+        event, payload = snapshot
+        emit(event, payload)
 
 @socketio.on('start_game')
+@socket_event_duration.time(event='start_game')
 def handle_start_game(data):
     """開始遊戲"""
     try:
@@ -850,21 +1672,48 @@ def handle_start_game(data):
             emit('game_error', {'error': '缺少譜面路徑'})
             return
         
-        # 創建遊戲會話
+        # 滿載時在載入譜面之前拒絕，被拒絕的連線不必負擔載入成本
+        if not game_sessions.has_capacity(request.sid):
+            logger.warning(f"Rejected start_game for {request.sid}: server at capacity")
+            emit('game_error', {'error': '伺服器目前遊戲人數已滿，請稍後再試', 'code': 'server_full'})
+            return
+        
+        # 創建遊戲會話（重新開始時沿用已有的時鐘同步結果與時間偏移樣本）
         session = WebGameSession(request.sid)
+        previous = game_sessions.get(request.sid)
+        if previous is not None:
+            session.clock = previous.clock
+            session.timing = previous.timing
+            if previous.replay is not None:
+                previous.replay.close()
+        
+        # 裝置開啟自動校準時套用已儲存的延遲補償（格式不正確的裝置 ID 不記錄校準與成績）
+        device_id = data.get('device_id')
+        session.device_id = device_id if is_valid_device_id(device_id) else None
+        session.input_offset = calibration_store.get_applied_offset(session.device_id)
+        session.player_name = (data.get('player_name') or '').strip()[:32] or None
         
         logger.info(f"Created session for {request.sid}")
         
         if session.load_chart(chart_path):
             logger.info(f"Chart loaded successfully: {session.chart_data['song_title']} with {len(session.chart_data['notes'])} notes")
             
-            game_sessions[request.sid] = session
+            if not game_sessions.add(request.sid, session):
+                logger.warning(f"Rejected start_game for {request.sid}: server at capacity")
+                emit('game_error', {'error': '伺服器目前遊戲人數已滿，請稍後再試', 'code': 'server_full'})
+                return
             session.start_game()
+            game_sessions.save(request.sid, flush=True)
             
+            # 只送出譜面 ID 與標頭，音符由客戶端以 request_notes 依播放進度請求
             emit('game_started', {
-                'chart_data': session.chart_data,
-                'start_time': session.start_time
+                'chart_id': chart_path,
+                'chart': chart_streamer.get_header(chart_path),
+                'start_time': session.start_time,
+                'input_offset': session.input_offset
             })
+            # 開局時連續取樣以建立時鐘偏移估計
+            emit('clock_ping', session.clock.create_ping())
             
             logger.info(f"Game started successfully for session {request.sid}")
         else:
@@ -875,9 +1724,32 @@ def handle_start_game(data):
         logger.error(f"Error starting game: {str(e)}")
         emit('game_error', {'error': str(e)})
 
+@socketio.on('request_notes')
+@socket_event_duration.time(event='request_notes')
+def handle_request_notes(data):
+    """回傳譜面在 [start, end) 時間視窗內的音符（精簡編碼）"""
+    try:
+        chart_path = resolve_chart_path(str((data or {}).get('chart_id') or ''))
+        start = data.get('start')
+        end = data.get('end')
+        window = chart_streamer.get_window(
+            chart_path,
+            float(start) if start is not None else None,
+            float(end) if end is not None else None,
+            packed=bool(data.get('packed'))
+        ) if chart_path else None
+        if window is None:
+            emit('game_error', {'error': '譜面不存在'})
+            return
+        emit('chart_notes', window)
+    except (TypeError, ValueError) as e:
+        emit('game_error', {'error': str(e)})
+
 @socketio.on('hit_note')
+@socket_event_duration.time(event='hit_note')
 def handle_hit_note(data):
     """處理音符擊中"""
+    received_at = time.monotonic()
     try:
         session = game_sessions.get(request.sid)
         if not session:
@@ -887,7 +1759,8 @@ def handle_hit_note(data):
         lane = data.get('lane')
         hit_time = data.get('time')
         
-        result = session.hit_note(lane, hit_time)
+        result = session.hit_note(lane, hit_time, client_ts=data.get('client_ts'), received_at=received_at)
+        game_sessions.save(request.sid)
         
         # 獲取目前統計資訊
         stats = session.game_stats.to_dict()
@@ -902,9 +1775,14 @@ def handle_hit_note(data):
             'max_combo': stats['max_combo'],  # 單獨發送 max_combo
             'accuracy': stats['accuracy'],
             'judgments': stats['judgments'],
-            'note_time': data.get('note_time', hit_time)  # 添加 note_time 字段
+            'note_time': data.get('note_time', hit_time),  # 添加 note_time 字段
+            'offset': result.get('offset')  # 帶正負號的時間差，正值表示太晚
         })
         
+        # 定期重新同步時鐘
+        if session.clock.needs_ping(received_at):
+            emit('clock_ping', session.clock.create_ping())
+        
     except Exception as e:
         logger.error(f"Error in handle_hit_note: {str(e)}")
         emit('game_error', {'error': str(e)})
@@ -915,6 +1793,7 @@ def handle_hit_note(data):
 
 
 @socketio.on('auto_miss')
+@socket_event_duration.time(event='auto_miss')
 def handle_auto_miss(data):
     """處理自動 MISS（音符未擊中）"""
     try:
@@ -940,6 +1819,9 @@ def handle_auto_miss(data):
 
         # 更新統計資料
         session.game_stats.add_judgment('miss')
+        if note_time is not None:
+            session.record_input(lane, KIND_AUTO_MISS, note_time)
+        game_sessions.save(request.sid)
 
         # 取得最新統計
         stats = session.game_stats.to_dict()
@@ -956,36 +1838,99 @@ def handle_auto_miss(data):
             'note_time': note_time
         })
 
+        if session.clock.needs_ping():
+            emit('clock_ping', session.clock.create_ping())
+
     except Exception as e:
         logger.error(f"Error in handle_auto_miss: {str(e)}")
         emit('game_error', {'error': str(e)})
 
 @socketio.on('pause_game')
-def handle_pause_game():
+@socket_event_duration.time(event='pause_game')
+def handle_pause_game(data=None):
     """暫停遊戲"""
+    received_at = time.monotonic()
     session = game_sessions.get(request.sid)
     if session:
-        session.pause_game()
+        session.pause_game((data or {}).get('client_ts'), received_at)
+        game_sessions.save(request.sid, flush=True)
         emit('game_paused')
 
 @socketio.on('resume_game')
-def handle_resume_game():
+@socket_event_duration.time(event='resume_game')
+def handle_resume_game(data=None):
     """恢復遊戲"""
+    received_at = time.monotonic()
     session = game_sessions.get(request.sid)
     if session:
-        session.resume_game()
+        session.resume_game((data or {}).get('client_ts'), received_at)
+        game_sessions.save(request.sid, flush=True)
         emit('game_resumed')
 
+@socketio.on('clock_pong')
+@socket_event_duration.time(event='clock_pong')
+def handle_clock_pong(data):
+    """時鐘同步回覆"""
+    received_at = time.monotonic()
+    session = game_sessions.get(request.sid)
+    if not session or not data:
+        return
+    
+    if session.clock.handle_pong(data.get('id'), data.get('client_time'), received_at):
+        session.refresh_anchor()
+    if session.clock.needs_ping(received_at):
+        emit('clock_ping', session.clock.create_ping())
+
+@socketio.on('audio_started')
+@socket_event_duration.time(event='audio_started')
+def handle_audio_started(data):
+    """客戶端音樂開始播放，以其時間戳記校準遊戲起點"""
+    received_at = time.monotonic()
+    session = game_sessions.get(request.sid)
+    if session and data:
+        session.anchor_start(data.get('client_ts'), received_at)
+        game_sessions.save(request.sid)
+
 @socketio.on('end_game')
+@socket_event_duration.time(event='end_game')
 def handle_end_game():
     """結束遊戲"""
     session = game_sessions.get(request.sid)
     if session:
+        was_playing = session.is_playing
         session.end_game()
+        game_sessions.save(request.sid, flush=True)
         results = session.game_stats.to_dict()
-        emit('game_ended', {'results': results})
+        calibration = session.timing.to_dict()
+        calibration['applied_offset'] = session.input_offset
+        calibration['saved'] = False
+        
+        # 校準模式只要樣本足夠就儲存；一般遊戲需等估計值收斂才更新
+        recommended = session.timing.recommended_offset
+        if was_playing and session.device_id and recommended is not None and \
+                (session.is_calibration or session.timing.is_stable):
+            calibration_store.update(session.device_id, offset=recommended, samples=session.timing.total)
+            calibration['saved'] = True
+            logger.info(f"Calibration for device {session.device_id}: {recommended * 1000:+.1f}ms")
+        
+        # 成績寫入排行榜（放入背景寫入佇列，不等待資料庫）
+        if was_playing and score_store is not None and session.device_id and not session.is_calibration:
+            max_score = session.chart_data.get('max_score') if session.chart_data else None
+            if max_score is None and session.chart_data:
+                max_score = session.score_calculator.calculate_max_score(len(session.chart_data['notes']))
+            score_store.submit(
+                session.chart_path, session.device_id, results,
+                player_name=session.player_name,
+                max_score=max_score,
+                input_offset=session.input_offset,
+                session_id=session.session_id,
+                played_at=session.start_time
+            )
+        
+        emit('game_ended', {'results': results, 'calibration': calibration})
 
 @socketio.on('get_game_state')
+@socket_event_duration.time(event='get_game_state')
 def handle_get_game_state():
     """獲取遊戲狀態"""
     session = game_sessions.get(request.sid)
@@ -994,6 +1939,9 @@ def handle_get_game_state():
             'is_playing': session.is_playing,
             'is_paused': session.is_paused,
             'current_time': session.get_current_time(),
+            'clock': session.clock.get_stats(),
+            'timing': session.timing.to_dict(),
+            'input_offset': session.input_offset,
             'stats': session.game_stats.to_dict() if session.game_stats else None
         })
 
@@ -1003,6 +1951,9 @@ if __name__ == '__main__':
     Path("rhythm_game/charts").mkdir(parents=True, exist_ok=True)
     Path("static").mkdir(parents=True, exist_ok=True)
     
+    # 分析行程在背景暖機，完成前 /api/ready 回傳 503
+    start_services()
+
     # 啟動開發伺服器
     logger.info("🎵 啟動RhythmeForge Web 伺服器...")
     socketio.run(app, debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -1,26 +1,112 @@
 import librosa
 import numpy as np
 import json
-import matplotlib.pyplot as plt
+import time
 from pathlib import Path
 import soundfile as sf
 import random
 
+try:
+    from rhythm_game.src.utils import ScoreCalculator, get_audio_duration, format_time
+    from rhythm_game.src.stages import StageGraph
+    from rhythm_game.src.detectors import (
+        ANALYSIS_PROFILES, DEFAULT_PROFILE, ONSET_PRESETS, get_onset_backend, get_beat_backend
+    )
+    from rhythm_game.src.onsets import ONSET_SOURCES, source_code, merge_onsets, min_interval_filter, nearest_distances
+except ImportError:  # 直接執行 analyzer.py 時
+    from utils import ScoreCalculator, get_audio_duration, format_time
+    from stages import StageGraph
+    from detectors import ANALYSIS_PROFILES, DEFAULT_PROFILE, ONSET_PRESETS, get_onset_backend, get_beat_backend
+    from onsets import ONSET_SOURCES, source_code, merge_onsets, min_interval_filter, nearest_distances
+
+
+def log_mel_spectrogram(y, sr, hop_length=512, top_db=80.0):
+    """
+    mel 頻譜（dB），與 librosa.onset.onset_strength(y=...) 內部的計算相同
+
+    top_db=None 時不截斷，供分段計算後拼接再一起截斷。
+    為模組層級函數，可送往其他行程分段計算。
+    """
+    return librosa.power_to_db(librosa.feature.melspectrogram(y=y, sr=sr, hop_length=hop_length), top_db=top_db)
+
+
+def onset_envelopes(S, sr, hop_length=512):
+    """
+    由 mel 頻譜（dB）計算 onset 強度包絡線
+
+    mel 頻譜只計算一次，同時得到 onset 檢測用（平均）與節拍追蹤用
+    （中位數，beat_track 的預設）兩條包絡線，與分別呼叫 onset_strength(y=...) 的結果相同。
+
+    Returns:
+        tuple: (平均包絡線, 中位數包絡線)
+    """
+    return (
+        librosa.onset.onset_strength(S=S, sr=sr, hop_length=hop_length),
+        librosa.onset.onset_strength(S=S, sr=sr, hop_length=hop_length, aggregate=np.median)
+    )
+
+
+def tempogram_sum(padded_envelope, sr, hop_length, win_length):
+    """
+    計算一段 tempogram 並回傳各欄總和
+
+    padded_envelope 為整條包絡線補邊後的切片，以 center=False 計算後每一欄與整首計算時相同；
+    速度估計只需要整首 tempogram 的平均，因此只回傳總和與欄數。
+
+    Returns:
+        tuple: (各欄總和, 欄數)
+    """
+    tg = librosa.feature.tempogram(
+        onset_envelope=padded_envelope, sr=sr, hop_length=hop_length,
+        win_length=win_length, center=False
+    )
+    return tg.sum(axis=-1), tg.shape[-1]
+
 
 class AudioAnalyzer:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, segment_executor=None, profile=DEFAULT_PROFILE):
+        """
+        Args:
+            debug: 輸出除錯訊息
+            segment_executor: concurrent.futures 執行器；提供時長音訊的 onset 包絡線
+                分段平行計算（見 compute_onset_envelopes）
+            profile: 分析設定檔（detectors.ANALYSIS_PROFILES），決定 onset 與節拍的檢測後端
+        """
         self.debug = debug
         self.sr = 22050  # 取樣率
         self.hop_length = 512
         self.charts_dir = Path("rhythm_game/charts")
         self.charts_dir.mkdir(parents=True, exist_ok=True)
+        self.segment_executor = segment_executor
+        self.segment_seconds = 60.0   # 每段長度
+        self.segment_overlap = 1.0    # 每段前後多算的長度，拼接時捨棄
+        self.min_parallel_duration = 120.0  # 短於此長度的音訊不分段
+        # 分析中音訊的快取特徵：audio、onset_envelopes、tempo（分段估計的 BPM）、beats
+        self._features = None
+        # generate_chart 中互不相依的步驟同時執行的執行緒數，以及上次各步驟的秒數
+        self.stage_workers = 4
+        self.stage_timings = {}
+        self.set_profile(profile)
+
+    def set_profile(self, profile):
+        """切換分析設定檔（'accurate'、'fast'）"""
+        if profile not in ANALYSIS_PROFILES:
+            raise ValueError(f"Unknown analysis profile: {profile}")
+        backends = ANALYSIS_PROFILES[profile]
+        self.profile = profile
+        self.onset_backend = get_onset_backend(backends['onset'])
+        self.beat_backend = get_beat_backend(backends['beat'])
+        # 不同後端的包絡線不能共用
+        self._features = None
     
     def load_audio(self, audio_path):
         """載入音訊檔案"""
         try:
             y, sr = librosa.load(audio_path, sr=self.sr)
             self.audio_data = y
+            self.audio_path = str(audio_path)
             self.original_sr = sr
+            self._features = None
             print(f"音訊載入成功: {audio_path}")
             print(f"長度: {len(y)/sr:.2f} 秒")
             return True
@@ -34,7 +120,9 @@ class AudioAnalyzer:
         
         Args:
             y: 音訊資料，如果 None 則使用已載入的資料
-            method: 檢測方法 ('complex', 'energy', 'spectral')
+            method: 檢測方法 ('complex', 'energy', 'loose', 'spectral')
+                   - 'complex'、'energy'、'loose' 以 onset 後端的包絡線與 ONSET_PRESETS 的參數挑選峰值
+                   - 'spectral' 固定使用 librosa 的頻譜質心
         
         Returns:
             list: onset 時間點列表
@@ -43,27 +131,12 @@ class AudioAnalyzer:
             y = self.audio_data
         
         # 使用不同的 onset 檢測方法
-        if method == 'complex':
-            # 複雜頻譜方法 - 對大多數音樂效果好
-            onset_frames = librosa.onset.onset_detect(
-                y=y, sr=self.sr, 
-                units='time',
-                hop_length=self.hop_length,
-                pre_max=20,
-                post_max=20,
-                pre_avg=100,
-                post_avg=100,
-                delta=0.1,
-                wait=50
-            )
-        elif method == 'energy':
-            # 簡化的能量檢測方法
-            onset_frames = librosa.onset.onset_detect(
-                y=y, sr=self.sr,
-                units='time',
-                hop_length=self.hop_length,
-                delta=0.15,
-                wait=30
+        if method in ONSET_PRESETS:
+            onset_envelope = self._cached_envelope(y, 0)
+            if onset_envelope is None:
+                onset_envelope = self.onset_backend.envelopes(y, self.sr, self.hop_length)[0]
+            onset_frames = self.onset_backend.detect(
+                onset_envelope, self.sr, self.hop_length, **ONSET_PRESETS[method]
             )
         elif method == 'spectral':
             # 頻譜流量方法
@@ -82,28 +155,119 @@ class AudioAnalyzer:
         """檢測節拍"""
         if y is None:
             y = self.audio_data
-            
-        tempo, beats = librosa.beat.beat_track(
-            y=y, sr=self.sr, hop_length=self.hop_length, units='time'
+        features = self._cached_features(y)
+        if features is not None and features['beats'] is not None:
+            return features['beats']
+        
+        onset_envelope = self._cached_envelope(y, 1)
+        if onset_envelope is None:
+            onset_envelope = self.onset_backend.envelopes(y, self.sr, self.hop_length)[1]
+        tempo, beats = self.beat_backend.track(
+            onset_envelope, self.sr, self.hop_length,
+            bpm=features['tempo'] if features is not None else None
         )
         
         if self.debug:
             print(f"檢測到的 BPM: {float(tempo):.2f}")
             print(f"節拍數量: {len(beats)}")
         
+        if features is not None:
+            features['beats'] = (float(tempo), beats)
         return float(tempo), beats
     
+    def compute_onset_envelopes(self, y=None):
+        """
+        計算並快取整首歌的 onset 包絡線，之後的 onset 檢測與節拍追蹤都直接使用
+
+        設定 segment_executor 且音訊長於 min_parallel_duration 時，將音訊切成
+        segment_seconds 的段落（前後各多 segment_overlap 秒）交給執行器平行計算
+        mel 頻譜，各自捨棄重疊部分後依序拼接，再以整首的最大值截斷 dB；速度估計的
+        tempogram 也以拼接後的包絡線分段計算。onset 峰值與節拍以整條包絡線計算，
+        結果與不分段相同（只有浮點加總順序造成的誤差）。分段只用於 librosa 的
+        onset 後端；其他後端（如 'flux'）本身已足夠快，直接整首計算。
+
+        Returns:
+            tuple: (平均包絡線, 中位數包絡線)
+        """
+        if y is None:
+            y = self.audio_data
+        segmented = (self.onset_backend.name == 'librosa' and self.segment_executor is not None
+                     and len(y) / self.sr >= self.min_parallel_duration)
+        if segmented:
+            envelopes = onset_envelopes(self._segmented_log_mel(y), self.sr, self.hop_length)
+        elif self.onset_backend.name == 'librosa':
+            envelopes = onset_envelopes(log_mel_spectrogram(y, self.sr, self.hop_length), self.sr, self.hop_length)
+        else:
+            envelopes = self.onset_backend.envelopes(y, self.sr, self.hop_length)
+        # 未分段時速度由節拍後端估計
+        tempo = None
+        if segmented and self.beat_backend.name == 'librosa':
+            tempo = self._segmented_tempo(envelopes[1])
+        if y is self.audio_data:
+            self._features = {'audio': y, 'onset_envelopes': envelopes, 'tempo': tempo, 'beats': None}
+        return envelopes
+
+    def _segment_ranges(self, total_frames):
+        # 依 segment_seconds 將 frame 切段，回傳 [(first, last)]
+        segment_frames = max(1, int(round(self.segment_seconds * self.sr / self.hop_length)))
+        return [(first, min(total_frames, first + segment_frames))
+                for first in range(0, total_frames, segment_frames)]
+
+    def _segmented_log_mel(self, y, top_db=80.0):
+        hop = self.hop_length
+        overlap_frames = int(round(self.segment_overlap * self.sr / hop))
+
+        futures = []
+        for first, last in self._segment_ranges(1 + len(y) // hop):
+            # 段落起點對齊 hop，段內第 j 個 frame 即整首的第 start + j 個 frame
+            start = max(0, first - overlap_frames)
+            end = min(len(y), (last + overlap_frames) * hop)
+            future = self.segment_executor.submit(log_mel_spectrogram, y[start * hop:end], self.sr, hop, None)
+            futures.append((future, first - start, last - first))
+
+        S = np.concatenate([future.result()[:, offset:offset + length] for future, offset, length in futures], axis=1)
+        if self.debug:
+            print(f"分段計算 mel 頻譜: {len(futures)} 段")
+        # 與 power_to_db(top_db=80) 相同，但以整首而非各段的最大值為基準
+        return np.maximum(S, S.max() - top_db)
+
+    def _segmented_tempo(self, envelope):
+        # 與 beat_track 內部的 librosa.feature.tempo 相同（8 秒自相關視窗），tempogram 分段計算
+        win_length = librosa.time_to_frames(8.0, sr=self.sr, hop_length=self.hop_length).item()
+        padded = np.pad(envelope, win_length // 2, mode='linear_ramp', end_values=[0, 0])
+        futures = [
+            self.segment_executor.submit(
+                tempogram_sum, padded[first:last + win_length - 1], self.sr, self.hop_length, win_length)
+            for first, last in self._segment_ranges(len(envelope))
+        ]
+        total = sum(future.result()[0] for future in futures)
+        tg = (total / len(envelope))[:, np.newaxis]
+        return float(librosa.feature.tempo(
+            tg=tg, sr=self.sr, hop_length=self.hop_length, start_bpm=120, aggregate=None
+        )[0])
+
+    def _cached_features(self, y):
+        # 只有分析中的整首音訊才使用快取的特徵
+        if self._features is not None and y is self._features['audio']:
+            return self._features
+        return None
+
+    def _cached_envelope(self, y, index):
+        features = self._cached_features(y)
+        return features['onset_envelopes'][index] if features is not None else None
+
+    @property
+    def onset_envelope(self):
+        """分析中音訊的 onset 強度包絡線（與 onset_strength 相同），尚未計算時為 None"""
+        return self._cached_envelope(getattr(self, 'audio_data', None), 0)
+
     def filter_close_onsets(self, onsets, min_interval=0.15):
         """過濾過於接近的 onset 點"""
         if len(onsets) <= 1:
             return onsets
         
-        filtered = [onsets[0]]
-        for onset in onsets[1:]:
-            if onset - filtered[-1] >= min_interval:
-                filtered.append(onset)
-        
-        return np.array(filtered)
+        onsets = np.asarray(onsets, dtype=np.float64)
+        return onsets[min_interval_filter(onsets, min_interval)]
     
     def combine_detection_methods(self, y=None):
         """結合多種檢測方法獲得更好的結果"""
@@ -119,32 +283,42 @@ class AudioAnalyzer:
         # 檢測節拍
         tempo, beats = self.detect_beats(y)
         
-        # 合併所有檢測點
-        all_onsets = np.concatenate([onsets_complex, onsets_energy, beats])
-        all_onsets = np.unique(all_onsets)  # 移除重複
-        all_onsets = np.sort(all_onsets)
+        return self.merge_detections(onsets_complex, onsets_energy, tempo, beats, y)
+    
+    def merge_detections(self, onsets_complex, onsets_energy, tempo, beats, y=None):
+        """合併各方法的 onset 與節拍，過少時以寬鬆參數或節拍網格補足"""
+        onsets, _, tempo = self.merge_labeled_detections(onsets_complex, onsets_energy, tempo, beats, y)
+        return onsets, tempo
+    
+    def merge_labeled_detections(self, onsets_complex, onsets_energy, tempo, beats, y=None):
+        """
+        合併各方法的 onset 與節拍，並標記每個 onset 的來源
+
+        各來源皆已排序，以 onsets.merge_onsets 合併、去重與過濾過近的點（陣列運算）；
+        時間相同時依 complex、energy、beat 的順序決定來源。
+
+        Returns:
+            tuple: (onset 時間, 來源標籤（ONSET_SOURCES 的索引）, BPM)
+        """
+        if y is None:
+            y = self.audio_data
         
-        # 過濾過於接近的點
-        filtered_onsets = self.filter_close_onsets(all_onsets, min_interval=0.12)
+        # 合併所有檢測點並過濾過於接近的點
+        filtered_onsets, sources, merged_count = merge_onsets(
+            [(onsets_complex, 'complex'), (onsets_energy, 'energy'), (beats, 'beat')], min_interval=0.12
+        )
         
         # 如果檢測到的 onset 太少，使用更寬鬆的參數重新檢測
         if len(filtered_onsets) < 20:
             print(f"檢測到的 onset 過少 ({len(filtered_onsets)})，嘗試使用更寬鬆的參數...")
             
             # 使用更寬鬆的參數重新檢測
-            loose_onsets = librosa.onset.onset_detect(
-                y=y, sr=self.sr,
-                units='time',
-                hop_length=self.hop_length,
-                delta=0.05,  # 降低閾值
-                wait=20      # 減少等待時間
-            )
+            loose_onsets = self.detect_onsets(y, 'loose')  # 降低閾值、減少等待時間
             
             # 再次合併
-            all_onsets = np.concatenate([filtered_onsets, loose_onsets, beats])
-            all_onsets = np.unique(all_onsets)
-            all_onsets = np.sort(all_onsets)
-            filtered_onsets = self.filter_close_onsets(all_onsets, min_interval=0.1)
+            filtered_onsets, sources, merged_count = merge_onsets(
+                [(filtered_onsets, sources), (loose_onsets, 'loose'), (beats, 'beat')], min_interval=0.1
+            )
         
         # 如果還是太少，使用節拍網格填充
         if len(filtered_onsets) < 10:
@@ -158,22 +332,32 @@ class AudioAnalyzer:
             grid_beats = np.arange(0, duration, beat_interval)
             
             # 合併檢測到的 onset 和節拍網格
-            all_onsets = np.concatenate([filtered_onsets, grid_beats])
-            all_onsets = np.unique(all_onsets)
-            all_onsets = np.sort(all_onsets)
-            filtered_onsets = self.filter_close_onsets(all_onsets, min_interval=0.1)
+            filtered_onsets, sources, merged_count = merge_onsets(
+                [(filtered_onsets, sources), (grid_beats, 'grid')], min_interval=0.1
+            )
         
         if self.debug:
             print(f"Complex onsets: {len(onsets_complex)}")
             print(f"Energy onsets: {len(onsets_energy)}")
             print(f"Beats: {len(beats)}")
-            print(f"合併後: {len(all_onsets)}")
+            print(f"合併後: {merged_count}")
             print(f"最終過濾後: {len(filtered_onsets)}")
-            print(f"時間範圍: {filtered_onsets[0]:.2f}s - {filtered_onsets[-1]:.2f}s")
+            counts = np.bincount(sources, minlength=len(ONSET_SOURCES))
+            print(f"來源: {dict(zip(ONSET_SOURCES, counts.tolist()))}")
+            if len(filtered_onsets):
+                print(f"時間範圍: {filtered_onsets[0]:.2f}s - {filtered_onsets[-1]:.2f}s")
         
-        return filtered_onsets, tempo
+        return filtered_onsets, sources, tempo
     
-    def assign_lanes(self, onsets, num_lanes=4, method='energy'):
+    def _beat_alignment(self, onsets, beats, sources=None):
+        # 每個 onset 到最近節拍的距離，以及是否在拍點上（100ms 內，或來源本身就是節拍 / 節拍網格）
+        distances = nearest_distances(onsets, beats)
+        on_beat = distances < 0.1
+        if sources is not None:
+            on_beat |= np.isin(sources, [source_code('beat'), source_code('grid')])
+        return distances, on_beat
+    
+    def assign_lanes(self, onsets, num_lanes=4, method='energy', sources=None):
         """
         將 onset 點分配到不同的 lane
         
@@ -181,6 +365,8 @@ class AudioAnalyzer:
             onsets: onset 時間點列表
             num_lanes: lane 數量
             method: 分配方法 ('energy', 'balanced_beat')
+            sources: 每個 onset 的來源標籤（merge_labeled_detections 的結果），
+                     節拍與節拍網格來源的 onset 一律視為在拍點上
         
         Returns:
             list: [(time, lane), ...]
@@ -200,15 +386,12 @@ class AudioAnalyzer:
             # 統計每個lane的累積使用次數
             lane_counts = [0] * num_lanes
             
+            # 檢查是否靠近節拍點
+            beat_distances, on_beat = self._beat_alignment(onsets, beats, sources)
+            
             for i, time in enumerate(onsets):
-                # 檢查是否靠近節拍點
-                nearest_beat_distance = float('inf')
-                for beat in beats:
-                    distance = abs(time - beat)
-                    if distance < nearest_beat_distance:
-                        nearest_beat_distance = distance
-                
-                is_on_beat = nearest_beat_distance < 0.1  # 100ms內算作在節拍上
+                nearest_beat_distance = beat_distances[i]
+                is_on_beat = on_beat[i]
                 
                 # 找出累積數量最小的lane(s)
                 min_count = min(lane_counts)
@@ -257,6 +440,7 @@ class AudioAnalyzer:
             lane_counts = [0] * num_lanes
             last_lane = -1
             consecutive_count = 0
+            _, on_beat = self._beat_alignment(onsets, beats, sources)
             
             for i, time in enumerate(onsets):
                 # 計算該時間點周圍的頻譜能量分布
@@ -307,8 +491,7 @@ class AudioAnalyzer:
                             sorted_indices = np.argsort(energy_array)[::-1]
                             
                             # 檢查是否靠近節拍點（增強節拍同步）
-                            nearest_beat_distance = min([abs(time - beat) for beat in beats])
-                            is_on_beat = nearest_beat_distance < 0.1  # 100ms內算作在節拍上
+                            is_on_beat = on_beat[i]
                             
                             # 平衡分配邏輯
                             lane = sorted_indices[0]  # 預設使用能量最高的lane
@@ -398,7 +581,7 @@ class AudioAnalyzer:
         else:
             # 如果方法不支援，預設使用平衡節拍方法
             print(f"不支援的方法 '{method}'，使用平衡節拍方法")
-            return self.assign_lanes(onsets, num_lanes, 'balanced_beat')
+            return self.assign_lanes(onsets, num_lanes, 'balanced_beat', sources)
         
         if self.debug:
             print(f"最終lane分配統計: {dict(enumerate(lane_counts))}")
@@ -409,7 +592,7 @@ class AudioAnalyzer:
         
         return notes
     
-    def generate_chart(self, audio_path, song_title=None, method='balanced_beat'):
+    def generate_chart(self, audio_path, song_title=None, method='balanced_beat', audio_data=None):
         """
         生成完整的譜面
         
@@ -419,6 +602,7 @@ class AudioAnalyzer:
             method: lane 分配方法 ('energy', 'balanced_beat')
                    - 'energy': 基於頻率能量分析分配lane
                    - 'balanced_beat': 基於累積數量平衡和拍點對齊分配lane (推薦)
+            audio_data: 已解碼的單聲道音訊（取樣率 self.sr）；提供時不再從 audio_path 載入
         
         Returns:
             dict: 譜面資料
@@ -426,34 +610,17 @@ class AudioAnalyzer:
         print(f"開始生成譜面: {audio_path}")
         print(f"使用方法: {method}")
         
-        if not self.load_audio(audio_path):
-            print("音訊載入失敗")
-            return None
-        
         print("正在分析音訊...")
         
         try:
-            # 檢測 onset 和節拍
-            onsets, tempo = self.combine_detection_methods()
-            print(f"檢測完成，找到 {len(onsets)} 個 onset 點")
-
-            # 增加開頭延遲，避免音符過早出現
-            start_delay = 0.5  # 秒
-            if len(onsets) > 0:
-                original_onset_count = len(onsets)
-                onsets = onsets[onsets >= start_delay]
-                
-                if self.debug and len(onsets) < original_onset_count:
-                    removed_count = original_onset_count - len(onsets)
-                    print(f"為提供反應時間，移除了 {removed_count} 個在 {start_delay}s 前的音符")
+            results = self._run_analysis_stages(audio_path, method, audio_data)
+            onsets, tempo, _ = results['merge']
+            notes = results['lanes']
             
             if len(onsets) == 0:
                 print("警告: 沒有檢測到任何 onset 點")
                 return None
             
-            # 分配 lane
-            print(f"開始分配 lane，使用方法: {method}")
-            notes = self.assign_lanes(onsets, method=method)
             print(f"Lane 分配完成，生成了 {len(notes)} 個音符")
             
             if len(notes) == 0:
@@ -469,7 +636,8 @@ class AudioAnalyzer:
                 "notes": notes,
                 "note_count": int(len(notes)),
                 "lanes": 4,
-                "created_method": method
+                "created_method": method,
+                "analysis_profile": self.profile
             }
             
             if self.debug:
@@ -493,12 +661,211 @@ class AudioAnalyzer:
             traceback.print_exc()
             return None
     
+    def _run_analysis_stages(self, audio_path, method, audio_data=None):
+        """
+        以步驟圖執行分析：decode → features → {onsets_complex, onsets_energy, beats} → merge → lanes
+
+        onset 的兩種檢測與節拍追蹤只依賴共用的包絡線，在執行緒池中同時執行；
+        各步驟秒數記錄在 stage_timings。提供 audio_data 時沒有 decode 步驟。
+
+        Returns:
+            dict: 各步驟結果
+        """
+        def decode():
+            if not self.load_audio(audio_path):
+                raise ValueError("音訊載入失敗")
+            return self.audio_data
+        
+        def features(decode):
+            # onset 檢測與節拍追蹤共用同一份包絡線（長音訊可分段平行計算）
+            self.compute_onset_envelopes(decode)
+            print("開始檢測 onset 和節拍...")
+            return decode
+        
+        def merge(features, onsets_complex, onsets_energy, beats):
+            onsets, sources, tempo = self.merge_labeled_detections(onsets_complex, onsets_energy, *beats, y=features)
+            print(f"檢測完成，找到 {len(onsets)} 個 onset 點")
+            
+            # 增加開頭延遲，避免音符過早出現
+            start_delay = 0.5  # 秒
+            if len(onsets) > 0:
+                original_onset_count = len(onsets)
+                keep = onsets >= start_delay
+                onsets, sources = onsets[keep], sources[keep]
+                
+                if self.debug and len(onsets) < original_onset_count:
+                    removed_count = original_onset_count - len(onsets)
+                    print(f"為提供反應時間，移除了 {removed_count} 個在 {start_delay}s 前的音符")
+            return onsets, tempo, sources
+        
+        def lanes(merge):
+            onsets, _, sources = merge
+            if len(onsets) == 0:
+                return []
+            # 分配 lane
+            print(f"開始分配 lane，使用方法: {method}")
+            return self.assign_lanes(onsets, method=method, sources=sources)
+        
+        graph = StageGraph(self.stage_workers)
+        if audio_data is None:
+            graph.add('decode', decode)
+            graph.add('features', features, deps=('decode',))
+        else:
+            self.audio_data = audio_data
+            self.audio_path = str(audio_path)
+            self.original_sr = self.sr
+            graph.add('features', lambda: features(audio_data))
+        graph.add('onsets_complex', lambda features: self.detect_onsets(features, 'complex'), deps=('features',))
+        graph.add('onsets_energy', lambda features: self.detect_onsets(features, 'energy'), deps=('features',))
+        graph.add('beats', lambda features: self.detect_beats(features), deps=('features',))
+        graph.add('merge', merge, deps=('features', 'onsets_complex', 'onsets_energy', 'beats'))
+        graph.add('lanes', lanes, deps=('merge',))
+        try:
+            return graph.run()
+        finally:
+            self.stage_timings = dict(graph.timings)
+    
+    def load_section(self, audio_path, start, end, context=3.0):
+        """
+        只解碼 [start - context, end + context] 的音訊
+
+        soundfile 可讀的格式（wav、flac、mp3 等）直接跳到起點解碼，不會讀取整首歌。
+
+        Returns:
+            tuple: (原始取樣率與聲道數的音訊 (channels, samples), 原始取樣率, 解碼起點（秒）)
+        """
+        offset = max(0.0, start - context)
+        y, sr = librosa.load(audio_path, sr=None, mono=False, offset=offset, duration=end + context - offset)
+        return np.atleast_2d(y), sr, offset
+    
+    def find_song_chart(self, audio_path, method='balanced_beat'):
+        """
+        尋找已儲存的 audio_path 整首譜面
+
+        只接受相同 lane 分配方法與分析設定檔的整首譜面（不含練習譜面），有多個時取最新的。
+        不同分析行程或重新啟動後都能沿用，不依賴記憶體中的特徵快取。
+
+        Returns:
+            dict or None: 譜面資料
+        """
+        audio_name = Path(audio_path).name
+        found, found_mtime = None, None
+        for chart_path in self.charts_dir.glob('*.json'):
+            try:
+                mtime = chart_path.stat().st_mtime
+                if found is not None and mtime <= found_mtime:
+                    continue
+                with open(chart_path, 'r', encoding='utf-8') as f:
+                    chart = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if (isinstance(chart, dict) and chart.get('audio_file') == audio_name and 'section' not in chart
+                    and chart.get('created_method') == method
+                    and chart.get('analysis_profile', self.profile) == self.profile):
+                found, found_mtime = chart, mtime
+        return found
+    
+    def generate_section_chart(self, audio_path, start, end, song_title=None, method='balanced_beat',
+                               lead_in=2.0, tail=1.0, context=3.0):
+        """
+        生成 [start, end] 範圍的練習譜面
+
+        已儲存整首譜面時（相同方法與設定檔）直接取出範圍內的音符，音符與 lane 都與整首譜面一致；
+        沒有時才只解碼該範圍（前後各多 context 秒，讓 onset 峰值挑選的移動平均與節拍追蹤有足夠的上下文），
+        分析後只保留範圍內的音符。練習音訊從 start 前 lead_in 秒開始、到 end 後 tail 秒結束，
+        音符時間以練習音訊的開頭為 0。
+
+        Args:
+            audio_path: 音訊檔案路徑
+            start, end: 範圍（秒）
+            song_title: 譜面標題，預設為「檔名 (MM:SS-MM:SS)」
+            method: lane 分配方法（同 generate_chart）
+
+        Returns:
+            tuple: (譜面資料, 練習音訊 (samples, channels), 練習音訊取樣率)；失敗時為 (None, None, None)
+        """
+        print(f"開始生成練習譜面: {audio_path} [{start:.2f}s - {end:.2f}s]")
+        timings = {}
+        try:
+            duration = get_audio_duration(audio_path)
+            if duration is not None:
+                end = min(end, duration)
+            if start < 0 or end <= start:
+                print(f"無效的範圍: {start:.2f}s - {end:.2f}s")
+                return None, None, None
+            
+            started = time.perf_counter()
+            native, native_sr, offset = self.load_section(audio_path, start, end, context)
+            timings['decode'] = time.perf_counter() - started
+            clip_start = max(offset, start - lead_in)
+            begin = int(round((clip_start - offset) * native_sr))
+            clip = native[:, begin:begin + int(round((end + tail - clip_start) * native_sr))]
+            
+            started = time.perf_counter()
+            song_chart = self.find_song_chart(audio_path, method)
+            if song_chart is not None:
+                print("使用已儲存的整首譜面")
+                tempo = song_chart.get('bpm', 0.0)
+                notes = [dict(note) for note in song_chart.get('notes', []) if start <= note['time'] < end]
+                timings['slice'] = time.perf_counter() - started
+            else:
+                # 分析範圍的音訊（分析取樣率、單聲道）；不覆蓋已快取的整首歌特徵
+                y = librosa.resample(librosa.to_mono(native), orig_sr=native_sr, target_sr=self.sr)
+                previous = (getattr(self, 'audio_data', None), getattr(self, 'audio_path', None), self._features)
+                try:
+                    results = self._run_analysis_stages(audio_path, method, audio_data=y)
+                    timings.update(self.stage_timings)
+                finally:
+                    self.audio_data, self.audio_path, self._features = previous
+                tempo = results['merge'][1]
+                notes = [
+                    {"time": note["time"] + offset, "lane": note["lane"]} for note in results['lanes']
+                    if start <= note["time"] + offset < end
+                ]
+            self.stage_timings = timings
+            
+            if len(notes) == 0:
+                print("警告: 範圍內沒有任何音符")
+                return None, None, None
+            for note in notes:
+                note["time"] = float(note["time"] - clip_start)
+            
+            chart_data = {
+                "song_title": song_title or f"{Path(audio_path).stem} ({format_time(start)}-{format_time(end)})",
+                "audio_file": str(Path(audio_path).name),
+                "bpm": float(tempo),
+                "duration": float(clip.shape[1] / native_sr),
+                "notes": notes,
+                "note_count": int(len(notes)),
+                "lanes": 4,
+                "created_method": method,
+                "analysis_profile": self.profile,
+                # 練習音訊在原曲中的範圍；audio_file 由呼叫端改為練習音訊
+                "section": {
+                    "audio_file": str(Path(audio_path).name),
+                    "start": float(start),
+                    "end": float(end),
+                    "offset": float(clip_start)
+                }
+            }
+            print(f"練習譜面完成，{len(notes)} 個音符")
+            return chart_data, clip.T, native_sr
+            
+        except Exception as e:
+            print(f"生成練習譜面時發生錯誤: {e}")
+            import traceback
+            traceback.print_exc()
+            self.stage_timings = timings
+            return None, None, None
+    
     def save_chart(self, chart_data, filename=None):
         """儲存譜面到 JSON 檔案"""
         if filename is None:
             filename = f"{chart_data['song_title']}.json"
         
         chart_path = self.charts_dir / filename
+        # 理論最高分（全部 Perfect）在儲存時算好，排行榜與選曲不必重新計算
+        chart_data['max_score'] = ScoreCalculator().calculate_max_score(len(chart_data.get('notes', [])))
         
         try:
             with open(chart_path, 'w', encoding='utf-8') as f:
@@ -513,6 +880,10 @@ class AudioAnalyzer:
     
     def visualize_analysis(self, audio_path, save_plot=False):
         """視覺化分析結果（DEBUG 用）"""
+        # matplotlib 只有除錯繪圖需要，不在分析行程啟動時載入
+        import matplotlib.pyplot as plt
+        import librosa.display
+        
         if not hasattr(self, 'audio_data'):
             self.load_audio(audio_path)
         
@@ -0,0 +1,297 @@
+import re
+import json
+import time
+import statistics
+from collections import deque, OrderedDict
+from pathlib import Path
+
+from rhythm_game.src.threads import native_threading
+
+
+# 校準譜面的識別字，/api/chart/calibration 與 start_game 皆以此載入
+CALIBRATION_CHART_ID = 'calibration'
+
+# 校準時按鍵與音符可配對的最大時間差（秒）
+CALIBRATION_WINDOW = 0.3
+
+# 客戶端產生的裝置 ID（UUID 或 base36 時間戳記與亂數）
+DEVICE_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{8,64}')
+
+
+def is_valid_device_id(device_id):
+    """裝置 ID 是否為可接受的格式"""
+    return isinstance(device_id, str) and DEVICE_ID_PATTERN.fullmatch(device_id) is not None
+
+
+class OffsetEstimator:
+    """
+    按鍵時間偏移的串流估計器
+
+    記錄每次擊中的帶正負號時間差（按鍵時間 - 音符時間，正值表示太晚），
+    以最近 window 筆的截尾平均估計玩家/裝置的系統性延遲。截尾平均去掉
+    兩端各 trim 比例的樣本，不受偶發的誤按影響，又比中位數收斂得快。
+    """
+
+    def __init__(self, window=32, trim=0.2, min_samples=12, max_spread=0.04):
+        """
+        Args:
+            window (int): 保留最近幾筆樣本
+            trim (float): 截尾平均兩端各去掉的比例
+            min_samples (int): 至少幾筆樣本才提供建議值
+            max_spread (float): 中位數絕對偏差小於此值（秒）才視為收斂
+        """
+        self.window = window
+        self.trim = trim
+        self.min_samples = min_samples
+        self.max_spread = max_spread
+        self._samples = deque(maxlen=window)
+        self.total = 0
+
+    def add(self, offset):
+        """加入一筆帶正負號的時間差（秒）"""
+        self._samples.append(float(offset))
+        self.total += 1
+
+    def __len__(self):
+        return len(self._samples)
+
+    @property
+    def median(self):
+        if not self._samples:
+            return None
+        return statistics.median(self._samples)
+
+    @property
+    def trimmed_mean(self):
+        if not self._samples:
+            return None
+        values = sorted(self._samples)
+        cut = int(len(values) * self.trim)
+        if cut and len(values) - 2 * cut > 0:
+            values = values[cut:-cut]
+        return sum(values) / len(values)
+
+    @property
+    def spread(self):
+        """中位數絕對偏差（秒），代表按鍵時間的穩定程度"""
+        if not self._samples:
+            return None
+        median = self.median
+        return statistics.median(abs(value - median) for value in self._samples)
+
+    @property
+    def is_stable(self):
+        return len(self._samples) >= self.min_samples and self.spread <= self.max_spread
+
+    @property
+    def recommended_offset(self):
+        """建議的延遲補償（秒），樣本不足時為 None"""
+        if len(self._samples) < self.min_samples:
+            return None
+        return round(self.trimmed_mean, 4)
+
+    def get_state(self):
+        """取得可序列化的狀態"""
+        return {'samples': list(self._samples), 'total': self.total}
+
+    def load_state(self, state):
+        """由 get_state() 的結果還原狀態"""
+        self._samples.clear()
+        self._samples.extend(state.get('samples', []))
+        self.total = state.get('total', len(self._samples))
+
+    def to_dict(self):
+        return {
+            'samples': len(self._samples),
+            'total': self.total,
+            'median': self.median,
+            'trimmed_mean': self.trimmed_mean,
+            'spread': self.spread,
+            'stable': self.is_stable,
+            'recommended_offset': self.recommended_offset
+        }
+
+
+class CalibrationStore:
+    """
+    各裝置的延遲校準結果
+
+    以裝置 ID 為鍵存放建議偏移與是否自動套用，儲存為 JSON 檔。
+
+    - 裝置 ID 由客戶端提供，只接受 DEVICE_ID_PATTERN 格式
+    - 最多保存 max_devices 台裝置，超過時移除最久未使用的裝置
+    - 更新只修改記憶體中的資料；背景寫入執行緒（OS 執行緒，不佔用事件迴圈）
+      在第一筆變更後等待 save_delay 秒，將期間的所有變更合併為一次原子寫入
+    """
+
+    def __init__(self, path="rhythm_game/calibration.json", max_devices=10000, save_delay=2.0):
+        """
+        Args:
+            path (str): JSON 檔案路徑
+            max_devices (int): 最多保存的裝置數
+            save_delay (float): 更新後延遲多少秒寫入檔案（合併連續的更新）
+        """
+        self.path = Path(path)
+        self.max_devices = max_devices
+        self.save_delay = save_delay
+
+        threads = native_threading()
+        self._lock = threads.Lock()
+        self._wake = threads.Event()
+        self._stop = threads.Event()
+        self._thread_factory = threads.Thread
+        self._writer = None
+        self._dirty = False
+
+        self._records = self._load()
+        self._evict_locked()
+
+    def _load(self):
+        try:
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+                # 依最後更新時間排序，最久未使用的在前
+                valid = [(device_id, record) for device_id, record in records.items()
+                         if is_valid_device_id(device_id) and isinstance(record, dict)]
+                valid.sort(key=lambda item: item[1].get('updated_at') or 0)
+                return OrderedDict(valid)
+        except Exception as e:
+            print(f"載入校準資料失敗: {e}")
+        return OrderedDict()
+
+    def _evict_locked(self):
+        evicted = 0
+        while len(self._records) > self.max_devices:
+            self._records.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def _write(self, records):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(records, f, indent=2, ensure_ascii=False)
+            tmp_path.replace(self.path)
+        except Exception as e:
+            print(f"儲存校準資料失敗: {e}")
+
+    def _schedule_save(self):
+        """標記為待寫入並喚醒背景寫入執行緒（呼叫時須持有鎖）"""
+        self._dirty = True
+        if self._writer is None:
+            self._stop.clear()
+            self._writer = self._thread_factory(target=self._write_loop, name='calibration-writer')
+            self._writer.daemon = True
+            self._writer.start()
+        self._wake.set()
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            # 等待後續更新，合併為一次寫入
+            self._stop.wait(self.save_delay)
+            self.flush()
+
+    def flush(self):
+        """立即寫入尚未儲存的變更"""
+        with self._lock:
+            self._wake.clear()
+            if not self._dirty:
+                return
+            self._dirty = False
+            records = {device_id: dict(record) for device_id, record in self._records.items()}
+        self._write(records)
+
+    def close(self):
+        """停止背景寫入執行緒並寫入剩餘的變更"""
+        writer = self._writer
+        if writer is not None:
+            self._stop.set()
+            self._wake.set()
+            writer.join(timeout=self.save_delay + 5)
+            self._writer = None
+        self.flush()
+
+    def get(self, device_id):
+        """取得裝置的校準結果，沒有資料時回傳 None"""
+        with self._lock:
+            record = self._records.get(device_id)
+            if not record:
+                return None
+            self._records.move_to_end(device_id)
+            return dict(record)
+
+    def update(self, device_id, offset=None, samples=None, auto_apply=None):
+        """
+        更新裝置的校準結果，回傳更新後的資料
+
+        Raises:
+            ValueError: 裝置 ID 格式不正確
+        """
+        if not is_valid_device_id(device_id):
+            raise ValueError('無效的裝置 ID')
+        with self._lock:
+            record = self._records.setdefault(device_id, {
+                'offset': 0.0,
+                'samples': 0,
+                'auto_apply': False,
+                'updated_at': None
+            })
+            self._records.move_to_end(device_id)
+            if offset is not None:
+                record['offset'] = float(offset)
+                record['updated_at'] = time.time()
+            if samples is not None:
+                record['samples'] = int(samples)
+            if auto_apply is not None:
+                record['auto_apply'] = bool(auto_apply)
+            self._evict_locked()
+            self._schedule_save()
+            return dict(record)
+
+    def delete(self, device_id):
+        with self._lock:
+            removed = self._records.pop(device_id, None) is not None
+            if removed:
+                self._schedule_save()
+            return removed
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def get_applied_offset(self, device_id):
+        """裝置開啟自動套用時回傳偏移，否則回傳 0"""
+        record = self.get(device_id) if device_id else None
+        if record and record.get('auto_apply'):
+            return record.get('offset', 0.0)
+        return 0.0
+
+
+def create_calibration_chart(bpm=100, beats=32, lead_in=2.0, lanes=4):
+    """
+    產生校準用譜面：固定節拍的節拍器音符，不需要音訊檔
+
+    客戶端以 Web Audio 依音符時間播放節拍聲，玩家跟著節拍按任意鍵即可。
+
+    Args:
+        bpm (int): 節拍速度
+        beats (int): 音符數量
+        lead_in (float): 第一個音符前的預備時間（秒）
+        lanes (int): 音符輪流出現的軌道數
+    """
+    interval = 60.0 / bpm
+    notes = [{'time': round(lead_in + i * interval, 4), 'lane': i % lanes} for i in range(beats)]
+    return {
+        'song_title': '延遲校準',
+        'audio_file': None,
+        'mode': 'calibration',
+        'bpm': bpm,
+        'duration': notes[-1]['time'] + 1.0 if notes else lead_in,
+        'lanes': lanes,
+        'difficulty': 'calibration',
+        'note_count': len(notes),
+        'notes': notes
+    }
@@ -0,0 +1,153 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from rhythm_game.src.calibration import CALIBRATION_CHART_ID, create_calibration_chart
+
+
+# 客戶端每次請求的預設視窗長度與提前量（秒）
+DEFAULT_WINDOW = 10.0
+DEFAULT_LOOKAHEAD = 5.0
+
+
+def encode_notes(times, lanes, packed=False):
+    """
+    精簡音符編碼：時間（毫秒整數）與軌道分成兩個平行陣列
+
+    {"t": [500, 750, ...], "l": [0, 1, ...]}，比每個音符一個物件小得多。
+    packed=True 時改為位元組：t 為 little-endian int32、l 為 uint8，
+    客戶端以 DataView 直接讀取，不必逐一解析數字。
+
+    Args:
+        times (np.ndarray): 音符時間（秒）
+        lanes (np.ndarray): 音符軌道
+        packed (bool): 是否打包為位元組
+
+    Returns:
+        dict: 編碼後的音符
+    """
+    times_ms = np.rint(np.asarray(times) * 1000)
+    if packed:
+        return {
+            't': times_ms.astype('<i4').tobytes(),
+            'l': np.asarray(lanes).astype(np.uint8).tobytes()
+        }
+    return {
+        't': times_ms.astype(np.int64).tolist(),
+        'l': np.asarray(lanes).astype(np.int64).tolist()
+    }
+
+
+class _ChartEntry:
+    """快取中的譜面：不含音符的標頭與依時間排序的音符陣列"""
+
+    __slots__ = ('version', 'header', 'times', 'lanes')
+
+    def __init__(self, version, chart_data):
+        notes = chart_data.get('notes', [])
+        times = np.array([note['time'] for note in notes], dtype=np.float64)
+        lanes = np.array([note['lane'] for note in notes], dtype=np.int64)
+        order = np.argsort(times, kind='stable')
+        self.version = version
+        self.times = times[order]
+        self.lanes = lanes[order]
+        self.header = {key: value for key, value in chart_data.items() if key != 'notes'}
+        self.header['note_count'] = len(notes)
+
+
+class ChartStreamer:
+    """
+    依時間視窗提供譜面音符
+
+    開局時客戶端只取得譜面標頭，音符再依播放進度分段請求，
+    開局延遲與傳輸量不再隨譜面長度增加。已解析的譜面以 LRU 快取，
+    檔案修改時間改變時重新載入。
+    """
+
+    def __init__(self, chart_manager, max_charts=32):
+        """
+        Args:
+            chart_manager (ChartManager): 載入譜面檔案
+            max_charts (int): 快取的譜面數量上限
+        """
+        self.chart_manager = chart_manager
+        self.max_charts = max_charts
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_entry(self, chart_path):
+        if chart_path == CALIBRATION_CHART_ID:
+            version = None
+        else:
+            try:
+                stat = Path(chart_path).stat()
+            except OSError:
+                return None
+            version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._cache.get(chart_path)
+            if entry is not None and entry.version == version:
+                self._cache.move_to_end(chart_path)
+                return entry
+
+        if chart_path == CALIBRATION_CHART_ID:
+            chart_data = create_calibration_chart()
+        else:
+            chart_data = self.chart_manager.load_chart(chart_path)
+        if not chart_data:
+            return None
+        entry = _ChartEntry(version, chart_data)
+
+        with self._lock:
+            self._cache[chart_path] = entry
+            self._cache.move_to_end(chart_path)
+            while len(self._cache) > self.max_charts:
+                self._cache.popitem(last=False)
+        return entry
+
+    def get_header(self, chart_path):
+        """
+        取得譜面標頭（不含音符）
+
+        Returns:
+            dict or None: 譜面標頭，另含 chart_id、note_count、first_note_time 與建議的視窗設定
+        """
+        entry = self._get_entry(chart_path)
+        if entry is None:
+            return None
+        header = dict(entry.header)
+        header['chart_id'] = chart_path
+        header['first_note_time'] = float(entry.times[0]) if len(entry.times) else None
+        header['stream'] = {'window': DEFAULT_WINDOW, 'lookahead': DEFAULT_LOOKAHEAD}
+        return header
+
+    def get_window(self, chart_path, start=None, end=None, packed=False):
+        """
+        取得時間落在 [start, end) 的音符
+
+        Args:
+            chart_path (str): 譜面路徑
+            start (float): 視窗起點（秒），None 表示從第一個音符開始
+            end (float): 視窗終點（秒），None 表示到最後一個音符
+            packed (bool): 音符打包為位元組（見 encode_notes）
+
+        Returns:
+            dict or None: chart_id、start、end、notes（精簡編碼）與 done（之後已沒有音符）
+        """
+        entry = self._get_entry(chart_path)
+        if entry is None:
+            return None
+        lo = 0 if start is None else int(np.searchsorted(entry.times, start, side='left'))
+        hi = len(entry.times) if end is None else int(np.searchsorted(entry.times, end, side='left'))
+        hi = max(lo, hi)
+        return {
+            'chart_id': chart_path,
+            'start': start,
+            'end': end,
+            'notes': encode_notes(entry.times[lo:hi], entry.lanes[lo:hi], packed),
+            'packed': packed,
+            'done': hi >= len(entry.times)
+        }
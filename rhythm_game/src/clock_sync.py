@@ -0,0 +1,148 @@
+import time
+import statistics
+from collections import deque
+
+
+class ClockSync:
+    """
+    NTP 式的客戶端時鐘同步
+
+    伺服器送出 clock_ping（附伺服器單調時鐘時間 s0），客戶端立即以 clock_pong
+    回覆自己的時間 c，伺服器於 s1 收到後得到一筆樣本：
+
+        rtt    = s1 - s0
+        offset = c - (s0 + s1) / 2     （客戶端時鐘 - 伺服器時鐘）
+
+    保留最近 window 筆樣本，以 RTT 最小的樣本估計 offset（網路排隊延遲最少，
+    誤差上限為 rtt / 2）。遊戲中每隔 resync_interval 秒重新取樣，持續修正漂移。
+    """
+
+    def __init__(self, window=16, burst=5, resync_interval=2.0, max_lag=0.5, ping_timeout=2.0):
+        """
+        Args:
+            window (int): 保留的樣本數
+            burst (int): 開局時連續取樣的次數
+            resync_interval (float): 取得足夠樣本後重新取樣的間隔（秒）
+            max_lag (float): 客戶端時間戳記最多可早於伺服器收到時間多少秒
+            ping_timeout (float): 未回覆的 ping 多久後視為遺失（秒）
+        """
+        self.window = window
+        self.burst = burst
+        self.resync_interval = resync_interval
+        self.max_lag = max_lag
+        self.ping_timeout = ping_timeout
+
+        self._samples = deque(maxlen=window)
+        self._pending = {}
+        self._next_id = 0
+        self._last_ping = None
+        self.sample_count = 0
+
+    def create_ping(self, now=None):
+        """建立一個 ping，回傳要送給客戶端的資料"""
+        now = time.monotonic() if now is None else now
+        # 清除逾時未回覆的 ping
+        for ping_id in [pid for pid, sent in self._pending.items() if now - sent > self.ping_timeout]:
+            del self._pending[ping_id]
+
+        self._next_id += 1
+        self._pending[self._next_id] = now
+        self._last_ping = now
+        return {'id': self._next_id, 'server_time': now}
+
+    def handle_pong(self, ping_id, client_time, now=None):
+        """
+        處理客戶端回覆
+
+        Returns:
+            bool: 是否成功加入樣本
+        """
+        now = time.monotonic() if now is None else now
+        sent = self._pending.pop(ping_id, None)
+        if sent is None or client_time is None:
+            return False
+
+        rtt = now - sent
+        if rtt < 0:
+            return False
+        offset = float(client_time) - (sent + now) / 2
+        self._samples.append((rtt, offset))
+        self.sample_count += 1
+        return True
+
+    def needs_ping(self, now=None):
+        """是否該送出新的 ping（開局連續取樣或定期重新取樣）"""
+        now = time.monotonic() if now is None else now
+        if self._last_ping is not None and self._pending and now - self._last_ping < self.ping_timeout:
+            # 已有未回覆的 ping，避免重複送出
+            return False
+        if len(self._samples) < self.burst:
+            return True
+        return self._last_ping is None or now - self._last_ping >= self.resync_interval
+
+    @property
+    def is_synced(self):
+        return len(self._samples) > 0
+
+    @property
+    def offset(self):
+        """估計的客戶端時鐘偏移（秒），尚未同步時為 None"""
+        if not self._samples:
+            return None
+        return min(self._samples)[1]
+
+    @property
+    def rtt(self):
+        """近期 RTT 中位數（秒），尚未同步時為 None"""
+        if not self._samples:
+            return None
+        return statistics.median(rtt for rtt, _ in self._samples)
+
+    def to_server_time(self, client_time, received_at):
+        """
+        將客戶端時間戳記換算為伺服器單調時鐘時間
+
+        尚未同步或未提供時間戳記時，以收到時間減去半個 RTT 估計。
+        結果限制在 [received_at - max_lag, received_at] 之間，
+        避免錯誤或偽造的時間戳記影響判定。
+        """
+        if client_time is not None and self.is_synced:
+            try:
+                server_time = float(client_time) - self.offset
+            except (TypeError, ValueError):
+                server_time = received_at
+        elif self.rtt is not None:
+            server_time = received_at - self.rtt / 2
+        else:
+            server_time = received_at
+
+        return min(received_at, max(received_at - self.max_lag, server_time))
+
+    def get_state(self):
+        """
+        取得可序列化的狀態（樣本與累計數，不含未回覆的 ping）
+
+        offset 相對於伺服器單調時鐘，只在同一台主機上有意義；保存時改為相對於
+        牆上時鐘，由其他主機的 worker 還原時再換算回該主機的單調時鐘。
+        """
+        wall_minus_mono = time.time() - time.monotonic()
+        return {
+            'samples': [(rtt, offset - wall_minus_mono) for rtt, offset in self._samples],
+            'sample_count': self.sample_count
+        }
+
+    def load_state(self, state):
+        """由 get_state() 的結果還原狀態"""
+        wall_minus_mono = time.time() - time.monotonic()
+        self._samples.clear()
+        self._samples.extend((float(rtt), float(offset) + wall_minus_mono) for rtt, offset in state.get('samples', []))
+        self.sample_count = state.get('sample_count', len(self._samples))
+
+    def get_stats(self):
+        """取得同步狀態（供除錯與監控）"""
+        return {
+            'synced': self.is_synced,
+            'offset': self.offset,
+            'rtt': self.rtt,
+            'samples': self.sample_count
+        }
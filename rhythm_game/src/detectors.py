@@ -0,0 +1,280 @@
+import numpy as np
+
+
+# onset 檢測的峰值挑選參數（frame 為單位，意義同 librosa.util.peak_pick）
+# 未指定的參數使用 librosa.onset.onset_detect 的預設值
+ONSET_PRESETS = {
+    # 複雜頻譜方法 - 對大多數音樂效果好
+    'complex': {'pre_max': 20, 'post_max': 20, 'pre_avg': 100, 'post_avg': 100, 'delta': 0.1, 'wait': 50},
+    # 簡化的能量檢測方法
+    'energy': {'delta': 0.15, 'wait': 30},
+    # 檢測結果過少時使用的寬鬆參數
+    'loose': {'delta': 0.05, 'wait': 20},
+}
+
+# 分析設定檔：onset 與節拍各使用哪個後端
+ANALYSIS_PROFILES = {
+    # librosa 的 mel 頻譜 onset 與動態規劃節拍追蹤（預設，最準確）
+    'accurate': {'onset': 'librosa', 'beat': 'librosa'},
+    # 純 NumPy 的頻譜通量與自相關節拍，適合大量匯入
+    'fast': {'onset': 'flux', 'beat': 'autocorr'},
+}
+DEFAULT_PROFILE = 'accurate'
+
+
+def default_peak_params(sr, hop_length):
+    """librosa.onset.onset_detect 的預設峰值挑選參數"""
+    return {
+        'pre_max': 0.03 * sr // hop_length,
+        'post_max': 0.00 * sr // hop_length + 1,
+        'pre_avg': 0.10 * sr // hop_length,
+        'post_avg': 0.10 * sr // hop_length + 1,
+        'wait': 0.03 * sr // hop_length,
+        'delta': 0.07,
+    }
+
+
+def normalize_envelope(envelope):
+    """將包絡線縮放到 0-1（與 onset_detect 的 normalize 相同）"""
+    envelope = np.asarray(envelope, dtype=np.float64)
+    envelope = envelope - envelope.min()
+    return envelope / (envelope.max() + np.finfo(envelope.dtype).tiny)
+
+
+def peak_pick(x, pre_max, post_max, pre_avg, post_avg, delta, wait):
+    """
+    以陣列運算挑選峰值，結果與 librosa.util.peak_pick 相同
+
+    x[n] 須為 x[n - pre_max:n + post_max] 的最大值、不低於 x[n - pre_avg:n + post_avg]
+    的平均加 delta，且與上一個峰值相隔超過 wait 個 frame。
+
+    Returns:
+        np.ndarray: 峰值的 frame 索引
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    if n == 0:
+        return np.array([], dtype=int)
+    pre_max, post_max, pre_avg, post_avg, wait = (
+        int(np.ceil(value)) for value in (pre_max, post_max, pre_avg, post_avg, wait))
+
+    padded = np.pad(x, (pre_max, post_max - 1), constant_values=x.min())
+    mov_max = np.lib.stride_tricks.sliding_window_view(padded, pre_max + post_max).max(axis=1)
+
+    # 邊界處只平均實際存在的 frame
+    cumulative = np.concatenate(([0.0], np.cumsum(x)))
+    index = np.arange(n)
+    lo = np.maximum(index - pre_avg, 0)
+    hi = np.minimum(index + post_avg, n)
+    mov_avg = (cumulative[hi] - cumulative[lo]) / (hi - lo)
+
+    candidates = np.flatnonzero((x == mov_max) & (x >= mov_avg + delta) & (x != 0))
+    if len(candidates) == 0 or wait == 0:
+        return candidates
+    peaks = []
+    last = -np.inf
+    for candidate in candidates:
+        if candidate > last + wait:
+            peaks.append(candidate)
+            last = candidate
+    return np.array(peaks, dtype=int)
+
+
+def frames_to_time(frames, sr, hop_length):
+    return np.asarray(frames) * hop_length / float(sr)
+
+
+class LibrosaOnsetDetector:
+    """librosa 的 mel 頻譜 onset 強度與峰值挑選（原本的檢測方式）"""
+
+    name = 'librosa'
+
+    def envelopes(self, y, sr, hop_length):
+        """
+        Returns:
+            tuple: (onset 檢測用包絡線, 節拍追蹤用包絡線)
+        """
+        import librosa
+        # 與 analyzer.log_mel_spectrogram / onset_envelopes 相同：mel 頻譜只算一次
+        S = librosa.power_to_db(librosa.feature.melspectrogram(y=y, sr=sr, hop_length=hop_length), top_db=80.0)
+        return (
+            librosa.onset.onset_strength(S=S, sr=sr, hop_length=hop_length),
+            librosa.onset.onset_strength(S=S, sr=sr, hop_length=hop_length, aggregate=np.median)
+        )
+
+    def detect(self, envelope, sr, hop_length, **params):
+        """由包絡線挑選 onset，回傳時間（秒）"""
+        import librosa
+        return librosa.onset.onset_detect(
+            onset_envelope=envelope, sr=sr, hop_length=hop_length, units='time', **params)
+
+
+class SpectralFluxOnsetDetector:
+    """
+    純 NumPy 的頻譜通量 onset 檢測
+
+    以較短的 FFT（預設 1024）計算功率譜，加總成對數間隔的頻帶（取代 mel 濾波器組的
+    矩陣乘法）後換算 dB（同樣以最大值往下 80 dB 截斷），取相鄰 frame 正向差值的平均；
+    峰值挑選使用與 librosa 相同規則的陣列版本。frame 與 librosa 同樣置中，
+    第 k 個 frame 對應 k * hop_length。
+    """
+
+    name = 'flux'
+
+    def __init__(self, n_fft=1024, n_bands=64, top_db=80.0):
+        self.n_fft = n_fft
+        self.n_bands = n_bands
+        self.top_db = top_db
+
+    def envelopes(self, y, sr, hop_length):
+        y = np.asarray(y, dtype=np.float32)
+        padded = np.pad(y, self.n_fft // 2)
+        if len(padded) < self.n_fft:
+            padded = np.pad(padded, (0, self.n_fft - len(padded)))
+        frames = np.lib.stride_tricks.sliding_window_view(padded, self.n_fft)[::hop_length]
+        frames = frames[:1 + len(y) // hop_length]
+        window = np.hanning(self.n_fft + 1)[:-1].astype(np.float32)
+        power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2
+
+        # 對數間隔的頻帶（略過直流與最低頻的 bin）
+        edges = np.unique(np.round(np.geomspace(2, self.n_fft // 2, self.n_bands + 1)).astype(int))
+        bands = np.add.reduceat(power, edges[:-1], axis=1)
+        db = 10.0 * np.log10(np.maximum(bands, 1e-10))
+        db = np.maximum(db, db.max() - self.top_db)
+
+        flux = np.zeros(len(frames))
+        flux[1:] = np.maximum(db[1:] - db[:-1], 0.0).mean(axis=1)
+        return flux, flux
+
+    def detect(self, envelope, sr, hop_length, **params):
+        if not np.any(envelope):
+            return np.array([])
+        kwargs = default_peak_params(sr, hop_length)
+        kwargs.update(params)
+        return frames_to_time(peak_pick(normalize_envelope(envelope), **kwargs), sr, hop_length)
+
+
+class LibrosaBeatTracker:
+    """librosa.beat.beat_track（tempogram 速度估計與動態規劃節拍追蹤）"""
+
+    name = 'librosa'
+
+    def track(self, envelope, sr, hop_length, bpm=None):
+        """
+        Returns:
+            tuple: (BPM, 節拍時間（秒）)
+        """
+        import librosa
+        tempo, beats = librosa.beat.beat_track(
+            onset_envelope=envelope, sr=sr, hop_length=hop_length, units='time', bpm=bpm)
+        return float(np.atleast_1d(tempo)[0]), beats
+
+
+class AutocorrelationBeatTracker:
+    """
+    以整首包絡線的自相關估計速度，再以梳狀濾波選擇相位的快速節拍追蹤
+
+    - 速度：包絡線稍微平滑後做一次 FFT 自相關（不計算逐 frame 的 tempogram），
+      以 start_bpm 為中心的對數常態先驗加權後取最大值，並以拋物線內插取得小於一個 frame 的週期
+    - 節拍：每拍由上一拍加一個週期預測，再對齊到前後 snap 比例週期內的包絡線最大值，
+      速度估計的小誤差不會累積成相位飄移；一個週期內的每個起點同時追蹤（向量化），
+      取節拍上包絡線總和最大的一組
+    """
+
+    name = 'autocorr'
+
+    def __init__(self, start_bpm=120.0, std_octaves=1.0, min_bpm=40.0, max_bpm=240.0, snap=0.1, smoothing=5):
+        self.start_bpm = start_bpm
+        self.smoothing = smoothing
+        self.std_octaves = std_octaves
+        self.min_bpm = min_bpm
+        self.max_bpm = max_bpm
+        self.snap = snap
+
+    def estimate_tempo(self, envelope, sr, hop_length):
+        fps = sr / hop_length
+        x = np.asarray(envelope, dtype=np.float64)
+        # onset 峰值只有一兩個 frame 寬，週期不是整數 frame 時自相關的峰會被削弱
+        x = np.convolve(x, np.hanning(self.smoothing + 2)[1:-1], mode='same')
+        x = x - x.mean()
+        size = 1 << int(np.ceil(np.log2(2 * len(x))))
+        spectrum = np.fft.rfft(x, size)
+        autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:len(x)]
+
+        min_lag = max(1, int(np.floor(60.0 * fps / self.max_bpm)))
+        max_lag = min(len(x) - 2, int(np.ceil(60.0 * fps / self.min_bpm)))
+        if max_lag <= min_lag:
+            return self.start_bpm
+        lags = np.arange(min_lag, max_lag + 1)
+        bpms = 60.0 * fps / lags
+        prior = np.exp(-0.5 * (np.log2(bpms / self.start_bpm) / self.std_octaves) ** 2)
+        score = np.maximum(autocorrelation[lags], 0.0) * prior
+        best = int(np.argmax(score))
+
+        # 拋物線內插
+        lag = float(lags[best])
+        if 0 < best < len(score) - 1:
+            left, center, right = score[best - 1:best + 2]
+            denominator = left - 2 * center + right
+            if denominator != 0:
+                lag += 0.5 * (left - right) / denominator
+        return 60.0 * fps / lag
+
+    def track(self, envelope, sr, hop_length, bpm=None):
+        envelope = np.asarray(envelope, dtype=np.float64)
+        if not np.any(envelope):
+            return 0.0, np.array([])
+        if bpm is None:
+            bpm = self.estimate_tempo(envelope, sr, hop_length)
+        period = 60.0 * sr / hop_length / bpm
+        n = len(envelope)
+        radius = max(1, int(self.snap * period))
+        padded = np.pad(envelope, radius, constant_values=-np.inf)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1)
+
+        # 每個起點同時逐拍預測並對齊到附近的包絡線最大值；超出結尾的以 n 標記
+        positions = np.arange(int(np.ceil(period)), dtype=np.float64)
+        paths = []
+        while True:
+            active = positions < n
+            if not active.any():
+                break
+            predicted = np.minimum(np.rint(positions).astype(int), n - 1)
+            beats = predicted + np.argmax(windows[predicted], axis=1) - radius
+            beats = np.where(active, beats, n)
+            paths.append(beats)
+            positions = np.where(active, beats + period, n)
+        paths = np.stack(paths, axis=1)
+        score = np.where(paths < n, envelope[np.minimum(paths, n - 1)], 0.0).sum(axis=1)
+        beats = paths[int(np.argmax(score))]
+        beats = beats[beats < n]
+
+        # 與 librosa 的 trim 相同：去掉開頭與結尾包絡線偏弱的節拍
+        threshold = 0.5 * np.sqrt(np.mean(envelope ** 2))
+        strong = np.flatnonzero(envelope[beats] > threshold)
+        if len(strong):
+            beats = beats[strong[0]:strong[-1] + 1]
+        return float(bpm), frames_to_time(np.unique(beats), sr, hop_length)
+
+
+ONSET_BACKENDS = {
+    LibrosaOnsetDetector.name: LibrosaOnsetDetector,
+    SpectralFluxOnsetDetector.name: SpectralFluxOnsetDetector,
+}
+
+BEAT_BACKENDS = {
+    LibrosaBeatTracker.name: LibrosaBeatTracker,
+    AutocorrelationBeatTracker.name: AutocorrelationBeatTracker,
+}
+
+
+def get_onset_backend(name):
+    if name not in ONSET_BACKENDS:
+        raise ValueError(f"Unknown onset backend: {name}")
+    return ONSET_BACKENDS[name]()
+
+
+def get_beat_backend(name):
+    if name not in BEAT_BACKENDS:
+        raise ValueError(f"Unknown beat backend: {name}")
+    return BEAT_BACKENDS[name]()
@@ -0,0 +1,200 @@
+import json
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+
+logger = logging.getLogger(__name__)
+
+_YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com')
+
+
+def extract_video_id(url):
+    """
+    由連結取得 YouTube 影片 ID（不連網）
+
+    支援 watch?v=、youtu.be/、embed/、v/、shorts/ 形式；無法辨識時回傳 None。
+    """
+    if not url:
+        return None
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    parts = [part for part in parsed.path.split('/') if part]
+    if host in ('youtu.be', 'www.youtu.be'):
+        return parts[0] if parts else None
+    if host in _YOUTUBE_HOSTS:
+        if parsed.path == '/watch':
+            return parse_qs(parsed.query).get('v', [None])[0]
+        if len(parts) >= 2 and parts[0] in ('embed', 'v', 'shorts'):
+            return parts[1]
+    return None
+
+
+def download_key(url):
+    """下載去重與快取使用的鍵：影片 ID，非 YouTube 連結則為連結本身"""
+    video_id = extract_video_id(url)
+    return f"youtube:{video_id}" if video_id else url.strip()
+
+
+class DownloadQueueFull(Exception):
+    """等待中的下載已達上限"""
+
+
+class DownloadManager:
+    """
+    有上限的下載工作佇列
+
+    - 固定數量的下載工作者，超過 max_pending 的請求直接拒絕，不會無限制地開執行緒
+    - 同一部影片正在下載時，重複的請求共用同一個工作（同一個 job_id）
+    - 已完成的下載依影片 ID 記錄在 JSON 檔，檔案仍存在時直接回傳，不再下載
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, cache_path="rhythm_game/downloads.json", spawn=None):
+        """
+        Args:
+            max_workers (int): 同時進行的下載數量
+            max_pending (int): 等待中與執行中的下載數上限
+            cache_path (str): 已完成下載的記錄檔，None 表示只保存在記憶體
+            spawn (callable): 啟動背景工作的函數（例如 socketio.start_background_task）
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(self.max_workers, int(max_pending))
+        self.cache_path = Path(cache_path) if cache_path else None
+        self._spawn = spawn or self._spawn_thread
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._workers_started = False
+        self._records = self._load()
+        self._counters = {'queued': 0, 'joined': 0, 'cached': 0, 'rejected': 0}
+
+    @staticmethod
+    def _spawn_thread(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _load(self):
+        try:
+            if self.cache_path is not None and self.cache_path.exists():
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load download cache: {e}")
+        return {}
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._records, f, indent=2, ensure_ascii=False)
+            tmp_path.replace(self.cache_path)
+        except Exception as e:
+            logger.warning(f"Failed to save download cache: {e}")
+
+    def _ensure_workers(self):
+        if self._workers_started:
+            return
+        self._workers_started = True
+        for _ in range(self.max_workers):
+            self._spawn(self._worker)
+
+    @property
+    def pending(self):
+        """等待中或執行中的下載數"""
+        return len(self._inflight)
+
+    def get_cached(self, url):
+        """
+        取得已完成的下載
+
+        Returns:
+            dict or None: audio_path、title、url 與 downloaded_at；檔案已不存在時為 None
+        """
+        key = download_key(url)
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                return None
+            if not Path(record['audio_path']).exists():
+                # 檔案被刪除後不再使用此記錄
+                del self._records[key]
+                self._save()
+                return None
+            self._counters['cached'] += 1
+            return dict(record)
+
+    def remember(self, url, audio_path, title):
+        """記錄已完成的下載（或更新為轉檔後的檔案）"""
+        with self._lock:
+            self._records[download_key(url)] = {
+                'audio_path': audio_path,
+                'title': title,
+                'url': url,
+                'downloaded_at': time.time()
+            }
+            self._save()
+
+    def submit(self, url, create_job, task, kind='download'):
+        """
+        送出下載；同一部影片正在下載時共用原本的工作
+
+        Args:
+            url (str): 影片連結
+            create_job (callable): create_job() 建立新工作並回傳 job_id
+            task (callable): task(job_id, url) 在下載工作者中執行，
+                成功時回傳 (音訊路徑, 標題)，失敗時回傳 None 或 (None, None)
+            kind (str): 工作種類；只有相同種類的請求會共用工作
+
+        Returns:
+            tuple: (job_id, 是否為新工作)
+
+        Raises:
+            DownloadQueueFull: 等待中的下載已達 max_pending
+        """
+        key = (kind, download_key(url))
+        with self._lock:
+            job_id = self._inflight.get(key)
+            if job_id is not None:
+                self._counters['joined'] += 1
+                return job_id, False
+            if len(self._inflight) >= self.max_pending:
+                self._counters['rejected'] += 1
+                raise DownloadQueueFull(f"{len(self._inflight)} downloads pending")
+            job_id = create_job()
+            self._inflight[key] = job_id
+            self._counters['queued'] += 1
+            self._ensure_workers()
+        self._queue.put((key, job_id, url, task))
+        return job_id, True
+
+    def _worker(self):
+        while True:
+            key, job_id, url, task = self._queue.get()
+            try:
+                result = task(job_id, url)
+                if result and result[0]:
+                    self.remember(url, *result)
+            except Exception as e:
+                logger.error(f"Download task failed: {e}")
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                self._queue.task_done()
+
+    def join(self):
+        """等待所有已送出的下載完成"""
+        self._queue.join()
+
+    def get_metrics(self):
+        with self._lock:
+            return {'pending': len(self._inflight), 'cached_entries': len(self._records), **self._counters}
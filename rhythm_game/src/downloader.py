@@ -1,5 +1,5 @@
 import os
-import yt_dlp
+import copy
 import re
 from pathlib import Path
 import time
@@ -10,6 +10,8 @@ class YouTubeDownloader:
     def __init__(self, download_dir="rhythm_game/assets"):
         self.download_dir = Path(download_dir)
         self.download_dir.mkdir(parents=True, exist_ok=True)
+        # 下載中的檔案以影片 ID 命名暫存於此，完成後才移到 download_dir
+        self.staging_dir = self.download_dir / '.downloading'
     
     def sanitize_filename(self, filename):
         """清理檔案名稱，移除非法字符"""
@@ -97,72 +99,97 @@ class YouTubeDownloader:
             
         return opts
     
-    def download_audio(self, youtube_url, progress_callback=None):
+    def download_audio(self, youtube_url, progress_callback=None, extract_audio=True):
         """
         下載 YouTube 音樂為 wav 格式
         
         Args:
             youtube_url (str): YouTube 影片連結
             progress_callback (callable): 進度回調函數，接收進度資訊
+            extract_audio (bool): 是否以 FFmpeg 轉為 wav；False 時保留原始音訊格式（通常為 m4a），
+                由之後的分析流程直接解碼
             
         Returns:
             tuple: (下載成功的檔案路徑, 歌曲標題) 或 (None, None) 如果失敗
         """
+        # yt-dlp 載入約需 0.3 秒，只在實際下載時才匯入
+        import yt_dlp
+        
         max_retries = 3
         retry_delay = 2
+        # 影片資訊只擷取一次，重試下載時沿用
+        info = None
         
         for attempt in range(max_retries):
             try:
                 print(f"嘗試下載 (第 {attempt + 1} 次): {youtube_url}")
                 
-                # 先獲取影片資訊
-                info_opts = self.get_ydl_opts('%(title)s.%(ext)s')
-                info_opts['quiet'] = True
-                
-                with yt_dlp.YoutubeDL(info_opts) as ydl:
-                    try:
-                        # 取得影片資訊但不下載
-                        info = ydl.extract_info(youtube_url, download=False)
-                        title = info.get('title', 'unknown')
-                        duration = info.get('duration', 0)
-                        
-                        # 檢查影片長度（避免下載過長的影片）
-                        if duration > 600:  # 10分鐘
-                            print(f"警告: 影片長度 {duration//60}:{duration%60:02d}，可能較長")
-                        
-                        clean_title = self.sanitize_filename(title)
-                        print(f"影片標題: {title}")
-                        print(f"清理後檔名: {clean_title}")
-                        
-                    except Exception as e:
-                        print(f"獲取影片資訊失敗: {str(e)}")
-                        if attempt < max_retries - 1:
-                            print(f"等待 {retry_delay} 秒後重試...")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2
-                            continue
-                        else:
-                            return None, None
+                # 同一個 YoutubeDL 先取得影片資訊，再以該資訊下載，不必重新解析頁面。
+                # 選項在建立前就全部決定：先以影片 ID 下載到暫存資料夾，完成後再改為清理後的標題，
+                # 暫存檔不會與既有的音訊同名
+                opts = self.get_ydl_opts(str(self.staging_dir / '%(id)s.%(ext)s'), progress_callback)
+                if not extract_audio:
+                    opts['postprocessors'] = []
+                    opts['extractaudio'] = False
                 
-                # 設定下載選項
-                download_template = str(self.download_dir / f'{clean_title}.%(ext)s')
-                download_opts = self.get_ydl_opts(download_template, progress_callback)
+                with yt_dlp.YoutubeDL(opts) as ydl:
+                    if info is None:
+                        try:
+                            # 取得影片資訊但不下載
+                            info = ydl.extract_info(youtube_url, download=False)
+                        except Exception as e:
+                            print(f"獲取影片資訊失敗: {str(e)}")
+                            if attempt < max_retries - 1:
+                                print(f"等待 {retry_delay} 秒後重試...")
+                                time.sleep(retry_delay)
+                                retry_delay *= 2
+                                continue
+                            else:
+                                return None, None
+                    
+                    title = info.get('title', 'unknown')
+                    duration = info.get('duration') or 0
+                    
+                    # 檢查影片長度（避免下載過長的影片）
+                    if duration > 600:  # 10分鐘
+                        print(f"警告: 影片長度 {int(duration)//60}:{int(duration)%60:02d}，可能較長")
+                    
+                    clean_title = self.sanitize_filename(title)
+                    print(f"影片標題: {title}")
+                    print(f"清理後檔名: {clean_title}")
+                    
+                    print(f"開始下載音頻...")
+                    
+                    # 執行下載
+                    result = ydl.process_ie_result(copy.deepcopy(info), download=True)
                 
-                print(f"開始下載音頻...")
+                # 後處理（轉檔）後的實際檔案路徑
+                downloaded = None
+                for download in (result or {}).get('requested_downloads') or []:
+                    filepath = download.get('filepath')
+                    if filepath and Path(filepath).exists():
+                        downloaded = Path(filepath)
+                        break
                 
-                # 執行下載
-                with yt_dlp.YoutubeDL(download_opts) as ydl:
-                    ydl.download([youtube_url])
+                # 沒有回報路徑時依影片 ID 尋找
+                video_id = self.sanitize_filename(str(info.get('id', '')))
+                if downloaded is None:
+                    for ext in ['wav', 'mp3', 'm4a', 'webm', 'mp4']:
+                        candidate_file = self.staging_dir / f"{video_id}.{ext}"
+                        if video_id and candidate_file.exists():
+                            downloaded = candidate_file
+                            break
                 
-                # 檢查下載的檔案
-                possible_extensions = ['wav', 'mp3', 'm4a', 'webm', 'mp4']
+                # 以清理後的標題命名；已有同名檔案（不同影片清理後標題相同）時加上影片 ID，
+                # 不覆蓋其他譜面與試聽片段使用中的音訊
                 audio_file = None
-                
-                for ext in possible_extensions:
-                    candidate_file = self.download_dir / f"{clean_title}.{ext}"
-                    if candidate_file.exists():
-                        audio_file = candidate_file
-                        break
+                if downloaded is not None:
+                    audio_file = self.download_dir / f"{clean_title}{downloaded.suffix}"
+                    if audio_file.exists() and video_id:
+                        # 同一部影片重新下載時取代自己的 <標題>_<影片 ID> 檔案
+                        audio_file = self.download_dir / f"{clean_title}_{video_id}{downloaded.suffix}"
+                        print(f"已有同名檔案，改存為: {audio_file.name}")
+                    downloaded.replace(audio_file)
                 
                 if audio_file and audio_file.exists():
                     print(f"下載完成: {audio_file}")
@@ -233,12 +260,14 @@ class YouTubeDownloader:
     def get_downloaded_files(self):
         """取得已下載的音樂檔案清單"""
         audio_files = []
-        for ext in ['*.wav', '*.mp3', '*.m4a', '*.webm']:
+        for ext in ['*.wav', '*.mp3', '*.m4a', '*.webm', '*.flac']:
             audio_files.extend(self.download_dir.glob(ext))
         return audio_files
     
     def test_connection(self):
         """測試 YouTube 連接"""
+        import yt_dlp
+        
         test_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"  # Rick Roll - 應該總是可用
         
         try:
@@ -0,0 +1,143 @@
+import numpy as np
+
+
+def _click(sr, frequency, decay, length=0.08):
+    # 指數衰減的正弦波打擊聲
+    t = np.arange(int(length * sr)) / sr
+    return np.exp(-t / decay) * np.sin(2 * np.pi * frequency * t)
+
+
+def _noise_burst(sr, decay, rng, length=0.08):
+    # 指數衰減的白噪音（小鼓、腳踏鈸）
+    t = np.arange(int(length * sr)) / sr
+    return np.exp(-t / decay) * rng.standard_normal(len(t))
+
+
+def synthesize_track(bpm, seconds, sr=22050, pattern='drums', seed=0, noise=0.0):
+    """
+    合成固定速度、已知 onset 與節拍時間的測試音訊
+
+    Args:
+        bpm (float): 速度
+        seconds (float): 長度（秒）
+        sr (int): 取樣率
+        pattern (str): 'click'（每拍一聲）或 'drums'（大鼓、小鼓與八分音符腳踏鈸）
+        seed (int): 亂數種子（噪音與打擊聲的隨機成分）
+        noise (float): 背景白噪音的振幅
+
+    Returns:
+        tuple: (音訊, onset 時間, 節拍時間)
+    """
+    return synthesize_sections([(seconds, bpm)], sr, pattern, seed, noise)
+
+
+def synthesize_sections(sections, sr=22050, pattern='drums', seed=0, noise=0.0):
+    """
+    依段落合成測試音訊，可包含變速與無聲段落
+
+    每段從拍點重新開始；bpm 為 0 或 None 的段落為無聲（只有背景噪音）。
+
+    Args:
+        sections (list): [(段落長度（秒）, bpm), ...]
+        其餘參數同 synthesize_track
+
+    Returns:
+        tuple: (音訊, onset 時間, 節拍時間)
+    """
+    rng = np.random.default_rng(seed)
+    total = sum(length for length, _ in sections)
+    y = np.zeros(int(total * sr), dtype=np.float64)
+    kick = _click(sr, 60.0, 0.04) * 0.9
+    snare = _noise_burst(sr, 0.03, rng) * 0.4 + _click(sr, 200.0, 0.02) * 0.3
+    click = _click(sr, 1000.0, 0.01) * 0.6
+    if pattern not in ('click', 'drums'):
+        raise ValueError(f"Unknown pattern: {pattern}")
+
+    events = []
+    beat_times = []
+    section_start = 0.0
+    for length, bpm in sections:
+        section_end = section_start + length
+        if bpm:
+            beat = 60.0 / bpm
+            # 第一段開頭留 0.5 秒空白，和譜面的開頭延遲一致
+            first = section_start + (0.5 if section_start == 0 else 0.0)
+            beats = np.arange(first, section_end - 0.1, beat)
+            beat_times.extend(beats)
+            for index, time in enumerate(beats):
+                if pattern == 'click':
+                    events.append((time, click))
+                    continue
+                events.append((time, kick if index % 2 == 0 else snare))
+                # 反拍的腳踏鈸
+                offbeat = time + beat / 2
+                if offbeat < section_end - 0.1:
+                    events.append((offbeat, _noise_burst(sr, 0.01, rng) * 0.15))
+        section_start = section_end
+
+    for time, sound in events:
+        start = int(round(time * sr))
+        end = min(len(y), start + len(sound))
+        y[start:end] += sound[:end - start]
+    if noise:
+        y += noise * rng.standard_normal(len(y))
+    onset_times = np.array(sorted(time for time, _ in events))
+    return y.astype(np.float32), onset_times, np.array(beat_times)
+
+
+def dominant_tempo(sections):
+    """段落中總長度最長的速度，作為整首 BPM 的參考值"""
+    lengths = {}
+    for length, bpm in sections:
+        if bpm:
+            lengths[bpm] = lengths.get(bpm, 0.0) + length
+    return max(lengths, key=lengths.get) if lengths else 0.0
+
+
+def match_events(reference, estimated, window=0.05):
+    """
+    一對一配對兩組事件時間（皆須已排序），時間差不超過 window 秒者視為命中
+
+    Returns:
+        int: 命中數
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    estimated = np.asarray(estimated, dtype=np.float64)
+    hits = 0
+    i = j = 0
+    while i < len(reference) and j < len(estimated):
+        difference = estimated[j] - reference[i]
+        if abs(difference) <= window:
+            hits += 1
+            i += 1
+            j += 1
+        elif difference < 0:
+            j += 1
+        else:
+            i += 1
+    return hits
+
+
+def onset_f_measure(reference, estimated, window=0.05):
+    """
+    onset 檢測的 precision、recall 與 F-measure（容許誤差 window 秒，預設 50 ms）
+
+    Returns:
+        dict: {'precision', 'recall', 'f_measure'}
+    """
+    reference = np.sort(np.asarray(reference, dtype=np.float64))
+    estimated = np.sort(np.asarray(estimated, dtype=np.float64))
+    if len(reference) == 0 and len(estimated) == 0:
+        return {'precision': 1.0, 'recall': 1.0, 'f_measure': 1.0}
+    hits = match_events(reference, estimated, window)
+    precision = hits / len(estimated) if len(estimated) else 0.0
+    recall = hits / len(reference) if len(reference) else 0.0
+    f_measure = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f_measure': f_measure}
+
+
+def tempo_error(reference_bpm, estimated_bpm):
+    """BPM 的相對誤差；估計為兩倍或一半速度時以較接近者計算（八度誤差）"""
+    if not reference_bpm or not estimated_bpm:
+        return 1.0
+    return min(abs(estimated_bpm * factor - reference_bpm) / reference_bpm for factor in (1.0, 0.5, 2.0))
@@ -0,0 +1,430 @@
+import io
+import os
+import queue
+import time
+import logging
+import threading
+import contextlib
+import multiprocessing
+import multiprocessing.util
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from rhythm_game.src.stages import StageGraph
+from rhythm_game.src.detectors import DEFAULT_PROFILE
+from rhythm_game.src.waveform import peaks_path, write_peaks
+
+
+logger = logging.getLogger(__name__)
+
+# 子行程內重複使用的分析器（每個分析行程各一個）
+_worker_analyzer = None
+# 分析行程內分段計算 onset 包絡線的行程池（segment_workers > 1 時才建立）
+_segment_pool = None
+# 此分析行程暖機花費的秒數（未暖機時為 None）
+_worker_warm_up_seconds = None
+
+
+def _get_worker_analyzer(segment_workers=0, profile=DEFAULT_PROFILE):
+    global _worker_analyzer
+    if _worker_analyzer is None:
+        from rhythm_game.src.analyzer import AudioAnalyzer
+        _worker_analyzer = AudioAnalyzer(debug=False)
+    _worker_analyzer.segment_executor = _get_segment_pool(segment_workers)
+    if _worker_analyzer.profile != profile:
+        _worker_analyzer.set_profile(profile)
+    return _worker_analyzer
+
+
+def _get_segment_pool(workers):
+    global _segment_pool
+    if workers < 2:
+        return None
+    if _segment_pool is None:
+        # 分段行程只計算包絡線，不需要暖機；沿用同一個 numba 快取
+        _segment_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(os.environ.get('NUMBA_CACHE_DIR'), False)
+        )
+        # 分析行程結束時會等待所有子行程，必須在佇列的 finalizer（優先度 10）之前關閉分段行程池
+        multiprocessing.util.Finalize(None, _segment_pool.shutdown, exitpriority=100)
+    return _segment_pool
+
+
+def warm_up_analyzer(duration=6.0):
+    """
+    以合成的節拍訊號跑過一次完整的分析流程
+
+    librosa 的 numba 函數第一次呼叫時才編譯（或從磁碟快取載入），
+    暖機讓這段成本發生在行程啟動時，而不是第一個產生譜面的請求。
+
+    Args:
+        duration (float): 合成訊號長度（秒）
+
+    Returns:
+        float: 暖機花費的秒數
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    analyzer = _get_worker_analyzer()
+    sr = analyzer.sr
+    t = np.arange(int(duration * sr)) / sr
+    # 120 BPM 的打擊聲加上持續的和弦，onset、節拍與頻譜特徵都有內容
+    y = 0.2 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 330 * t)
+    click = np.exp(-np.arange(int(0.05 * sr)) / (0.01 * sr)) * np.sin(2 * np.pi * 1000 * t[:int(0.05 * sr)])
+    for beat in np.arange(0, duration, 0.5):
+        start = int(beat * sr)
+        y[start:start + len(click)] += click[:len(y) - start]
+    y = y.astype(np.float32)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for method in ('balanced_beat', 'energy'):
+            analyzer.generate_chart('warm_up', method=method, audio_data=y)
+    return time.perf_counter() - started
+
+
+def _init_worker(numba_cache_dir, warm_up, ready_queue=None):
+    # 分析行程的 initializer：必須在匯入 numba 前設定快取位置
+    global _worker_warm_up_seconds
+    if numba_cache_dir:
+        os.environ['NUMBA_CACHE_DIR'] = str(Path(numba_cache_dir).resolve())
+    if warm_up:
+        try:
+            _worker_warm_up_seconds = warm_up_analyzer()
+        except Exception as e:
+            logger.warning(f"Analysis worker warm-up failed: {e}")
+            _worker_warm_up_seconds = 0.0
+    if ready_queue is not None:
+        # 回報此行程已完成初始化
+        ready_queue.put((os.getpid(), _worker_warm_up_seconds))
+
+
+def _worker_status():
+    """回傳 (行程 ID, 暖機秒數)"""
+    return os.getpid(), _worker_warm_up_seconds
+
+
+def generate_chart_job(audio_path, song_title=None, method='balanced_beat', preview_cache=None, segment_workers=0,
+                       profile=DEFAULT_PROFILE):
+    """
+    在分析行程中產生並儲存譜面
+
+    Args:
+        preview_cache (PreviewCache): 提供時順便以已解碼的音訊產生試聽片段
+        segment_workers (int): 大於 1 時長音訊的 onset 包絡線以這麼多個行程分段平行計算
+        profile (str): 分析設定檔（'accurate'、'fast'）
+
+    Returns:
+        tuple: (譜面資料, 譜面路徑, 各步驟秒數)；失敗時為 (None, None, 各步驟秒數)
+    """
+    analyzer = _get_worker_analyzer(segment_workers, profile)
+    chart_data = analyzer.generate_chart(audio_path, song_title=song_title, method=method)
+    timings = dict(analyzer.stage_timings)
+    if not chart_data:
+        return None, None, timings
+
+    # 儲存譜面與試聽片段互不相依，同時進行
+    graph = StageGraph()
+    graph.add('save', lambda: analyzer.save_chart(chart_data))
+    if preview_cache is not None:
+        graph.add('preview', lambda: _generate_preview(preview_cache, audio_path, analyzer))
+    results = graph.run()
+    timings.update(graph.timings)
+    return chart_data, results['save'], timings
+
+
+def _generate_preview(preview_cache, audio_path, analyzer):
+    # 試聽片段失敗不影響譜面產生；沿用分析時的 onset 包絡線
+    if preview_cache is None:
+        return
+    try:
+        preview_cache.generate(audio_path, y=analyzer.audio_data, sr=analyzer.sr,
+                               onset_envelope=analyzer.onset_envelope, hop_length=analyzer.hop_length)
+    except Exception as e:
+        logger.warning(f"Preview generation failed for {audio_path}: {e}")
+
+
+# 練習譜面的音訊片段存放於音訊資料夾下的子資料夾
+PRACTICE_DIR = 'practice'
+
+
+def practice_name(audio_path, start, end):
+    """練習譜面與音訊片段的檔名（不含副檔名），以原曲檔名開頭，刪除原曲時一併刪除"""
+    return f"{Path(audio_path).stem}_practice_{int(round(start * 1000))}-{int(round(end * 1000))}"
+
+
+def practice_clips(audio_path):
+    """原曲的所有練習音訊片段"""
+    audio_path = Path(audio_path)
+    return list((audio_path.parent / PRACTICE_DIR).glob(f"{audio_path.stem}_practice_*.flac"))
+
+
+def section_chart_job(audio_path, start, end, song_title=None, method='balanced_beat', segment_workers=0,
+                      profile=DEFAULT_PROFILE):
+    """
+    在分析行程中產生 [start, end] 範圍的練習譜面
+
+    練習音訊片段以 FLAC 存於原曲旁的 practice/ 資料夾，譜面的 audio_file 指向片段，
+    遊戲從片段開頭播放即可，不需要跳到原曲的 start。
+
+    Returns:
+        tuple: (譜面資料, 譜面路徑, 各步驟秒數)；失敗時為 (None, None, 各步驟秒數)
+    """
+    import soundfile as sf
+
+    analyzer = _get_worker_analyzer(segment_workers, profile)
+    chart_data, clip, sr = analyzer.generate_section_chart(
+        audio_path, start, end, song_title=song_title, method=method)
+    timings = dict(analyzer.stage_timings)
+    if not chart_data:
+        return None, None, timings
+
+    section = chart_data['section']
+    name = practice_name(audio_path, section['start'], section['end'])
+    clip_path = Path(audio_path).parent / PRACTICE_DIR / f"{name}.flac"
+    chart_data['audio_file'] = f"{PRACTICE_DIR}/{clip_path.name}"
+
+    def write_clip():
+        clip_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = clip_path.with_name(clip_path.name + '.tmp')
+        sf.write(str(tmp_path), clip, sr, format='FLAC')
+        tmp_path.replace(clip_path)
+
+    # 片段與譜面互不相依，同時寫入
+    graph = StageGraph()
+    graph.add('clip', write_clip)
+    graph.add('save', lambda: analyzer.save_chart(chart_data, f"{name}.json"))
+    results = graph.run()
+    timings.update(graph.timings)
+    return chart_data, results['save'], timings
+
+
+# 瀏覽器可直接播放的音訊格式；其他格式（例如含影像的 mp4）需轉檔後才提供
+BROWSER_AUDIO_EXTENSIONS = ('.m4a', '.mp3', '.ogg', '.opus', '.webm', '.wav', '.flac')
+
+
+def pipeline_chart_job(source_path, song_title=None, method='balanced_beat', preview_cache=None, segment_workers=0,
+                       profile=DEFAULT_PROFILE):
+    """
+    在分析行程中完成下載後的所有步驟：解碼 → 分析 → 轉檔 → 儲存譜面 → 波形峰值與試聽片段
+
+    音訊只解碼一次，解碼後的資料直接交給分析器；原始檔可直接播放時不轉檔，
+    否則以同一份解碼結果編碼為 FLAC 供遊戲播放，不再經過 wav 暫存檔。
+    各步驟以 StageGraph 執行：轉檔與波形峰值只依賴解碼結果，與分析同時進行；
+    試聽片段需要分析的包絡線與轉檔後的檔案。
+
+    Returns:
+        tuple: (譜面資料, 譜面路徑, 遊戲使用的音訊路徑, 各步驟秒數)；失敗時譜面資料為 None
+    """
+    import librosa
+    import soundfile as sf
+
+    analyzer = _get_worker_analyzer(segment_workers, profile)
+    source = Path(source_path)
+    transcode = source.suffix.lower() not in BROWSER_AUDIO_EXTENSIONS
+    audio_path = source.with_suffix('.flac') if transcode else source
+
+    def decode():
+        if transcode:
+            # 保留原始取樣率與聲道作為播放用音訊，分析用的單聲道由同一份資料重新取樣
+            native, native_sr = librosa.load(str(source), sr=None, mono=False)
+            y = librosa.resample(librosa.to_mono(native), orig_sr=native_sr, target_sr=analyzer.sr)
+            return y, native, native_sr
+        y, _ = librosa.load(str(source), sr=analyzer.sr)
+        return y, None, None
+
+    def analyze(decode):
+        return analyzer.generate_chart(str(audio_path), song_title=song_title, method=method, audio_data=decode[0])
+
+    def encode(decode):
+        _, native, native_sr = decode
+        sf.write(str(audio_path), native.T, native_sr, format='FLAC')
+
+    graph = StageGraph()
+    graph.add('decode', decode)
+    graph.add('analyze', analyze, deps=('decode',))
+    if transcode:
+        graph.add('encode', encode, deps=('decode',))
+    # 波形峰值沿用同一份解碼結果，寫在播放用音訊旁（轉檔時需晚於音訊檔，才不會被視為過期）
+    graph.add('peaks', lambda decode, **_: write_peaks(audio_path, decode[0], analyzer.sr),
+              deps=('decode', 'encode') if transcode else ('decode',))
+    graph.add('save', lambda analyze: analyzer.save_chart(analyze) if analyze else None, deps=('analyze',))
+    if preview_cache is not None:
+        graph.add('preview',
+                  lambda analyze, **_: _generate_preview(preview_cache, audio_path, analyzer) if analyze else None,
+                  deps=('analyze', 'encode') if transcode else ('analyze',))
+    chart_data = None
+    try:
+        results = graph.run()
+        chart_data = results['analyze']
+    finally:
+        timings = dict(graph.timings)
+        if 'analyze' in timings:
+            # 分析內部各步驟（features、onsets_*、beats、merge、lanes）
+            timings.update(analyzer.stage_timings)
+        if transcode and not chart_data:
+            # 分析失敗或任一步驟拋出例外時保留原始檔，移除已轉好的檔案
+            # （graph.run() 會等執行中的步驟結束才拋出，此時已不會再寫入）
+            audio_path.unlink(missing_ok=True)
+            peaks_path(audio_path).unlink(missing_ok=True)
+
+    if not chart_data:
+        return None, None, source.as_posix(), timings
+    if transcode:
+        source.unlink()
+    return chart_data, results['save'], audio_path.as_posix(), timings
+
+
+class AnalysisExecutor:
+    """
+    CPU 密集分析工作的行程池
+
+    librosa 分析會佔用 CPU 並持有 GIL，放在網頁行程內執行會卡住 Socket.IO
+    的事件迴圈。此類別將工作送往獨立的分析行程，並以協作式輪詢等待結果，
+    在 threading / eventlet 模式下都不會阻塞其他連線。
+    """
+
+    def __init__(self, max_workers=None, sleep=None, warm_up=True, numba_cache_dir=None):
+        """
+        Args:
+            max_workers (int): 分析行程數量，預設為 CPU 數減一（至少 1）
+            sleep (callable): 等待時使用的 sleep 函數（例如 socketio.sleep）
+            warm_up (bool): 分析行程啟動時先跑一次分析流程，編譯 numba 函數
+            numba_cache_dir (str): numba 編譯結果的磁碟快取資料夾，所有分析行程共用
+        """
+        if not max_workers:
+            max_workers = max(1, (os.cpu_count() or 2) - 1)
+        self.max_workers = max_workers
+        self.sleep = sleep or time.sleep
+        self.warm_up = warm_up
+        self.numba_cache_dir = numba_cache_dir
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        # 分析行程在 initializer 結束時回報 (行程 ID, 暖機秒數) 的佇列
+        self._ready_queue = None
+        # 已完成暖機的分析行程：{行程 ID: 暖機秒數}
+        self._warm_workers = {}
+        self._ready = threading.Event()
+        self._started = False
+        if not warm_up:
+            self._ready.set()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.numba_cache_dir:
+                    Path(self.numba_cache_dir).mkdir(parents=True, exist_ok=True)
+                # 使用 spawn，避免把 monkey patch 過的網頁行程狀態 fork 給子行程
+                context = multiprocessing.get_context('spawn')
+                self._ready_queue = context.Queue() if self.warm_up else None
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self.numba_cache_dir, self.warm_up, self._ready_queue)
+                )
+                logger.info(f"Started analysis pool with {self.max_workers} workers")
+            return self._pool
+
+    def start(self):
+        """
+        立即啟動所有分析行程並在背景暖機
+
+        暖機在各行程的 initializer 中執行，行程完成暖機前不會接到工作，
+        因此第一個請求不必負擔 numba 編譯時間。各行程的 initializer 結束時回報行程 ID，
+        收到 max_workers 個不同行程的回報後 ready 才為 True。重複呼叫不會再次啟動。
+        """
+        pool = self._get_pool()
+        with self._lock:
+            started, self._started = self._started, True
+        if self.warm_up and not started:
+            # spawn 的行程池在送出工作時才建立行程，每個工作建立一個，直到 max_workers
+            for _ in range(self.max_workers):
+                pool.submit(_worker_status)
+
+    def _collect_reports(self):
+        """取出分析行程的回報（不阻塞）；max_workers 個不同的行程都回報後設定為就緒"""
+        ready_queue = self._ready_queue
+        if ready_queue is None or self._ready.is_set():
+            return
+        while True:
+            try:
+                pid, seconds = ready_queue.get_nowait()
+            except queue.Empty:
+                break
+            except (OSError, ValueError):
+                # 佇列已隨 shutdown 關閉
+                return
+            with self._lock:
+                self._warm_workers[pid] = seconds
+            logger.info(f"Analysis worker {pid} warmed up in {seconds or 0:.2f}s")
+        with self._lock:
+            if len(self._warm_workers) >= self.max_workers:
+                self._ready.set()
+
+    @property
+    def ready(self):
+        """所有分析行程都已完成暖機"""
+        self._collect_reports()
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None, poll_interval=0.1):
+        """協作式等待暖機完成，回傳是否已就緒"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self.sleep(poll_interval)
+        return True
+
+    def get_status(self):
+        self._collect_reports()
+        with self._lock:
+            return {
+                'ready': self._ready.is_set(),
+                'workers': self.max_workers,
+                'warm_workers': len(self._warm_workers),
+                'warm_up_seconds': sorted(seconds or 0.0 for seconds in self._warm_workers.values())
+            }
+
+    @property
+    def pending(self):
+        """等待中或執行中的工作數"""
+        return self._pending
+
+    def submit(self, fn, *args, **kwargs):
+        """送出工作，回傳 concurrent.futures.Future"""
+        future = self._get_pool().submit(fn, *args, **kwargs)
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def run(self, fn, *args, poll_interval=0.1, **kwargs):
+        """送出工作並協作式等待結果（例外會原樣拋出）"""
+        future = self.submit(fn, *args, **kwargs)
+        while not future.done():
+            self.sleep(poll_interval)
+        return future.result()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._started = False
+        if pool is not None:
+            pool.shutdown(wait=wait)
+        if self.warm_up:
+            with self._lock:
+                ready_queue, self._ready_queue = self._ready_queue, None
+                self._warm_workers.clear()
+            self._ready.clear()
+            if ready_queue is not None:
+                ready_queue.close()
@@ -0,0 +1,258 @@
+import time
+import bisect
+import functools
+import threading
+
+
+# Prometheus 預設的延遲 bucket（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 長時間工作（下載、譜面產生）使用的 bucket（秒）
+JOB_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape_label(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """指標基底類別：名稱、說明與標籤"""
+
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+        try:
+            return tuple(str(labels[name]) for name in self.labelnames)
+        except KeyError:
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}'
+        ]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self):
+        raise NotImplementedError
+
+
+class _CallbackMixin:
+    """支援以回呼函數於輸出時取值的指標"""
+
+    def set_function(self, function):
+        """
+        輸出時呼叫 function() 取得數值
+
+        無標籤時回傳單一數值；有標籤時回傳 {標籤值 tuple: 數值} 字典
+        """
+        self._function = function
+
+    def _collect(self):
+        if self._function is None:
+            with self._lock:
+                return sorted(self._values.items())
+        try:
+            value = self._function()
+        except Exception:
+            return []
+        if self.labelnames:
+            return sorted((tuple(str(v) for v in key), val) for key, val in value.items())
+        return [((), value)]
+
+    def _render_samples(self):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in self._collect()]
+
+
+class Counter(_CallbackMixin, _Metric):
+    """只增不減的計數器"""
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def items(self):
+        """回傳 {標籤值 tuple: 數值} 的複本"""
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(_CallbackMixin, _Metric):
+    """可增可減的量測值，也可綁定回呼函數於輸出時取值"""
+
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = function
+
+    def set(self, value, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    分布統計（延遲等）
+
+    每次 observe 只做一次二分搜尋與數個整數加法，適合在正式環境常駐開啟。
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每組標籤: [各 bucket 計數（非累積，最後一格為 +Inf）, 總和, 次數]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        """計時用的 context manager / decorator"""
+        return _HistogramTimer(self, labels)
+
+    def get_count(self, **labels):
+        with self._lock:
+            series = self._series.get(self._label_values(labels))
+            return series[2] if series else 0
+
+    def _render_samples(self):
+        with self._lock:
+            items = sorted((key, ([*series[0]], series[1], series[2])) for key, series in self._series.items())
+
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            base_labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{base_labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{base_labels} {count}')
+        return lines
+
+
+class _HistogramTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+        return False
+
+    def __call__(self, func):
+        histogram, labels = self.histogram, self.labels
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+
+
+class MetricsRegistry:
+    """指標登錄表，負責建立指標並輸出 Prometheus 文字格式"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指標名稱重複: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self._register(Counter(self.prefix + name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(self.prefix + name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(self.prefix + name)
+
+    def render(self):
+        """輸出所有指標（Prometheus text exposition format 0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,119 @@
+import numpy as np
+
+
+# onset 來源標籤；陣列中以索引（int8）表示
+ONSET_SOURCES = ('complex', 'energy', 'beat', 'loose', 'grid')
+
+
+def source_code(name):
+    """來源名稱對應的標籤值"""
+    return ONSET_SOURCES.index(name)
+
+
+def merge_sorted(sources):
+    """
+    合併多組已排序的時間並附上來源標籤
+
+    以穩定排序（timsort，遇到已排序的區段時等同 k 路合併）一次完成，
+    時間相同時保留 sources 中較前面的來源在前。
+
+    Args:
+        sources (list): [(時間陣列, 來源名稱或標籤陣列), ...]
+
+    Returns:
+        tuple: (時間, 標籤)
+    """
+    times = []
+    labels = []
+    for values, label in sources:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        times.append(values)
+        if isinstance(label, str):
+            labels.append(np.full(len(values), source_code(label), dtype=np.int8))
+        else:
+            labels.append(np.asarray(label, dtype=np.int8))
+    if not times:
+        return np.array([], dtype=np.float64), np.array([], dtype=np.int8)
+    times = np.concatenate(times)
+    labels = np.concatenate(labels)
+    order = np.argsort(times, kind='stable')
+    return times[order], labels[order]
+
+
+def dedupe(times, labels, tolerance=1e-6):
+    """移除與前一個時間相差不超過 tolerance 的重複點（保留先出現的來源）"""
+    if len(times) == 0:
+        return times, labels
+    keep = np.empty(len(times), dtype=bool)
+    keep[0] = True
+    keep[1:] = np.diff(times) > tolerance
+    return times[keep], labels[keep]
+
+
+def min_interval_filter(times, min_interval):
+    """
+    由前往後保留與上一個保留點相隔至少 min_interval 的點，回傳保留點的索引
+
+    結果與逐一比較的迴圈相同：先以二分搜尋求出每個點之後第一個可保留的點，
+    再以倍增跳躍（每輪把已知的路徑長度加倍）從第一個點走完整條鏈，
+    只需 O(log n) 次陣列運算。
+
+    Args:
+        times (np.ndarray): 已排序的時間
+        min_interval (float): 最小間隔（秒）
+
+    Returns:
+        np.ndarray: 保留點的索引
+    """
+    times = np.asarray(times, dtype=np.float64)
+    n = len(times)
+    if n == 0:
+        return np.array([], dtype=np.intp)
+    index = np.arange(n)
+    following = np.searchsorted(times, times + min_interval, side='left')
+    # 與迴圈的判斷 times[j] - times[i] >= min_interval 一致：浮點捨入可能讓邊界差一個值，
+    # 調整時跳過整段相同的時間
+    left = np.maximum(following - 1, 0)
+    back = (following - 1 > index) & (times[left] - times >= min_interval)
+    following[back] = np.searchsorted(times, times[left[back]], side='left')
+    right = np.minimum(following, n - 1)
+    forward = (following < n) & (times[right] - times < min_interval)
+    following[forward] = np.searchsorted(times, times[right[forward]], side='right')
+    following = np.maximum(following, index + 1)
+
+    # jump 為往後跳 len(path) 步的位置，n 表示已超出結尾
+    jump = np.append(following, n)
+    path = np.array([0])
+    while path[-1] != n:
+        path = np.concatenate((path, jump[path]))
+        jump = jump[jump]
+    return path[path < n]
+
+
+def merge_onsets(sources, min_interval, tolerance=1e-6):
+    """
+    合併、去重並以最小間隔過濾多組 onset
+
+    Args:
+        sources (list): [(已排序的時間, 來源名稱或標籤陣列), ...]，排在前面的來源在時間相同時優先
+        min_interval (float): 保留的 onset 之間的最小間隔（秒）
+        tolerance (float): 視為同一個點的時間差
+
+    Returns:
+        tuple: (時間, 標籤, 去重後合併的點數)
+    """
+    times, labels = dedupe(*merge_sorted(sources), tolerance=tolerance)
+    keep = min_interval_filter(times, min_interval)
+    return times[keep], labels[keep], len(times)
+
+
+def nearest_distances(times, targets):
+    """每個時間到最近的 target（已排序）的距離；沒有 target 時為 inf"""
+    times = np.asarray(times, dtype=np.float64)
+    targets = np.asarray(targets, dtype=np.float64)
+    if len(targets) == 0:
+        return np.full(len(times), np.inf)
+    position = np.searchsorted(targets, times)
+    before = targets[np.maximum(position - 1, 0)]
+    after = targets[np.minimum(position, len(targets) - 1)]
+    return np.minimum(np.abs(times - before), np.abs(times - after))
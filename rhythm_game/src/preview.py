@@ -0,0 +1,171 @@
+import hashlib
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+# 試聽片段長度與淡入淡出（秒）
+DEFAULT_DURATION = 20.0
+FADE_IN = 0.5
+FADE_OUT = 1.5
+# 片段起點避開歌曲開頭與結尾的比例（前奏與結尾通常不具代表性）
+INTRO_RATIO = 0.1
+OUTRO_RATIO = 0.05
+
+
+def select_segment(y, sr, duration=DEFAULT_DURATION, hop_length=512, onset_envelope=None, rms=None):
+    """
+    選出最具代表性的片段起點
+
+    以 RMS 能量與 onset 強度（皆正規化到 0-1）的平均作為每個 frame 的分數，
+    取分數總和最高的 duration 秒視窗，通常落在副歌或能量最高的段落；
+    起點再對齊到視窗開頭前後 1 秒內最強的 onset，讓片段從拍點開始。
+
+    Args:
+        y (np.ndarray): 單聲道音訊
+        sr (int): 取樣率
+        duration (float): 片段長度（秒）
+        hop_length (int): 特徵的 hop 長度
+        onset_envelope (np.ndarray): 已算好的 onset 強度，None 時重新計算
+        rms (np.ndarray): 已算好的 RMS 能量，None 時重新計算
+
+    Returns:
+        float: 片段起點（秒）
+    """
+    import librosa
+
+    if len(y) <= duration * sr:
+        return 0.0
+    if onset_envelope is None:
+        onset_envelope = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+    if rms is None:
+        rms = librosa.feature.rms(y=y, hop_length=hop_length)[0]
+
+    n = min(len(onset_envelope), len(rms))
+    onset_envelope = np.asarray(onset_envelope[:n], dtype=np.float64)
+    rms = np.asarray(rms[:n], dtype=np.float64)
+    score = rms / (rms.max() or 1.0) + onset_envelope / (onset_envelope.max() or 1.0)
+
+    window = int(duration * sr / hop_length)
+    if n <= window:
+        return 0.0
+    # 每個起點的視窗分數總和
+    cumulative = np.concatenate(([0.0], np.cumsum(score)))
+    totals = cumulative[window:] - cumulative[:-window]
+    lo = int(n * INTRO_RATIO)
+    hi = max(lo + 1, min(len(totals), int(n * (1 - OUTRO_RATIO)) - window + 1))
+    if lo >= len(totals):
+        lo, hi = 0, len(totals)
+    best = lo + int(np.argmax(totals[lo:hi]))
+
+    # 對齊到附近最強的 onset
+    radius = int(sr / hop_length)
+    start = max(0, best - radius)
+    best = start + int(np.argmax(onset_envelope[start:min(len(totals), best + radius + 1)]))
+    return float(best * hop_length / sr)
+
+
+def render_clip(y, sr, start, duration=DEFAULT_DURATION, fade_in=FADE_IN, fade_out=FADE_OUT):
+    """取出片段並加上淡入淡出"""
+    begin = int(start * sr)
+    clip = np.array(y[begin:begin + int(duration * sr)], dtype=np.float32)
+    fade_in_len = min(int(fade_in * sr), len(clip))
+    fade_out_len = min(int(fade_out * sr), len(clip))
+    if fade_in_len:
+        clip[:fade_in_len] *= np.linspace(0.0, 1.0, fade_in_len, dtype=np.float32)
+    if fade_out_len:
+        clip[-fade_out_len:] *= np.linspace(1.0, 0.0, fade_out_len, dtype=np.float32)
+    return clip
+
+
+class PreviewCache:
+    """
+    試聽片段的磁碟快取
+
+    片段以音訊檔內容的 SHA-1 命名（<雜湊>.mp3），音訊內容改變時自然改用新的片段，
+    同一首歌改名或重複上傳也共用同一個片段。雜湊值依檔案修改時間與大小記在記憶體中，
+    檔案未變時不必重新讀取。
+    """
+
+    def __init__(self, cache_dir="rhythm_game/previews", duration=DEFAULT_DURATION, max_files=500):
+        """
+        Args:
+            cache_dir (str): 片段存放資料夾
+            duration (float): 片段長度（秒）
+            max_files (int): 保留的片段數上限，超過時刪除最舊的
+        """
+        self.cache_dir = Path(cache_dir)
+        self.duration = duration
+        self.max_files = max_files
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # 送往分析行程時不帶鎖與雜湊快取
+        return {'cache_dir': self.cache_dir, 'duration': self.duration, 'max_files': self.max_files}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def asset_hash(self, audio_path):
+        """音訊檔內容的 SHA-1（依修改時間與大小快取）"""
+        audio_path = Path(audio_path)
+        stat = audio_path.stat()
+        key = (audio_path.as_posix(), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._hashes.get(key)
+        if digest is None:
+            sha1 = hashlib.sha1()
+            with open(audio_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(chunk)
+            digest = sha1.hexdigest()
+            with self._lock:
+                self._hashes[key] = digest
+        return digest
+
+    def path_for(self, audio_path):
+        """音訊檔對應的片段路徑（不論是否已產生）"""
+        return self.cache_dir / f"{self.asset_hash(audio_path)[:20]}.mp3"
+
+    def get(self, audio_path):
+        """已產生的片段路徑，沒有時回傳 None"""
+        path = self.path_for(audio_path)
+        return path if path.exists() else None
+
+    def generate(self, audio_path, y=None, sr=22050, onset_envelope=None, rms=None, hop_length=512):
+        """
+        產生並快取試聽片段
+
+        Args:
+            audio_path (str): 音訊檔路徑
+            y (np.ndarray): 已解碼的單聲道音訊，None 時解碼 audio_path
+            sr (int): y 的取樣率（或解碼的取樣率）
+            onset_envelope, rms: 已算好的特徵，可省略
+
+        Returns:
+            Path: 片段路徑
+        """
+        import soundfile as sf
+
+        path = self.path_for(audio_path)
+        if path.exists():
+            return path
+        if y is None:
+            import librosa
+            y, sr = librosa.load(str(audio_path), sr=sr, mono=True)
+
+        start = select_segment(y, sr, self.duration, hop_length, onset_envelope, rms)
+        clip = render_clip(y, sr, start, self.duration)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        sf.write(str(tmp_path), clip, sr, format='MP3')
+        tmp_path.replace(path)
+        self._prune()
+        return path
+
+    def _prune(self):
+        files = sorted(self.cache_dir.glob('*.mp3'), key=lambda p: p.stat().st_mtime)
+        for old in files[:max(0, len(files) - self.max_files)]:
+            old.unlink(missing_ok=True)
@@ -0,0 +1,193 @@
+import time
+import uuid
+import threading
+
+
+# 工作的最終狀態：立即送出，不受節流影響
+FINAL_STATUSES = ('completed', 'failed')
+
+
+def job_room(job_id):
+    """工作頻道（Socket.IO room）名稱"""
+    return f"job:{job_id}"
+
+
+class _JobChannel:
+    """單一工作的進度狀態"""
+
+    __slots__ = ('event', 'latest', 'pending', 'last_emit', 'flush_scheduled', 'finished_at', 'updated_at',
+                 'seq', 'emitted_seq', 'emit_lock')
+
+    def __init__(self, event, now):
+        self.event = event
+        self.latest = None
+        self.pending = None
+        self.last_emit = 0.0
+        self.flush_scheduled = False
+        self.finished_at = None
+        self.updated_at = now
+        # 發送順序：在鎖內配號，發送時略過比已發送者舊的事件
+        self.seq = 0
+        self.emitted_seq = 0
+        self.emit_lock = threading.Lock()
+
+
+class ProgressBroadcaster:
+    """
+    依工作頻道發送並節流進度事件
+
+    - 每個下載 / 譜面產生工作有自己的 room，只有訂閱該工作的客戶端會收到
+    - progress 狀態在 1 / max_rate 秒內只送最新的一筆，其餘合併掉；
+      被合併的最後一筆會在下一個時段補送，不會停在過時的進度
+    - 最終狀態（completed / failed）立即送出
+    - 保留每個工作的最新狀態，晚訂閱的客戶端可立刻取得目前進度
+    - 工作結束 retain 秒後、或超過 idle_ttl 秒沒有任何進度（從未結束的工作）時移除頻道
+
+    狀態在共用的鎖內更新，實際發送在鎖外進行，發送緩慢時不會擋住其他工作；
+    同一工作的發送依配號順序進行，補送的舊進度不會排在最終狀態之後。
+    """
+
+    def __init__(self, emit, max_rate=5.0, retain=300, idle_ttl=3600, spawn=None, sleep=None,
+                 clock=time.monotonic):
+        """
+        Args:
+            emit (callable): emit(event, payload, room) 實際發送事件
+            max_rate (float): 每個工作每秒最多發送幾次進度，0 表示不節流
+            retain (float): 工作結束後保留最新狀態的秒數
+            idle_ttl (float): 未結束的工作多久沒有進度後視為中斷並移除
+            spawn (callable): 啟動背景工作的函數（例如 socketio.start_background_task）
+            sleep (callable): 等待時使用的 sleep 函數（例如 socketio.sleep）
+        """
+        self._emit = emit
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.retain = retain
+        self.idle_ttl = idle_ttl
+        self._spawn = spawn or self._spawn_thread
+        self._sleep = sleep or time.sleep
+        self._clock = clock
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._counters = {'published': 0, 'emitted': 0, 'coalesced': 0}
+
+    @staticmethod
+    def _spawn_thread(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def create_job(self, event):
+        """
+        建立工作頻道
+
+        Args:
+            event (str): 此工作發送的事件名稱（例如 download_progress）
+
+        Returns:
+            str: 工作 ID
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._prune()
+            self._channels[job_id] = _JobChannel(event, self._clock())
+        return job_id
+
+    def publish(self, job_id, payload):
+        """
+        發送工作進度
+
+        Args:
+            job_id (str): create_job() 回傳的工作 ID
+            payload (dict): 事件內容，status 屬於 FINAL_STATUSES 時視為最終狀態
+        """
+        payload = dict(payload, job_id=job_id)
+        final = payload.get('status') in FINAL_STATUSES
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None:
+                return
+            self._counters['published'] += 1
+            channel.latest = payload
+            channel.updated_at = self._clock()
+            if final:
+                channel.finished_at = self._clock()
+                channel.pending = None
+            else:
+                wait = channel.last_emit + self.min_interval - self._clock()
+                if wait > 0:
+                    # 時段內已發送過，只保留最新一筆，等時段結束再補送
+                    if channel.pending is not None:
+                        self._counters['coalesced'] += 1
+                    channel.pending = payload
+                    if not channel.flush_scheduled:
+                        channel.flush_scheduled = True
+                        self._spawn(self._flush_later, job_id, wait)
+                    return
+                channel.pending = None
+            seq = self._claim_emit(channel)
+        self._send(job_id, channel, seq, payload)
+
+    def _claim_emit(self, channel):
+        """記錄一次發送並配號（呼叫時須持有鎖）"""
+        channel.last_emit = self._clock()
+        channel.seq += 1
+        return channel.seq
+
+    def _send(self, job_id, channel, seq, payload):
+        """在共用鎖外發送；同一工作已送出較新的事件時略過"""
+        with channel.emit_lock:
+            if seq < channel.emitted_seq:
+                return
+            channel.emitted_seq = seq
+            with self._lock:
+                self._counters['emitted'] += 1
+            self._emit(channel.event, payload, job_room(job_id))
+
+    def _flush_later(self, job_id, delay):
+        self._sleep(delay)
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None:
+                return
+            channel.flush_scheduled = False
+            payload = channel.pending
+            if payload is None:
+                return
+            channel.pending = None
+            seq = self._claim_emit(channel)
+        self._send(job_id, channel, seq, payload)
+
+    def snapshot(self, job_id):
+        """
+        取得工作的事件名稱與最新狀態
+
+        Returns:
+            tuple or None: (event, payload)；工作不存在時為 None
+        """
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None or channel.latest is None:
+                return None
+            return channel.event, channel.latest
+
+    def prune(self):
+        """
+        移除已結束超過 retain 秒或閒置超過 idle_ttl 秒的工作頻道
+
+        Returns:
+            int: 移除的頻道數
+        """
+        with self._lock:
+            return self._prune()
+
+    def _prune(self):
+        now = self._clock()
+        expired = [job_id for job_id, channel in self._channels.items()
+                   if (channel.finished_at is not None and now - channel.finished_at > self.retain)
+                   or (self.idle_ttl and now - channel.updated_at > self.idle_ttl)]
+        for job_id in expired:
+            del self._channels[job_id]
+        return len(expired)
+
+    def get_metrics(self):
+        with self._lock:
+            return {'jobs': len(self._channels), **self._counters}
@@ -0,0 +1,356 @@
+import json
+import time
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from rhythm_game.src.utils import ChartManager, ScoreCalculator, JUDGMENT_NAMES, MISS_CODE
+from rhythm_game.src.calibration import CALIBRATION_CHART_ID
+
+
+# 檔頭：魔術字、版本、JSON 標頭長度
+REPLAY_MAGIC = b'RFRP'
+REPLAY_VERSION = 1
+_PREFIX = struct.Struct('<4sBI')
+
+# 每筆輸入 10 位元組：序號、軌道、種類、遊戲時間（微秒）
+_RECORD = struct.Struct('<IbBi')
+RECORD_DTYPE = np.dtype([('seq', '<u4'), ('lane', 'i1'), ('kind', 'u1'), ('time_us', '<i4')])
+
+KIND_HIT = 0
+KIND_AUTO_MISS = 1
+
+# 判定代碼（陣列索引），與 ScoreCalculator 批次 API 共用
+JUDGMENTS = JUDGMENT_NAMES
+MISS = MISS_CODE
+
+# 與 WebGameSession.hit_note 相同的預設判定容差
+DEFAULT_TOLERANCES = {'perfect': 0.08, 'great': 0.15, 'good': 0.25}
+
+
+class ReplayWriter:
+    """
+    只能附加的二進位重播檔
+
+    檔頭記錄譜面與套用中的延遲補償，之後每個輸入一筆固定長度紀錄。
+    紀錄先累積在記憶體，每 flush_every 筆或結束時以附加模式寫入，
+    不常駐開啟檔案，會話被回收時也不會遺留檔案描述元。
+    """
+
+    def __init__(self, path, header=None, flush_every=32):
+        """
+        Args:
+            path (str | Path): 重播檔路徑，已存在時接續附加
+            header (dict): 新檔案的標頭資料
+            flush_every (int): 累積幾筆後寫入檔案
+        """
+        self.path = Path(path)
+        self.flush_every = flush_every
+        self._buffer = bytearray()
+        self._pending = 0
+
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            header_bytes = json.dumps(header or {}, ensure_ascii=False).encode('utf-8')
+            with open(self.path, 'wb') as f:
+                f.write(_PREFIX.pack(REPLAY_MAGIC, REPLAY_VERSION, len(header_bytes)))
+                f.write(header_bytes)
+
+    def append(self, seq, lane, kind, game_time):
+        """附加一筆輸入（game_time 為秒）"""
+        if not isinstance(lane, int) or not -128 <= lane <= 127:
+            lane = -1
+        time_us = int(round(float(game_time) * 1_000_000))
+        time_us = max(-2**31, min(2**31 - 1, time_us))
+        self._buffer += _RECORD.pack(seq, lane, kind, time_us)
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        with open(self.path, 'ab') as f:
+            f.write(self._buffer)
+        self._buffer = bytearray()
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+
+
+def read_replay(path):
+    """
+    讀取重播檔
+
+    Returns:
+        tuple: (標頭 dict, RECORD_DTYPE 結構陣列)；檔尾不完整的紀錄會被忽略
+    """
+    data = Path(path).read_bytes()
+    if len(data) < _PREFIX.size:
+        raise ValueError(f"重播檔過短: {path}")
+    magic, version, header_len = _PREFIX.unpack_from(data)
+    if magic != REPLAY_MAGIC:
+        raise ValueError(f"不是重播檔: {path}")
+    if version != REPLAY_VERSION:
+        raise ValueError(f"不支援的重播檔版本 {version}: {path}")
+
+    start = _PREFIX.size + header_len
+    header = json.loads(data[_PREFIX.size:start].decode('utf-8'))
+    count = (len(data) - start) // RECORD_DTYPE.itemsize
+    records = np.frombuffer(data, dtype=RECORD_DTYPE, count=count, offset=start)
+    return header, records
+
+
+class ReplayEngine:
+    """
+    批次重新判定與計分
+
+    將所有重播的按鍵與譜面音符攤平成單一陣列，以 searchsorted 一次找出
+    每個按鍵最接近的音符並判定。只有多個按鍵搶同一個音符的局部群集才退回
+    逐筆判定，以確保結果與 WebGameSession.hit_note 完全一致。
+    """
+
+    def __init__(self, tolerances=None, score_calculator=None, chart_loader=None):
+        """
+        Args:
+            tolerances (dict): 判定容差（秒），未指定的項目使用預設值
+            score_calculator (ScoreCalculator): 分數計算器
+            chart_loader (callable): 由譜面路徑載入譜面資料的函數
+        """
+        self.tolerances = dict(DEFAULT_TOLERANCES)
+        self.tolerances.update(tolerances or {})
+        self.score_calculator = score_calculator or ScoreCalculator()
+        self.chart_loader = chart_loader or ChartManager().load_chart
+        self._charts = {}
+
+    def _load_notes(self, chart_path):
+        """取得譜面音符的 (時間, 軌道) 陣列，依時間排序並快取"""
+        if chart_path not in self._charts:
+            chart = self.chart_loader(chart_path) if chart_path else None
+            if chart is None:
+                self._charts[chart_path] = None
+            else:
+                notes = chart.get('notes', [])
+                times = np.array([note['time'] for note in notes], dtype=np.float64)
+                lanes = np.array([note['lane'] for note in notes], dtype=np.int64)
+                order = np.argsort(times, kind='stable')
+                self._charts[chart_path] = (times[order], lanes[order])
+        return self._charts[chart_path]
+
+    def rescore(self, replays, input_offset=None):
+        """
+        重新判定並計分
+
+        Args:
+            replays: 重播檔路徑，或 read_replay() 結果 (header, records) 的序列
+            input_offset (float): 覆寫每個重播記錄的延遲補償（秒）
+
+        Returns:
+            list: 每個重播一個結果 dict，格式同 GameStats.to_dict()（不含 play_time）
+        """
+        entries = []
+        results = []
+        for replay in replays:
+            source = None
+            if isinstance(replay, (str, Path)):
+                source = str(replay)
+                try:
+                    header, records = read_replay(replay)
+                except (OSError, ValueError) as e:
+                    results.append({'replay': source, 'error': str(e)})
+                    continue
+            else:
+                header, records = replay
+
+            result = {
+                'replay': source,
+                'session_id': header.get('session_id'),
+                'chart_path': header.get('chart_path'),
+                'device_id': header.get('device_id')
+            }
+            if header.get('chart_path') == CALIBRATION_CHART_ID:
+                # 校準模式不分軌道且判定範圍不同，分數沒有意義
+                result['error'] = '校準重播不計分'
+                results.append(result)
+                continue
+            notes = self._load_notes(header.get('chart_path'))
+            if notes is None:
+                result['error'] = '譜面不存在'
+                results.append(result)
+                continue
+
+            records = records[np.argsort(records['seq'], kind='stable')]
+            offset = header.get('input_offset', 0.0) if input_offset is None else input_offset
+            entries.append((result, records, notes, offset))
+            results.append(result)
+
+        if entries:
+            self._rescore_entries(entries)
+        return results
+
+    def _rescore_entries(self, entries):
+        tol = self.tolerances
+        good = tol['good']
+        replay_count = len(entries)
+
+        # 1. 攤平：每個 (重播, 軌道) 是一組；紀錄依重播、序號串接
+        lane_slots = 1 + max([int(notes[1].max()) for _, _, notes, _ in entries if len(notes[1])] + [0])
+        note_times, note_groups, note_replays = [], [], []
+        rec_times, rec_groups, rec_replays, rec_kinds = [], [], [], []
+        for r, (_, records, (times, lanes), offset) in enumerate(entries):
+            note_times.append(times)
+            note_groups.append(r * lane_slots + lanes)
+            note_replays.append(np.full(len(times), r))
+
+            rec_lanes = records['lane'].astype(np.int64)
+            # 不存在的軌道歸到 -1 組，不會配對到任何音符
+            rec_groups.append(np.where((rec_lanes >= 0) & (rec_lanes < lane_slots), r * lane_slots + rec_lanes, -1))
+            # 按鍵扣除延遲補償；auto_miss 記錄的是音符時間
+            seconds = records['time_us'] / 1_000_000
+            rec_times.append(np.where(records['kind'] == KIND_HIT, seconds - offset, seconds))
+            rec_replays.append(np.full(len(records), r))
+            rec_kinds.append(records['kind'])
+
+        note_time = np.concatenate(note_times)
+        note_group = np.concatenate(note_groups).astype(np.int64)
+        note_replay = np.concatenate(note_replays).astype(np.int64)
+        rec_time = np.concatenate(rec_times)
+        rec_group = np.concatenate(rec_groups).astype(np.int64)
+        rec_replay = np.concatenate(rec_replays).astype(np.int64)
+        rec_kind = np.concatenate(rec_kinds)
+        is_tap = rec_kind == KIND_HIT
+
+        # 2. 以 (組, 時間) 合成排序鍵，一次 searchsorted 找出每筆紀錄最近的音符
+        margin = good + 1.0
+        max_time = max(float(note_time.max()) if len(note_time) else 0.0, 0.0)
+        span = max_time + 2 * margin
+        note_order = np.lexsort((note_time, note_group))
+        note_time, note_group, note_replay = note_time[note_order], note_group[note_order], note_replay[note_order]
+        note_key = note_group * span + (note_time + margin)
+        rec_key = rec_group * span + (np.clip(rec_time, -margin / 2, max_time + margin / 2) + margin)
+
+        note_count = len(note_time)
+        idx = np.searchsorted(note_key, rec_key)
+        left = np.clip(idx - 1, 0, max(note_count - 1, 0))
+        right = np.clip(idx, 0, max(note_count - 1, 0))
+        if note_count:
+            left_ok = (idx > 0) & (note_group[left] == rec_group)
+            right_ok = (idx < note_count) & (note_group[right] == rec_group)
+            dist_left = np.where(left_ok, np.abs(rec_time - note_time[left]), np.inf)
+            dist_right = np.where(right_ok, np.abs(note_time[right] - rec_time), np.inf)
+        else:
+            dist_left = dist_right = np.full(len(rec_time), np.inf)
+        # 距離相同時取較早的音符，與 hit_note 依序搜尋的結果一致
+        nearest = np.where(dist_left <= dist_right, left, right)
+        distance = np.minimum(dist_left, dist_right)
+        matched = is_tap & (distance <= good)
+
+        rec_code = np.full(len(rec_time), MISS, dtype=np.int64)
+        rec_code[matched & (distance <= tol['great'])] = 1
+        rec_code[matched & (distance <= tol['perfect'])] = 0
+        rec_code[matched & (distance > tol['great'])] = 2
+
+        # 3. 多個按鍵搶同一個音符時改為逐筆判定。按鍵只會搶到 good 範圍內的音符，
+        #    同一組內時間相隔超過 2 * good 的按鍵互不影響，因此只需重算衝突所在的
+        #    局部群集（依時間排序、間隔不超過 2 * good 的連續按鍵）
+        note_hit = np.zeros(note_count, dtype=bool)
+        claims = np.bincount(nearest[matched], minlength=note_count) if note_count else np.zeros(0, dtype=np.int64)
+        contested = matched & (claims[nearest] > 1 if note_count else False)
+
+        taps = np.flatnonzero(is_tap & (rec_group >= 0))
+        taps = taps[np.lexsort((rec_time[taps], rec_group[taps]))]
+        breaks = np.ones(len(taps), dtype=bool)
+        breaks[1:] = (np.diff(rec_group[taps]) != 0) | (np.diff(rec_time[taps]) > 2 * good)
+        cluster = np.cumsum(breaks) - 1
+        cluster_contested = np.bincount(cluster, weights=contested[taps]) > 0 if len(taps) else np.zeros(0, bool)
+        resolved = taps[cluster_contested[cluster]] if len(taps) else taps
+
+        clean = matched.copy()
+        clean[resolved] = False
+        note_hit[nearest[clean]] = True
+
+        cluster_starts = np.flatnonzero(breaks)
+        cluster_ends = np.append(cluster_starts[1:], len(taps))
+        for c in np.flatnonzero(cluster_contested):
+            # 群集內依序號（紀錄順序）處理
+            members = np.sort(taps[cluster_starts[c]:cluster_ends[c]])
+            times = rec_time[members]
+            lo = np.searchsorted(note_key, rec_group[members[0]] * span + (times.min() - good + margin), side='left')
+            hi = np.searchsorted(note_key, rec_group[members[0]] * span + (times.max() + good + margin), side='right')
+            codes, hits = self._judge_cluster(times.tolist(), note_time[lo:hi].tolist(), note_hit[lo:hi].tolist())
+            rec_code[members] = codes
+            note_hit[lo:hi] = hits
+
+        # 4. miss：auto_miss 紀錄的音符重新判定後仍未擊中，就在原本的位置計一次 miss；
+        #    擊中的則不再計入。找不到音符的 auto_miss 與 handle_auto_miss 相同仍計 miss
+        is_auto = ~is_tap
+        auto_found = is_auto & (distance < 1e-3)
+        covered = np.zeros(note_count, dtype=bool)
+        covered[nearest[auto_found]] = True
+        keep = is_tap | ~(auto_found & note_hit[nearest] if note_count else auto_found)
+
+        # 沒有紀錄的未擊中音符（原本被擊中、新容差下落空）在超出 good 範圍時計 miss，
+        # 只計算到最後一筆紀錄為止，中途離開的遊戲不會把後面的音符都算成 miss
+        rec_bounds = np.searchsorted(rec_replay, np.arange(replay_count + 1))
+        record_counts = np.diff(rec_bounds)
+        last_time = np.full(replay_count, -np.inf)
+        has_records = record_counts > 0
+        if has_records.any():
+            last_time[has_records] = np.maximum.reduceat(rec_time, rec_bounds[:-1][has_records])
+        synthesized = ~note_hit & ~covered & (note_time <= last_time[note_replay])
+
+        # 插入位置：依每筆紀錄的發生時間（auto_miss 約在音符時間 + good）找出順序
+        event_time = np.where(is_tap, rec_time, rec_time + good)
+        running = np.maximum.accumulate(rec_replay * span + np.clip(event_time + margin, 0, span))
+        miss_key = note_replay[synthesized] * span + np.clip(note_time[synthesized] + good + margin, 0, span)
+        positions = np.searchsorted(running, miss_key, side='right') - 0.5 if len(running) else miss_key * 0
+
+        order_key = np.concatenate([np.arange(len(rec_time))[keep].astype(np.float64), positions])
+        event_replay = np.concatenate([rec_replay[keep], note_replay[synthesized]])
+        event_code = np.concatenate([rec_code[keep], np.full(int(synthesized.sum()), MISS, dtype=np.int64)])
+        order = np.argsort(order_key, kind='stable')
+
+        self._score_events(entries, event_replay[order], event_code[order])
+
+    def _judge_cluster(self, tap_times, note_times, hits):
+        """逐筆判定一個按鍵群集（與 hit_note 相同的貪婪配對）"""
+        tol = self.tolerances
+        codes = []
+        for tap_time in tap_times:
+            best, best_diff = None, float('inf')
+            for j, note_time in enumerate(note_times):
+                if not hits[j] and abs(tap_time - note_time) < best_diff:
+                    best, best_diff = j, abs(tap_time - note_time)
+            if best is None or best_diff > tol['good']:
+                codes.append(MISS)
+                continue
+            hits[best] = True
+            if best_diff <= tol['perfect']:
+                codes.append(0)
+            elif best_diff <= tol['great']:
+                codes.append(1)
+            else:
+                codes.append(2)
+        return codes, hits
+
+    def _score_events(self, entries, event_replay, event_code):
+        """依判定序列計算 combo、分數與準確度，寫回各重播的結果"""
+        batch = self.score_calculator.calculate_batch(event_code, event_replay, len(entries))
+        for r, (result, *_) in enumerate(entries):
+            result.update({
+                'score': int(batch['score'][r]),
+                'max_combo': int(batch['max_combo'][r]),
+                'accuracy': float(batch['accuracy'][r]),
+                'grade': str(batch['grade'][r]),
+                'judgments': {name: int(batch['judgments'][r, i]) for i, name in enumerate(JUDGMENTS)},
+                'total_notes': int(batch['judgments'][r].sum())
+            })
+
+def replay_filename(session_id, started_at=None):
+    """重播檔名：開始時間與會話 ID"""
+    started_at = time.time() if started_at is None else started_at
+    safe_id = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(session_id))
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started_at))
+    return f"{stamp}-{int(started_at * 1000) % 1000:03d}_{safe_id}.rfr"
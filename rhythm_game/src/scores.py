@@ -0,0 +1,376 @@
+import time
+import sqlite3
+import logging
+from pathlib import Path
+
+from rhythm_game.src.utils import JUDGMENT_NAMES
+from rhythm_game.src.threads import native_threading, native_queue
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# plays 保存每一場的成績；best_scores 由 trigger 維護每位玩家在每張譜面的最佳成績，
+# 排行榜只需依索引讀取前 N 筆，不必在數百萬筆 plays 上做 GROUP BY。
+# SQLite 的次要索引會附帶 rowid 排序，因此 plays(chart_id) / plays(player_id)
+# 已能依時間（id 遞增）取得最近的遊玩紀錄。
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    id INTEGER PRIMARY KEY,
+    chart_id TEXT NOT NULL,
+    player_id TEXT NOT NULL,
+    player_name TEXT,
+    score INTEGER NOT NULL,
+    max_combo INTEGER NOT NULL,
+    accuracy REAL NOT NULL,
+    grade TEXT NOT NULL,
+    perfect INTEGER NOT NULL,
+    great INTEGER NOT NULL,
+    good INTEGER NOT NULL,
+    miss INTEGER NOT NULL,
+    max_score INTEGER,
+    input_offset REAL,
+    session_id TEXT,
+    played_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_plays_chart ON plays(chart_id);
+CREATE INDEX IF NOT EXISTS idx_plays_player ON plays(player_id);
+
+CREATE TABLE IF NOT EXISTS best_scores (
+    chart_id TEXT NOT NULL,
+    player_id TEXT NOT NULL,
+    play_id INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    PRIMARY KEY (chart_id, player_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_best_chart_score ON best_scores(chart_id, score DESC, play_id);
+CREATE INDEX IF NOT EXISTS idx_best_player ON best_scores(player_id);
+
+CREATE TRIGGER IF NOT EXISTS plays_update_best AFTER INSERT ON plays
+BEGIN
+    INSERT INTO best_scores (chart_id, player_id, play_id, score)
+    VALUES (NEW.chart_id, NEW.player_id, NEW.id, NEW.score)
+    ON CONFLICT (chart_id, player_id) DO UPDATE
+        SET play_id = excluded.play_id, score = excluded.score
+        WHERE excluded.score > best_scores.score;
+END;
+"""
+
+_PLAY_COLUMNS = (
+    'chart_id', 'player_id', 'player_name', 'score', 'max_combo', 'accuracy', 'grade',
+    'perfect', 'great', 'good', 'miss', 'max_score', 'input_offset', 'session_id', 'played_at'
+)
+_INSERT_PLAY = (
+    f"INSERT INTO plays ({', '.join(_PLAY_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in _PLAY_COLUMNS)})"
+)
+_SELECT_PLAY = (
+    "SELECT p.id, p.chart_id, p.player_id, p.player_name, p.score, p.max_combo, p.accuracy, p.grade, "
+    "p.perfect, p.great, p.good, p.miss, p.max_score, p.played_at FROM"
+)
+
+
+def normalize_chart_id(chart_path):
+    """譜面識別字：去掉 rhythm_game/charts/ 前綴，讓不同寫法的路徑對應同一張譜面"""
+    chart_id = str(chart_path).replace('\\', '/')
+    prefix = 'rhythm_game/charts/'
+    return chart_id[len(prefix):] if chart_id.startswith(prefix) else chart_id
+
+
+def _parse_cursor(cursor, fields):
+    """解析分頁游標（以 ':' 分隔的整數）"""
+    try:
+        values = [int(value) for value in str(cursor).split(':')]
+    except ValueError:
+        raise ValueError('無效的分頁游標')
+    if len(values) != fields:
+        raise ValueError('無效的分頁游標')
+    return values
+
+
+def _row_to_dict(row):
+    return {
+        'play_id': row[0],
+        'chart_id': row[1],
+        'player_id': row[2],
+        'player_name': row[3],
+        'score': row[4],
+        'max_combo': row[5],
+        'accuracy': row[6],
+        'grade': row[7],
+        'judgments': dict(zip(JUDGMENT_NAMES, row[8:12])),
+        'max_score': row[12],
+        'played_at': row[13]
+    }
+
+
+class ScoreStore:
+    """
+    以 SQLite 保存遊戲成績與排行榜
+
+    - submit() 只把成績放進佇列就返回，不會阻塞 Socket.IO 事件處理
+    - 背景寫入執行緒累積最多 batch_size 筆或等待 flush_interval 秒後，
+      以單一交易批次寫入
+    - 佇列超過 max_pending 筆時丟棄新成績並記錄警告，避免資料庫異常時記憶體無限成長
+    - 查詢一律使用 keyset 分頁（游標），不論資料量多大，每頁都只讀取索引上的 limit 筆
+
+    寫入與查詢使用不同的連線，資料庫以 WAL 模式開啟，查詢不會被批次寫入擋住。
+    剛送出的成績在下一次批次寫入後才查得到。
+
+    建立物件時不會開啟資料庫；start()（或第一次送出、查詢）才建立檔案與資料表。
+    背景寫入執行緒為真正的 OS 執行緒，eventlet monkey patch 後批次寫入也不會卡住事件迴圈。
+    """
+
+    def __init__(self, path="rhythm_game/scores.db", batch_size=256, flush_interval=0.5, max_pending=10000):
+        """
+        Args:
+            path (str): 資料庫檔案路徑
+            batch_size (int): 每個交易最多寫入的筆數
+            flush_interval (float): 收到第一筆後最多等待幾秒再寫入
+            max_pending (int): 佇列中等待寫入的上限
+        """
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._queue_module = None
+        self._queue = None
+        self._writer = None
+        self._reader = None
+        self._start_lock = native_threading().Lock()
+        self._read_lock = None
+        self._counters = {'written': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+
+    def start(self):
+        """建立資料庫與背景寫入執行緒，重複呼叫不會再次建立"""
+        if self._writer is not None:
+            return
+        with self._start_lock:
+            if self._writer is not None:
+                return
+            threads = native_threading()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.executescript(_SCHEMA)
+            finally:
+                conn.close()
+            self._queue_module = native_queue()
+            self._queue = self._queue_module.Queue(maxsize=self.max_pending)
+            self._read_lock = threads.Lock()
+            self._reader = self._connect()
+            writer = threads.Thread(target=self._write_loop, name='score-writer')
+            writer.daemon = True
+            writer.start()
+            self._writer = writer
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # ---- 寫入 ----
+
+    def submit(self, chart_id, player_id, results, player_name=None, max_score=None,
+               input_offset=None, session_id=None, played_at=None):
+        """
+        送出一場遊戲的成績（非同步寫入）
+
+        Args:
+            chart_id (str): 譜面識別字
+            player_id (str): 玩家識別字（裝置 ID）
+            results (dict): GameStats.to_dict() 的結果
+
+        Returns:
+            bool: 是否已放入寫入佇列
+        """
+        judgments = results.get('judgments', {})
+        record = (
+            normalize_chart_id(chart_id),
+            str(player_id),
+            player_name,
+            int(results.get('score', 0)),
+            int(results.get('max_combo', 0)),
+            float(results.get('accuracy', 0.0)),
+            results.get('grade', 'D'),
+            *(int(judgments.get(name, 0)) for name in JUDGMENT_NAMES),
+            max_score,
+            input_offset,
+            session_id,
+            played_at if played_at is not None else time.time()
+        )
+        self.start()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except self._queue_module.Full:
+            # 與佇列共用同一把鎖，多個執行緒同時丟棄時計數不會遺失
+            with self._queue.mutex:
+                self._counters['dropped'] += 1
+                dropped = self._counters['dropped']
+            if dropped % 1000 == 1:
+                logger.warning(f"Score queue full, dropped {dropped} results so far")
+            return False
+
+    def _write_loop(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except self._queue_module.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write_batch(conn, batch)
+            for _ in batch:
+                self._queue.task_done()
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany(_INSERT_PLAY, batch)
+            self._counters['written'] += len(batch)
+            self._counters['batches'] += 1
+        except sqlite3.Error as e:
+            self._counters['errors'] += 1
+            logger.error(f"Failed to write {len(batch)} scores: {e}")
+
+    def flush(self):
+        """等待佇列中的成績全部寫入"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self):
+        """寫出剩餘成績並停止背景寫入執行緒"""
+        writer = self._writer
+        if writer is None:
+            return
+        self._queue.put(_STOP)
+        writer.join()
+        self._writer = None
+        with self._read_lock:
+            self._reader.close()
+            self._reader = None
+
+    def get_metrics(self):
+        pending = self._queue.qsize() if self._queue is not None else 0
+        return {'pending': pending, **self._counters}
+
+    # ---- 查詢 ----
+
+    def _query(self, sql, params):
+        self.start()
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def get_leaderboard(self, chart_id, limit=20, cursor=None):
+        """
+        譜面排行榜：每位玩家的最佳成績，依分數由高到低，同分時先達成者在前
+
+        Args:
+            chart_id (str): 譜面識別字
+            limit (int): 每頁筆數
+            cursor (str): 上一頁回傳的 next_cursor
+
+        Returns:
+            dict: entries（含名次 rank）與 next_cursor（沒有下一頁時為 None）
+        """
+        chart_id = normalize_chart_id(chart_id)
+        rank = 0
+        sql = f"{_SELECT_PLAY} best_scores b JOIN plays p ON p.id = b.play_id WHERE b.chart_id = ?"
+        params = [chart_id]
+        if cursor:
+            score, play_id, rank = _parse_cursor(cursor, 3)
+            # score <= ? 讓 SQLite 直接在索引上定位，不必從第一名掃描
+            sql += " AND b.score <= ? AND (b.score < ? OR b.play_id > ?)"
+            params += [score, score, play_id]
+        sql += " ORDER BY b.score DESC, b.play_id LIMIT ?"
+        rows = self._query(sql, params + [limit + 1])
+
+        entries = []
+        for row in rows[:limit]:
+            rank += 1
+            entries.append({'rank': rank, **_row_to_dict(row)})
+        next_cursor = None
+        if len(rows) > limit:
+            last = entries[-1]
+            next_cursor = f"{last['score']}:{last['play_id']}:{rank}"
+        return {'chart_id': chart_id, 'entries': entries, 'next_cursor': next_cursor}
+
+    def get_recent_plays(self, chart_id=None, player_id=None, limit=20, cursor=None):
+        """
+        最近的遊玩紀錄（由新到舊），可依譜面和/或玩家篩選
+
+        Returns:
+            dict: entries 與 next_cursor
+        """
+        conditions, params = [], []
+        if chart_id:
+            conditions.append("p.chart_id = ?")
+            params.append(normalize_chart_id(chart_id))
+        if player_id:
+            conditions.append("p.player_id = ?")
+            params.append(player_id)
+        if cursor:
+            conditions.append("p.id < ?")
+            params += _parse_cursor(cursor, 1)
+        sql = f"{_SELECT_PLAY} plays p"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY p.id DESC LIMIT ?"
+        rows = self._query(sql, params + [limit + 1])
+
+        entries = [_row_to_dict(row) for row in rows[:limit]]
+        next_cursor = str(entries[-1]['play_id']) if len(rows) > limit else None
+        return {'entries': entries, 'next_cursor': next_cursor}
+
+    def get_personal_bests(self, player_id, chart_id=None, limit=20, cursor=None):
+        """
+        玩家在各譜面的最佳成績與目前名次
+
+        Returns:
+            dict: entries（含 rank）與 next_cursor
+        """
+        sql = f"{_SELECT_PLAY} best_scores b JOIN plays p ON p.id = b.play_id WHERE b.player_id = ?"
+        params = [player_id]
+        if chart_id:
+            sql += " AND b.chart_id = ?"
+            params.append(normalize_chart_id(chart_id))
+        if cursor:
+            sql += " AND b.chart_id > ?"
+            params.append(str(cursor))
+        sql += " ORDER BY b.chart_id LIMIT ?"
+        rows = self._query(sql, params + [limit + 1])
+
+        entries = [_row_to_dict(row) for row in rows[:limit]]
+        for entry in entries:
+            # 每筆都是 idx_best_chart_score 上的 COUNT，只讀取排在前面的索引項目
+            entry['rank'] = self.get_rank(entry['chart_id'], entry['score'], entry['play_id'])
+        next_cursor = entries[-1]['chart_id'] if len(rows) > limit else None
+        return {'player_id': player_id, 'entries': entries, 'next_cursor': next_cursor}
+
+    def get_rank(self, chart_id, score, play_id):
+        """最佳成績在譜面排行榜上的名次（以索引計算排在前面的筆數）"""
+        rows = self._query(
+            "SELECT COUNT(*) FROM best_scores WHERE chart_id = ? "
+            "AND score >= ? AND (score > ? OR play_id < ?)",
+            (normalize_chart_id(chart_id), score, score, play_id)
+        )
+        return rows[0][0] + 1
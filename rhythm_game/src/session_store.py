@@ -0,0 +1,178 @@
+import json
+import time
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    遊戲會話儲存後端介面
+
+    SessionRegistry 透過此介面讀寫會話，讓會話可以放在行程內或外部服務
+    （例如 Redis），以支援多個 worker 共用會話資料。
+    """
+
+    # 是否跨行程共享（共享後端需要序列化會話狀態）
+    shared = False
+
+    def load(self, session_id):
+        """讀取會話，不存在時回傳 None"""
+        raise NotImplementedError
+
+    def save(self, session_id, session, ttl=None):
+        """寫入會話，ttl 為秒數（None 表示不過期）"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """刪除會話"""
+        raise NotImplementedError
+
+    def count(self):
+        """目前儲存的會話數量"""
+        raise NotImplementedError
+
+    def ids(self):
+        """目前儲存的會話 ID 清單"""
+        raise NotImplementedError
+
+
+class InProcessSessionStore(SessionStore):
+    """行程內記憶體後端（單一 worker 使用，直接保存物件參照）"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, session_id, now):
+        expires_at = self._expires.get(session_id)
+        return expires_at is not None and expires_at <= now
+
+    def load(self, session_id):
+        with self._lock:
+            if self._expired(session_id, time.monotonic()):
+                self._sessions.pop(session_id, None)
+                self._expires.pop(session_id, None)
+                return None
+            return self._sessions.get(session_id)
+
+    def save(self, session_id, session, ttl=None):
+        with self._lock:
+            self._sessions[session_id] = session
+            if ttl:
+                self._expires[session_id] = time.monotonic() + ttl
+            else:
+                self._expires.pop(session_id, None)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._expires.pop(session_id, None)
+
+    def count(self):
+        return len(self.ids())
+
+    def ids(self):
+        now = time.monotonic()
+        with self._lock:
+            for session_id in [sid for sid in self._expires if self._expired(sid, now)]:
+                self._sessions.pop(session_id, None)
+                self._expires.pop(session_id, None)
+            return list(self._sessions)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis 協定後端（多 worker 共享）
+
+    會話以 JSON 狀態保存（session.to_state()），讀取時透過 factory
+    重建物件。另以 sorted set 記錄各會話的到期時間以便快速計數。
+    任何相容 Redis 協定的伺服器皆可使用。
+    """
+
+    shared = True
+
+    def __init__(self, url, factory, prefix='rhythm:session:', client=None):
+        """
+        Args:
+            url (str): Redis 連線網址，例如 redis://localhost:6379/0
+            factory (callable): 由狀態字典重建會話物件的函數
+            prefix (str): key 前綴
+            client: 已建立的 Redis 客戶端（測試用，可省略）
+        """
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('RedisSessionStore 需要安裝 redis 套件 (pip install redis)')
+            client = redis.Redis.from_url(url)
+
+        self.client = client
+        self.factory = factory
+        self.prefix = prefix
+        self.index_key = f"{prefix}index"
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def load(self, session_id):
+        raw = self.client.get(self._key(session_id))
+        if raw is None:
+            return None
+        try:
+            return self.factory(json.loads(raw))
+        except Exception as e:
+            logger.error(f"Failed to restore session {session_id}: {e}")
+            return None
+
+    def save(self, session_id, session, ttl=None):
+        payload = json.dumps(session.to_state(), separators=(',', ':'), ensure_ascii=False)
+        expires_at = time.time() + ttl if ttl else float('inf')
+
+        pipe = self.client.pipeline()
+        if ttl:
+            pipe.set(self._key(session_id), payload, ex=max(1, int(ttl)))
+        else:
+            pipe.set(self._key(session_id), payload)
+        pipe.zadd(self.index_key, {session_id: expires_at})
+        pipe.execute()
+
+    def delete(self, session_id):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(session_id))
+        pipe.zrem(self.index_key, session_id)
+        pipe.execute()
+
+    def count(self):
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.index_key, '-inf', time.time())
+        pipe.zcard(self.index_key)
+        return int(pipe.execute()[1])
+
+    def ids(self):
+        self.client.zremrangebyscore(self.index_key, '-inf', time.time())
+        return [
+            sid.decode('utf-8') if isinstance(sid, bytes) else sid
+            for sid in self.client.zrange(self.index_key, 0, -1)
+        ]
+
+
+def create_session_store(url=None, factory=None):
+    """
+    依設定建立會話後端
+
+    Args:
+        url (str): None 或 'memory' 使用行程內後端；redis:// 開頭使用 Redis 後端
+        factory (callable): Redis 後端重建會話用的函數
+
+    Returns:
+        SessionStore: 會話後端
+    """
+    if not url or url == 'memory':
+        return InProcessSessionStore()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisSessionStore(url, factory)
+    raise ValueError(f"不支援的會話後端: {url}")
@@ -0,0 +1,346 @@
+import sys
+import time
+import threading
+import logging
+
+from rhythm_game.src.session_store import InProcessSessionStore
+
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(obj, _seen=None):
+    """
+    粗略估計物件佔用的記憶體（位元組）
+
+    遞迴計算 dict / list / tuple / set 與一般物件 __dict__ 的內容，
+    同一物件只計算一次。
+
+    Args:
+        obj: 要估計的物件
+
+    Returns:
+        int: 估計的位元組數
+    """
+    if _seen is None:
+        _seen = set()
+    obj_id = id(obj)
+    if obj_id in _seen:
+        return 0
+    _seen.add(obj_id)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key, _seen) + estimate_size(value, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += estimate_size(item, _seen)
+    elif hasattr(obj, '__dict__'):
+        size += estimate_size(vars(obj), _seen)
+    return size
+
+
+class _SessionEntry:
+    """登錄表內部使用的會話紀錄"""
+
+    __slots__ = ('session', 'created_at', 'last_active', 'size_bytes', 'dirty')
+
+    def __init__(self, session, size_bytes):
+        now = time.monotonic()
+        self.session = session
+        self.created_at = now
+        self.last_active = now
+        self.size_bytes = size_bytes
+        # 有尚未寫回後端的變更
+        self.dirty = False
+
+
+class SessionRegistry:
+    """
+    執行緒安全的遊戲會話登錄表
+
+    - 以鎖保護本地登錄表；後端讀寫與記憶體估計在鎖外進行，不會讓其他連線等待
+    - 閒置過久（idle_ttl）或存活過久（max_age）的會話由背景清理執行緒回收
+    - 超過 max_sessions 時拒絕建立新會話
+    - 記錄每個會話的估計記憶體用量，供監控使用
+
+    會話資料寫入可替換的 SessionStore。使用共享後端（如 Redis）時，
+    本地僅保留目前 worker 負責的會話快取，容量限制以所有 worker 合計。
+    設定 save_interval 時，遊戲中的變更只標記為待寫入，由背景執行緒每隔
+    save_interval 秒批次寫回，輸入事件不需等待序列化與網路往返。
+    """
+
+    def __init__(self, max_sessions=1000, idle_ttl=600, max_age=3600, reap_interval=30, store=None,
+                 save_interval=0):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self.reap_interval = reap_interval
+        self.save_interval = save_interval
+        self.store = store if store is not None else InProcessSessionStore()
+
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._reaper = None
+        self._stop_event = threading.Event()
+
+        self._counters = {
+            'created': 0,
+            'rejected': 0,
+            'removed': 0,
+            'evicted_idle': 0,
+            'evicted_age': 0,
+            'saves': 0,
+            'save_errors': 0
+        }
+
+    def add(self, session_id, session):
+        """
+        登錄新會話（同一 ID 的舊會話會被取代）
+
+        Returns:
+            bool: 是否成功登錄；達到容量上限時回傳 False
+        """
+        size_bytes = estimate_size(session)
+        if not self.has_capacity(session_id):
+            return False
+
+        with self._lock:
+            if (not self.store.shared and session_id not in self._entries
+                    and len(self._entries) >= self.max_sessions):
+                # 檢查容量後被其他請求佔滿
+                self._counters['rejected'] += 1
+                return False
+            self._entries[session_id] = _SessionEntry(session, size_bytes)
+            self._counters['created'] += 1
+        self.store.save(session_id, session, ttl=self.idle_ttl)
+
+        self._ensure_reaper()
+        return True
+
+    def has_capacity(self, session_id):
+        """
+        是否可為 session_id 建立會話（已有會話者一律可以）
+
+        在載入譜面等昂貴的準備工作之前呼叫，滿載時直接拒絕；
+        add() 仍會再檢查一次，避免檢查與登錄之間被其他請求佔滿。
+        共享後端的計數在鎖外查詢，不會讓其他連線的輸入事件等待網路往返。
+        """
+        if self._has_capacity(session_id):
+            return True
+        # 先嘗試回收過期會話再判斷是否真的已滿
+        self.reap()
+        if self._has_capacity(session_id):
+            return True
+        with self._lock:
+            self._counters['rejected'] += 1
+        logger.warning(f"Session limit reached ({self.max_sessions}), rejecting {session_id}")
+        return False
+
+    def _has_capacity(self, session_id):
+        with self._lock:
+            if session_id in self._entries:
+                return True
+            if not self.store.shared:
+                return len(self._entries) < self.max_sessions
+        return self.store.count() < self.max_sessions
+
+    def get(self, session_id):
+        """取得會話並更新最後活動時間，不存在時回傳 None"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry.last_active = time.monotonic()
+                return entry.session
+            if not self.store.shared:
+                return None
+
+        # 共享後端：由其他 worker 建立的會話在此重建並快取（讀取與估計在鎖外進行）
+        session = self.store.load(session_id)
+        if session is None:
+            return None
+        restored = _SessionEntry(session, estimate_size(session))
+        with self._lock:
+            # 同時有其他請求重建時沿用先登錄的會話
+            entry = self._entries.setdefault(session_id, restored)
+            entry.last_active = time.monotonic()
+            return entry.session
+
+    def save(self, session_id, flush=False):
+        """
+        會話狀態變更後寫回後端並延長存活時間
+
+        設定 save_interval 時只標記為待寫入，由背景執行緒批次寫回；
+        flush=True 時立即寫入（暫停、結束等需要確實保存的時間點）。
+        後端寫入在鎖外進行。記憶體用量在登錄、update_size 與背景清理時重新估計，
+        不在每次輸入後走訪整個會話（含譜面）。
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            if self.save_interval and not flush:
+                entry.dirty = True
+                return
+            entry.dirty = False
+        self._write(session_id, entry)
+
+    def flush(self):
+        """
+        寫回所有待寫入的會話
+
+        在鎖內取出待寫入的會話並清除標記，序列化與寫入在鎖外進行；
+        寫入期間再次變更的會話會重新標記，下一輪再寫入。
+
+        Returns:
+            int: 寫入的會話數量
+        """
+        with self._lock:
+            dirty = [(session_id, entry) for session_id, entry in self._entries.items() if entry.dirty]
+            for _, entry in dirty:
+                entry.dirty = False
+        written = 0
+        for session_id, entry in dirty:
+            try:
+                self._write(session_id, entry)
+                written += 1
+            except Exception as e:
+                with self._lock:
+                    self._counters['save_errors'] += 1
+                    if self._entries.get(session_id) is entry:
+                        entry.dirty = True
+                logger.error(f"Failed to save session {session_id}: {e}")
+        return written
+
+    def _write(self, session_id, entry):
+        self.store.save(session_id, entry.session, ttl=self.idle_ttl)
+        with self._lock:
+            self._counters['saves'] += 1
+
+    def remove(self, session_id):
+        """移除會話，回傳被移除的會話（不存在時為 None）"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._counters['removed'] += 1
+        self.store.delete(session_id)
+        return entry.session if entry is not None else None
+
+    def update_size(self, session_id):
+        """重新估計會話的記憶體用量（例如載入新譜面後）"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+        if entry is not None:
+            entry.size_bytes = estimate_size(entry.session)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def reap(self, update_sizes=False):
+        """
+        回收閒置或存活過久的會話
+
+        在鎖內移出過期的會話，後端刪除在鎖外進行。
+
+        Args:
+            update_sizes (bool): 同時重新估計其餘會話的記憶體用量（背景清理時）
+
+        Returns:
+            int: 被回收的會話數量
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for session_id, entry in self._entries.items():
+                if self.idle_ttl and now - entry.last_active > self.idle_ttl:
+                    expired.append((session_id, 'evicted_idle'))
+                elif self.max_age and now - entry.created_at > self.max_age:
+                    expired.append((session_id, 'evicted_age'))
+            for session_id, reason in expired:
+                del self._entries[session_id]
+                self._counters[reason] += 1
+            remaining = list(self._entries.values()) if update_sizes else []
+            remaining_count = len(self._entries)
+
+        for session_id, _ in expired:
+            self.store.delete(session_id)
+        for entry in remaining:
+            try:
+                entry.size_bytes = estimate_size(entry.session)
+            except RuntimeError:
+                # 估計期間會話正被修改，沿用上次的估計
+                pass
+
+        if expired:
+            logger.info(f"Reaped {len(expired)} expired sessions, {remaining_count} remaining")
+        return len(expired)
+
+    def _ensure_reaper(self):
+        """首次登錄會話時才啟動背景清理執行緒（同時負責批次寫回）"""
+        if self._reaper is not None or not (self.reap_interval or self.save_interval):
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._stop_event.clear()
+            self._reaper = threading.Thread(target=self._reap_loop, name='session-reaper')
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap_loop(self):
+        interval = min(value for value in (self.reap_interval, self.save_interval) if value)
+        last_reap = time.monotonic()
+        while not self._stop_event.wait(interval):
+            try:
+                if self.save_interval:
+                    self.flush()
+                now = time.monotonic()
+                if self.reap_interval and now - last_reap >= self.reap_interval:
+                    last_reap = now
+                    self.reap(update_sizes=True)
+            except Exception as e:
+                logger.error(f"Session reaper error: {e}")
+
+    def stop(self):
+        """停止背景清理執行緒並寫回待寫入的會話"""
+        self._stop_event.set()
+        reaper = self._reaper
+        if reaper is not None:
+            reaper.join(timeout=max(self.reap_interval, self.save_interval))
+        self._reaper = None
+        self.flush()
+
+    def get_metrics(self):
+        """
+        取得會話統計資訊
+
+        Returns:
+            dict: 目前會話數、容量設定、記憶體用量與累計計數
+        """
+        now = time.monotonic()
+        store_sessions = self.store.count() if self.store.shared else None
+        with self._lock:
+            sizes = [entry.size_bytes for entry in self._entries.values()]
+            oldest = max((now - entry.created_at for entry in self._entries.values()), default=0)
+            dirty = sum(1 for entry in self._entries.values() if entry.dirty)
+            return {
+                'active_sessions': len(self._entries),
+                'max_sessions': self.max_sessions,
+                'idle_ttl': self.idle_ttl,
+                'max_age': self.max_age,
+                'save_interval': self.save_interval,
+                'pending_saves': dirty,
+                'memory_bytes_total': sum(sizes),
+                'memory_bytes_max': max(sizes, default=0),
+                'memory_bytes_avg': (sum(sizes) / len(sizes)) if sizes else 0,
+                'oldest_session_age': oldest,
+                'store': type(self.store).__name__,
+                'store_sessions': store_sessions if store_sessions is not None else len(self._entries),
+                **self._counters
+            }
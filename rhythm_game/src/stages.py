@@ -0,0 +1,80 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class StageGraph:
+    """
+    以相依關係描述的處理步驟，互不相依的步驟在執行緒池中同時執行
+
+    librosa / NumPy 的 FFT 與矩陣運算大多會釋放 GIL，同一個分析行程內的
+    onset 檢測、節拍追蹤、編碼等步驟因此能真正並行，不必多開行程。
+
+    每個步驟以 add(name, fn, deps) 加入，fn 以關鍵字參數收到各相依步驟的結果：
+
+        graph = StageGraph()
+        graph.add('features', compute_features)
+        graph.add('beats', lambda features: track_beats(features), deps=('features',))
+        results = graph.run()
+        graph.timings   # {'features': 0.41, 'beats': 1.02}
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        Args:
+            max_workers (int): 同時執行的步驟數上限
+        """
+        self.max_workers = max_workers
+        self._stages = {}
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, deps=()):
+        """加入步驟；相依步驟必須先加入"""
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages: {', '.join(missing)}")
+        self._stages[name] = (fn, tuple(deps))
+        return self
+
+    def _run_stage(self, name, fn, kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(**kwargs)
+        finally:
+            with self._lock:
+                self.timings[name] = time.perf_counter() - started
+
+    def run(self):
+        """
+        執行所有步驟
+
+        Returns:
+            dict: {步驟名稱: 結果}
+
+        Raises:
+            任何步驟拋出的例外；尚未開始的步驟不再執行
+        """
+        results = {}
+        remaining = dict(self._stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='stage') as pool:
+            while remaining or running:
+                # 送出所有相依步驟皆已完成的步驟（依加入順序）
+                for name, (fn, deps) in list(remaining.items()):
+                    if all(dep in results for dep in deps):
+                        kwargs = {dep: results[dep] for dep in deps}
+                        running[pool.submit(self._run_stage, name, fn, kwargs)] = name
+                        del remaining[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    results[name] = future.result()
+        return results
@@ -0,0 +1,33 @@
+import queue
+import threading
+
+
+def _eventlet_patched():
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread')
+
+
+def native_threading():
+    """
+    取得建立真正 OS 執行緒的 threading 模組
+
+    server.py 以 eventlet monkey patch 後，threading.Thread 建立的是協程，在其中執行的
+    阻塞呼叫（SQLite、寫檔）會卡住整個事件迴圈。執行這類工作的背景執行緒，以及它與
+    事件處理共用的鎖，改由此模組建立。未 monkey patch 時即為標準的 threading。
+    gevent 會直接改寫 threading 模組本身，無法取回原始模組，因此 server.py 不提供 gevent 模式。
+    """
+    if _eventlet_patched():
+        from eventlet import patcher
+        return patcher.original('threading')
+    return threading
+
+
+def native_queue():
+    """與 native_threading() 搭配的 queue 模組（跨 OS 執行緒傳遞資料）"""
+    if _eventlet_patched():
+        from eventlet import patcher
+        return patcher.original('queue')
+    return queue
@@ -3,6 +3,13 @@ import os
 from pathlib import Path
 import time
 
+import numpy as np
+
+
+# 批次 API 使用的判定代碼：陣列值為此 tuple 的索引
+JUDGMENT_NAMES = ('perfect', 'great', 'good', 'miss')
+MISS_CODE = 3
+
 
 class ScoreCalculator:
     """分數計算器"""
@@ -16,6 +23,14 @@ class ScoreCalculator:
         }
         self.combo_bonus_threshold = 10
         self.max_combo_bonus = 2.0
+        # 準確度權重與等級門檻（由高到低）
+        self.accuracy_weights = {
+            'perfect': 1.0,
+            'great': 0.8,
+            'good': 0.5,
+            'miss': 0.0
+        }
+        self.grade_thresholds = ((95, 'SS'), (90, 'S'), (80, 'A'), (70, 'B'), (60, 'C'))
         
     def calculate_note_score(self, judgment, combo):
         """
@@ -55,10 +70,10 @@ class ScoreCalculator:
             return 0.0
         
         weighted_score = (
-            judgments.get('perfect', 0) * 1.0 +
-            judgments.get('great', 0) * 0.8 +
-            judgments.get('good', 0) * 0.5 +
-            judgments.get('miss', 0) * 0.0
+            judgments.get('perfect', 0) * self.accuracy_weights['perfect'] +
+            judgments.get('great', 0) * self.accuracy_weights['great'] +
+            judgments.get('good', 0) * self.accuracy_weights['good'] +
+            judgments.get('miss', 0) * self.accuracy_weights['miss']
         )
         
         return (weighted_score / total_notes) * 100
@@ -73,18 +88,157 @@ class ScoreCalculator:
         Returns:
             str: 等級 (SS, S, A, B, C, D)
         """
-        if accuracy >= 95:
-            return 'SS'
-        elif accuracy >= 90:
-            return 'S'
-        elif accuracy >= 80:
-            return 'A'
-        elif accuracy >= 70:
-            return 'B'
-        elif accuracy >= 60:
-            return 'C'
-        else:
-            return 'D'
+        for threshold, grade in self.grade_thresholds:
+            if accuracy >= threshold:
+                return grade
+        return 'D'
+    
+    # ---- 批次 API：以判定代碼陣列一次計算，結果與逐筆計算完全相同 ----
+    
+    def encode_judgments(self, judgments):
+        """
+        將判定名稱序列轉為判定代碼陣列
+        
+        Args:
+            judgments (iterable): 判定名稱，未知的判定視為 miss
+            
+        Returns:
+            np.ndarray: 判定代碼（JUDGMENT_NAMES 的索引）
+        """
+        index = {name: code for code, name in enumerate(JUDGMENT_NAMES)}
+        return np.array([index.get(judgment, MISS_CODE) for judgment in judgments], dtype=np.int64)
+    
+    def running_combo(self, codes, segment_starts=None):
+        """
+        計算每個判定之後的 combo（miss 歸零）
+        
+        Args:
+            codes (np.ndarray): 判定代碼
+            segment_starts (array): 多場遊戲串接時每場第一個判定的索引，combo 在此重新計算
+            
+        Returns:
+            np.ndarray: 與 codes 等長的 combo
+        """
+        codes = np.asarray(codes)
+        is_hit = (codes != MISS_CODE).astype(np.int64)
+        cumulative = np.cumsum(is_hit)
+        # 歸零點：miss 時的累計值，或每場開頭前一個判定的累計值
+        reset = np.where(codes == MISS_CODE, cumulative, 0)
+        if segment_starts is not None and len(segment_starts):
+            starts = np.asarray(segment_starts)
+            reset[starts] = np.maximum(reset[starts], cumulative[starts] - is_hit[starts])
+        if not len(codes):
+            return cumulative
+        return cumulative - np.maximum.accumulate(reset)
+    
+    def calculate_note_scores(self, codes, combo=None):
+        """
+        批次計算每個判定的分數（calculate_note_score 的陣列版本）
+        
+        Args:
+            codes (np.ndarray): 判定代碼
+            combo (np.ndarray): 每個判定之後的 combo，未提供時視為單場遊戲計算
+            
+        Returns:
+            np.ndarray: 每個判定的分數
+        """
+        codes = np.asarray(codes)
+        if combo is None:
+            combo = self.running_combo(codes)
+        base_scores = np.array([self.score_values.get(name, 0) for name in JUDGMENT_NAMES])[codes]
+        multiplier = np.minimum(
+            self.max_combo_bonus,
+            1.0 + (combo - self.combo_bonus_threshold) * 0.1
+        )
+        bonus_scores = (base_scores * multiplier).astype(np.int64)
+        return np.where(combo >= self.combo_bonus_threshold, bonus_scores, base_scores)
+    
+    def calculate_accuracy_batch(self, counts):
+        """
+        批次計算準確度
+        
+        Args:
+            counts (np.ndarray): 形狀 (N, 4) 的各判定次數，欄位順序同 JUDGMENT_NAMES
+            
+        Returns:
+            np.ndarray: 每列的準確度百分比 (0-100)
+        """
+        counts = np.asarray(counts)
+        weighted = counts[:, 0] * self.accuracy_weights['perfect']
+        for code, name in enumerate(JUDGMENT_NAMES[1:], start=1):
+            weighted = weighted + counts[:, code] * self.accuracy_weights[name]
+        totals = counts.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            accuracy = (weighted / totals) * 100
+        return np.where(totals > 0, accuracy, 0.0)
+    
+    def get_grade_batch(self, accuracy):
+        """批次計算等級"""
+        accuracy = np.asarray(accuracy)
+        conditions = [accuracy >= threshold for threshold, _ in self.grade_thresholds]
+        return np.select(conditions, [grade for _, grade in self.grade_thresholds], default='D')
+    
+    def calculate_batch(self, codes, segment_ids=None, segment_count=None):
+        """
+        批次計算多場遊戲的結果
+        
+        Args:
+            codes (np.ndarray): 依時間排序的判定代碼，多場遊戲依序串接
+            segment_ids (np.ndarray): 每個判定所屬的遊戲編號（遞增排序），未提供時視為單場
+            segment_count (int): 遊戲數量（包含沒有任何判定的遊戲）
+            
+        Returns:
+            dict: 每場一個值的陣列 score、max_combo、judgments (N, 4)、accuracy、grade，
+                  以及每個判定的 combo 與 note_scores
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        if segment_ids is None:
+            segment_ids = np.zeros(len(codes), dtype=np.int64)
+            segment_count = 1
+        segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        if segment_count is None:
+            segment_count = int(segment_ids.max()) + 1 if len(segment_ids) else 0
+        
+        starts = np.searchsorted(segment_ids, np.arange(segment_count))
+        lengths = np.bincount(segment_ids, minlength=segment_count)
+        nonempty = lengths > 0
+        
+        combo = self.running_combo(codes, starts[nonempty])
+        note_scores = self.calculate_note_scores(codes, combo)
+        
+        scores = np.zeros(segment_count, dtype=np.int64)
+        max_combos = np.zeros(segment_count, dtype=np.int64)
+        if nonempty.any():
+            scores[nonempty] = np.add.reduceat(note_scores, starts[nonempty])
+            max_combos[nonempty] = np.maximum.reduceat(combo, starts[nonempty])
+        counts = np.bincount(
+            segment_ids * len(JUDGMENT_NAMES) + codes,
+            minlength=segment_count * len(JUDGMENT_NAMES)
+        ).reshape(segment_count, len(JUDGMENT_NAMES))
+        accuracy = self.calculate_accuracy_batch(counts)
+        
+        return {
+            'score': scores,
+            'max_combo': max_combos,
+            'judgments': counts,
+            'accuracy': accuracy,
+            'grade': self.get_grade_batch(accuracy),
+            'combo': combo,
+            'note_scores': note_scores
+        }
+    
+    def calculate_max_score(self, note_count):
+        """
+        計算譜面的理論最高分（全部 Perfect）
+        
+        Args:
+            note_count (int): 音符數
+            
+        Returns:
+            int: 最高分數
+        """
+        codes = np.zeros(int(note_count), dtype=np.int64)
+        return int(self.calculate_note_scores(codes).sum())
 
 
 class GameStats:
@@ -136,6 +290,27 @@ class GameStats:
             return self.end_time - self.start_time
         return 0
     
+    def get_state(self):
+        """取得可序列化的內部狀態（供外部會話儲存使用）"""
+        return {
+            'score': self.score,
+            'combo': self.combo,
+            'max_combo': self.max_combo,
+            'judgments': self.judgments.copy(),
+            'start_time': self.start_time,
+            'end_time': self.end_time
+        }
+
+    def load_state(self, state):
+        """由 get_state() 的結果還原狀態"""
+        self.reset()
+        self.score = state.get('score', 0)
+        self.combo = state.get('combo', 0)
+        self.max_combo = state.get('max_combo', 0)
+        self.judgments.update(state.get('judgments', {}))
+        self.start_time = state.get('start_time')
+        self.end_time = state.get('end_time')
+
     def to_dict(self):
         """轉換為字典格式"""
         calculator = ScoreCalculator()
@@ -190,10 +365,13 @@ class ChartManager:
                         'path': json_file.as_posix(),
                         'file': json_file.as_posix(),  # 保留 'file' 字段以防其他地方使用
                         'title': chart_data.get('song_title', json_file.stem),
+                        'audio_file': chart_data.get('audio_file'),
                         'bpm': chart_data.get('bpm', 0),
                         'duration': chart_data.get('duration', 0),
                         'note_count': chart_data.get('note_count', 0),
-                        'difficulty': chart_data.get('difficulty', '未知')  # 添加难度字段
+                        'max_score': chart_data.get('max_score'),
+                        'difficulty': chart_data.get('difficulty', '未知'),  # 添加难度字段
+                        'section': chart_data.get('section')  # 練習譜面在原曲中的範圍
                     })
             except Exception as e:
                 print(f"無法讀取譜面 {json_file}: {e}")
@@ -317,6 +495,28 @@ class ConfigManager:
         return self.config['key_bindings'].get(action)
 
 
+def get_audio_duration(audio_path):
+    """
+    取得音訊長度（秒）
+
+    優先讀取檔頭資訊，不需解碼整個檔案；無法讀取時回傳 None
+    """
+    try:
+        import soundfile as sf
+        return sf.info(str(audio_path)).duration
+    except Exception:
+        pass
+
+    try:
+        # m4a / webm 等 soundfile 無法讀取的格式改用 audioread（只讀檔頭，不在網頁行程載入 librosa）
+        import audioread
+        with audioread.audio_open(str(audio_path)) as f:
+            return f.duration
+    except Exception as e:
+        print(f"無法取得音訊長度 {audio_path}: {e}")
+        return None
+
+
 def format_time(seconds):
     """格式化時間顯示"""
     minutes = int(seconds // 60)
@@ -0,0 +1,144 @@
+import struct
+from pathlib import Path
+
+import numpy as np
+
+
+# 峰值檔格式（little-endian）：
+#   標頭      magic 'RFWP'、版本 (uint8)、位元數 (uint8)、層數 (uint16)、取樣率 (uint32)、取樣數 (uint32)
+#   層級表    每層 samples_per_pixel (uint32)、像素數 (uint32)、資料起點 (uint32)，由粗到細排列
+#   資料      每層 [min0, max0, min1, max1, ...] (int8)，與 audiowaveform 的 8 位元資料相同
+# 最粗的層級在最前面，客戶端以一個小的 Range 請求就能取得標頭與總覽。
+MAGIC = b'RFWP'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHII')
+LEVEL = struct.Struct('<III')
+PEAKS_SUFFIX = '.peaks'
+
+# 最細層級每個像素涵蓋的取樣數，以及最粗層級的像素數下限
+BASE_SAMPLES_PER_PIXEL = 256
+MIN_PIXELS = 256
+
+
+def peaks_path(audio_path):
+    """音訊檔旁的峰值檔路徑（song.m4a → song.m4a.peaks）"""
+    audio_path = Path(audio_path)
+    return audio_path.with_name(audio_path.name + PEAKS_SUFFIX)
+
+
+def is_stale(audio_path):
+    """峰值檔不存在或比音訊檔舊時回傳 True"""
+    path = peaks_path(audio_path)
+    try:
+        return path.stat().st_mtime_ns < Path(audio_path).stat().st_mtime_ns
+    except OSError:
+        return True
+
+
+def compute_levels(y, samples_per_pixel=BASE_SAMPLES_PER_PIXEL, min_pixels=MIN_PIXELS):
+    """
+    計算多解析度的 min/max 峰值
+
+    最細層級以 samples_per_pixel 個取樣為一個像素，之後每層兩兩合併，
+    直到像素數不超過 min_pixels。取樣只讀一次，較粗的層級由上一層合併而得。
+
+    Args:
+        y (np.ndarray): 單聲道音訊（-1 到 1）
+        samples_per_pixel (int): 最細層級每個像素的取樣數
+        min_pixels (int): 最粗層級的像素數下限
+
+    Returns:
+        list: [(samples_per_pixel, peaks)]，peaks 為 (像素數, 2) 的 int8 陣列，由粗到細排列
+    """
+    y = np.asarray(y, dtype=np.float32)
+    if len(y) == 0:
+        return [(samples_per_pixel, np.zeros((0, 2), dtype=np.int8))]
+
+    starts = np.arange(0, len(y), samples_per_pixel)
+    mins = np.minimum.reduceat(y, starts)
+    maxs = np.maximum.reduceat(y, starts)
+
+    levels = []
+    spp = samples_per_pixel
+    while True:
+        levels.append((spp, _quantize(mins, maxs)))
+        if len(mins) <= min_pixels:
+            break
+        if len(mins) % 2:
+            mins = np.append(mins, mins[-1])
+            maxs = np.append(maxs, maxs[-1])
+        mins = mins.reshape(-1, 2).min(axis=1)
+        maxs = maxs.reshape(-1, 2).max(axis=1)
+        spp *= 2
+    levels.reverse()
+    return levels
+
+
+def _quantize(mins, maxs):
+    # 向外取整，量化後的包絡線不會比實際波形窄
+    peaks = np.empty((len(mins), 2), dtype=np.int8)
+    peaks[:, 0] = np.clip(np.floor(mins * 127), -128, 127)
+    peaks[:, 1] = np.clip(np.ceil(maxs * 127), -128, 127)
+    return peaks
+
+
+def encode_peaks(levels, sample_rate, sample_count):
+    """將 compute_levels() 的結果編碼為峰值檔內容"""
+    offset = HEADER.size + LEVEL.size * len(levels)
+    table = []
+    for spp, peaks in levels:
+        table.append(LEVEL.pack(spp, len(peaks), offset))
+        offset += peaks.nbytes
+    header = HEADER.pack(MAGIC, VERSION, 8, len(levels), int(sample_rate), int(sample_count))
+    return b''.join([header, *table, *(peaks.tobytes() for _, peaks in levels)])
+
+
+def decode_peaks(data):
+    """
+    解析峰值檔內容
+
+    Returns:
+        dict: sample_rate、sample_count 與 levels（[(samples_per_pixel, peaks)]，由粗到細）
+    """
+    magic, version, bits, level_count, sample_rate, sample_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or bits != 8:
+        raise ValueError("Unsupported peaks file")
+    levels = []
+    for index in range(level_count):
+        spp, length, offset = LEVEL.unpack_from(data, HEADER.size + LEVEL.size * index)
+        peaks = np.frombuffer(data, dtype=np.int8, count=length * 2, offset=offset).reshape(-1, 2)
+        levels.append((spp, peaks))
+    return {'sample_rate': sample_rate, 'sample_count': sample_count, 'levels': levels}
+
+
+def write_peaks(audio_path, y, sample_rate):
+    """
+    由已解碼的音訊計算峰值並寫入音訊檔旁
+
+    Returns:
+        str: 峰值檔路徑
+    """
+    path = peaks_path(audio_path)
+    data = encode_peaks(compute_levels(y), sample_rate, len(y))
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    tmp_path.replace(path)
+    return path.as_posix()
+
+
+def generate_peaks(audio_path, sample_rate=22050):
+    """
+    解碼音訊並產生峰值檔
+
+    Args:
+        audio_path (str): 音訊檔路徑
+        sample_rate (int): 解碼的取樣率
+
+    Returns:
+        str: 峰值檔路徑
+    """
+    import librosa
+
+    y, sr = librosa.load(str(audio_path), sr=sample_rate, mono=True)
+    return write_peaks(audio_path, y, sr)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+節奏遊戲正式環境伺服器
+Rhythm Game Production Server
+
+以 eventlet 的協程模式執行 Socket.IO，每個連線只佔用一個 greenlet
+而非一條 OS 執行緒，單一行程即可承載數千個遊戲連線。
+譜面分析等 CPU 密集工作由 app.py 的分析行程池處理，不會阻塞事件迴圈；
+成績、校準等阻塞寫入由 threads.py 建立的原生執行緒處理（目前只支援 eventlet 的 monkey patch）。
+
+用法:
+    python server.py --async-mode eventlet --port 5000
+"""
+
+import os
+import argparse
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='RhythmForge production server')
+    parser.add_argument('--host', default=os.environ.get('RHYTHM_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('RHYTHM_PORT', 5000)))
+    parser.add_argument('--async-mode', choices=['eventlet', 'threading'],
+                        default=os.environ.get('RHYTHM_ASYNC_MODE', 'eventlet'),
+                        help='Socket.IO 非同步模式')
+    parser.add_argument('--ping-interval', type=float, help='Socket.IO ping 間隔（秒）')
+    parser.add_argument('--ping-timeout', type=float, help='Socket.IO ping 逾時（秒）')
+    parser.add_argument('--max-http-buffer-size', type=int, help='單一訊息最大位元組數')
+    parser.add_argument('--analysis-workers', type=int, help='譜面分析行程數量')
+    parser.add_argument('--serializer', choices=['json', 'msgpack'], help='Socket.IO 封包格式')
+    parser.add_argument('--backlog', type=int, default=2048, help='監聽 socket 的 backlog 大小')
+    return parser.parse_args()
+
+
+def apply_env(args):
+    """將命令列參數寫入環境變數，供 app.py 建立 SocketIO 時讀取"""
+    os.environ['RHYTHM_ASYNC_MODE'] = args.async_mode
+    overrides = {
+        'RHYTHM_PING_INTERVAL': args.ping_interval,
+        'RHYTHM_PING_TIMEOUT': args.ping_timeout,
+        'RHYTHM_MAX_HTTP_BUFFER_SIZE': args.max_http_buffer_size,
+        'RHYTHM_ANALYSIS_WORKERS': args.analysis_workers,
+        'RHYTHM_SOCKET_SERIALIZER': args.serializer,
+    }
+    for key, value in overrides.items():
+        if value is not None:
+            os.environ[key] = str(value)
+
+
+def monkey_patch(async_mode):
+    """協程模式必須在載入其他模組前完成 monkey patch"""
+    if async_mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+
+
+def main():
+    args = parse_args()
+    apply_env(args)
+    monkey_patch(args.async_mode)
+
+    from pathlib import Path
+    from app import app, socketio, logger, start_services
+
+    Path("rhythm_game/assets").mkdir(parents=True, exist_ok=True)
+    Path("rhythm_game/charts").mkdir(parents=True, exist_ok=True)
+    # 分析行程在背景暖機，完成前 /api/ready 回傳 503
+    start_services()
+
+    logger.info(f"🎵 啟動 RhythmForge 正式伺服器 ({args.async_mode}) on {args.host}:{args.port}")
+
+    if args.async_mode == 'eventlet':
+        import eventlet
+        import eventlet.wsgi
+        listener = eventlet.listen((args.host, args.port), backlog=args.backlog)
+        eventlet.wsgi.server(listener, app, log_output=False, max_size=100000)
+    else:
+        socketio.run(app, host=args.host, port=args.port, allow_unsafe_werkzeug=True)
+
+
+if __name__ == '__main__':
+    main()
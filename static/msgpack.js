@@ -0,0 +1,254 @@
+// 節奏遊戲 - msgpack 編碼與解碼
+// Rhythm Game - minimal msgpack codec
+//
+// 伺服器以 RHYTHM_SOCKET_SERIALIZER=msgpack 啟動時 socket_transport.js 以此建立 Socket.IO parser。
+// 與伺服器一起提供，不依賴 CDN；介面與 @msgpack/msgpack 相同（MessagePack.encode / decode），
+// bin 解碼為 Uint8Array，64 位元整數轉為 Number，ext 型別解碼為 { type, data }。
+
+const MessagePack = (() => {
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    class Writer {
+        constructor() {
+            this.bytes = new Uint8Array(256);
+            this.view = new DataView(this.bytes.buffer);
+            this.pos = 0;
+        }
+
+        reserve(size) {
+            if (this.pos + size <= this.bytes.length) {
+                return;
+            }
+            let capacity = this.bytes.length * 2;
+            while (capacity < this.pos + size) {
+                capacity *= 2;
+            }
+            const bytes = new Uint8Array(capacity);
+            bytes.set(this.bytes.subarray(0, this.pos));
+            this.bytes = bytes;
+            this.view = new DataView(bytes.buffer);
+        }
+
+        u8(value) {
+            this.reserve(1);
+            this.view.setUint8(this.pos, value);
+            this.pos += 1;
+        }
+
+        // 型別標頭加上固定長度的數值
+        typed(type, setter, size, value) {
+            this.reserve(1 + size);
+            this.view.setUint8(this.pos, type);
+            this.view[setter](this.pos + 1, value);
+            this.pos += 1 + size;
+        }
+
+        raw(bytes) {
+            this.reserve(bytes.length);
+            this.bytes.set(bytes, this.pos);
+            this.pos += bytes.length;
+        }
+
+        result() {
+            return this.bytes.slice(0, this.pos);
+        }
+    }
+
+    function encodeInteger(writer, value) {
+        if (value >= 0) {
+            if (value < 0x80) {
+                writer.u8(value);
+            } else if (value < 0x100) {
+                writer.typed(0xcc, 'setUint8', 1, value);
+            } else if (value < 0x10000) {
+                writer.typed(0xcd, 'setUint16', 2, value);
+            } else if (value < 0x100000000) {
+                writer.typed(0xce, 'setUint32', 4, value);
+            } else {
+                writer.typed(0xcf, 'setBigUint64', 8, BigInt(value));
+            }
+        } else if (value >= -0x20) {
+            writer.u8(value & 0xff);
+        } else if (value >= -0x80) {
+            writer.typed(0xd0, 'setInt8', 1, value);
+        } else if (value >= -0x8000) {
+            writer.typed(0xd1, 'setInt16', 2, value);
+        } else if (value >= -0x80000000) {
+            writer.typed(0xd2, 'setInt32', 4, value);
+        } else {
+            writer.typed(0xd3, 'setBigInt64', 8, BigInt(value));
+        }
+    }
+
+    function encodeLength(writer, length, fixType, fixLimit, types) {
+        if (fixType !== null && length < fixLimit) {
+            writer.u8(fixType | length);
+        } else if (types[0] !== null && length < 0x100) {
+            writer.typed(types[0], 'setUint8', 1, length);
+        } else if (length < 0x10000) {
+            writer.typed(types[1], 'setUint16', 2, length);
+        } else {
+            writer.typed(types[2], 'setUint32', 4, length);
+        }
+    }
+
+    function encodeValue(writer, value) {
+        if (value === null || value === undefined) {
+            writer.u8(0xc0);
+        } else if (value === false) {
+            writer.u8(0xc2);
+        } else if (value === true) {
+            writer.u8(0xc3);
+        } else if (typeof value === 'number') {
+            if (Number.isSafeInteger(value)) {
+                encodeInteger(writer, value);
+            } else {
+                writer.typed(0xcb, 'setFloat64', 8, value);
+            }
+        } else if (typeof value === 'bigint') {
+            encodeInteger(writer, Number(value));
+        } else if (typeof value === 'string') {
+            const bytes = textEncoder.encode(value);
+            encodeLength(writer, bytes.length, 0xa0, 32, [0xd9, 0xda, 0xdb]);
+            writer.raw(bytes);
+        } else if (value instanceof ArrayBuffer || ArrayBuffer.isView(value)) {
+            const bytes = value instanceof ArrayBuffer
+                ? new Uint8Array(value)
+                : new Uint8Array(value.buffer, value.byteOffset, value.byteLength);
+            encodeLength(writer, bytes.length, null, 0, [0xc4, 0xc5, 0xc6]);
+            writer.raw(bytes);
+        } else if (Array.isArray(value)) {
+            encodeLength(writer, value.length, 0x90, 16, [null, 0xdc, 0xdd]);
+            value.forEach(item => encodeValue(writer, item));
+        } else if (typeof value === 'object') {
+            const keys = Object.keys(value).filter(key => value[key] !== undefined);
+            encodeLength(writer, keys.length, 0x80, 16, [null, 0xde, 0xdf]);
+            keys.forEach(key => {
+                encodeValue(writer, key);
+                encodeValue(writer, value[key]);
+            });
+        } else {
+            throw new Error(`Cannot encode ${typeof value} as msgpack`);
+        }
+    }
+
+    function encode(value) {
+        const writer = new Writer();
+        encodeValue(writer, value);
+        return writer.result();
+    }
+
+    class Reader {
+        constructor(data) {
+            this.bytes = data instanceof ArrayBuffer
+                ? new Uint8Array(data)
+                : new Uint8Array(data.buffer, data.byteOffset, data.byteLength);
+            this.view = new DataView(this.bytes.buffer, this.bytes.byteOffset, this.bytes.byteLength);
+            this.pos = 0;
+        }
+
+        number(getter, size) {
+            if (this.pos + size > this.bytes.length) {
+                throw new Error('Truncated msgpack data');
+            }
+            const value = this.view[getter](this.pos);
+            this.pos += size;
+            return value;
+        }
+
+        take(length) {
+            if (this.pos + length > this.bytes.length) {
+                throw new Error('Truncated msgpack data');
+            }
+            const bytes = this.bytes.subarray(this.pos, this.pos + length);
+            this.pos += length;
+            return bytes;
+        }
+
+        string(length) {
+            return textDecoder.decode(this.take(length));
+        }
+
+        array(length) {
+            const items = new Array(length);
+            for (let i = 0; i < length; i++) {
+                items[i] = this.value();
+            }
+            return items;
+        }
+
+        map(length) {
+            const object = {};
+            for (let i = 0; i < length; i++) {
+                const key = this.value();
+                const value = this.value();
+                if (key === '__proto__') {
+                    Object.defineProperty(object, key, { value, enumerable: true, writable: true, configurable: true });
+                } else {
+                    object[key] = value;
+                }
+            }
+            return object;
+        }
+
+        ext(length) {
+            const type = this.number('getInt8', 1);
+            return { type, data: this.take(length).slice() };
+        }
+
+        value() {
+            const type = this.number('getUint8', 1);
+            if (type < 0x80) return type;
+            if (type < 0x90) return this.map(type & 0x0f);
+            if (type < 0xa0) return this.array(type & 0x0f);
+            if (type < 0xc0) return this.string(type & 0x1f);
+            if (type >= 0xe0) return type - 0x100;
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return this.take(this.number('getUint8', 1)).slice();
+                case 0xc5: return this.take(this.number('getUint16', 2)).slice();
+                case 0xc6: return this.take(this.number('getUint32', 4)).slice();
+                case 0xc7: return this.ext(this.number('getUint8', 1));
+                case 0xc8: return this.ext(this.number('getUint16', 2));
+                case 0xc9: return this.ext(this.number('getUint32', 4));
+                case 0xca: return this.number('getFloat32', 4);
+                case 0xcb: return this.number('getFloat64', 8);
+                case 0xcc: return this.number('getUint8', 1);
+                case 0xcd: return this.number('getUint16', 2);
+                case 0xce: return this.number('getUint32', 4);
+                case 0xcf: return Number(this.number('getBigUint64', 8));
+                case 0xd0: return this.number('getInt8', 1);
+                case 0xd1: return this.number('getInt16', 2);
+                case 0xd2: return this.number('getInt32', 4);
+                case 0xd3: return Number(this.number('getBigInt64', 8));
+                case 0xd4: return this.ext(1);
+                case 0xd5: return this.ext(2);
+                case 0xd6: return this.ext(4);
+                case 0xd7: return this.ext(8);
+                case 0xd8: return this.ext(16);
+                case 0xd9: return this.string(this.number('getUint8', 1));
+                case 0xda: return this.string(this.number('getUint16', 2));
+                case 0xdb: return this.string(this.number('getUint32', 4));
+                case 0xdc: return this.array(this.number('getUint16', 2));
+                case 0xdd: return this.array(this.number('getUint32', 4));
+                case 0xde: return this.map(this.number('getUint16', 2));
+                case 0xdf: return this.map(this.number('getUint32', 4));
+                default: throw new Error(`Invalid msgpack type 0x${type.toString(16)}`);
+            }
+        }
+    }
+
+    function decode(data) {
+        const reader = new Reader(data);
+        const value = reader.value();
+        if (reader.pos !== reader.bytes.length) {
+            throw new Error('Extra bytes after msgpack data');
+        }
+        return value;
+    }
+
+    return { encode, decode };
+})();
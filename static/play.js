@@ -32,21 +32,33 @@ class RhythmGame {
         this.countdownTimer = null;
         this.chartPath = null;
         this.countdownStartTime = 0; // 新增：倒計時開始時間
+        this.deviceId = this.getDeviceId();
+        this.metronome = null; // 校準模式的 Web Audio 節拍器
+        this.noteStream = null; // 音符分段載入狀態
         
         this.init();
     }
 
-    init() {
-        this.initSocket();
+    async init() {
         this.initDOMReferences();
         this.initEventListeners();
         this.initGamePage();
         this.loadConfig();
+        await this.initSocket();
         this.getChartFromURL();
     }
 
-    initSocket() {
-        this.socket = io();
+    async initSocket() {
+        // 依伺服器設定選擇 JSON 或 msgpack 封包
+        try {
+            const { socket, transport } = await RhythmSocket.connect();
+            this.socket = socket;
+            this.transport = transport;
+        } catch (error) {
+            console.error('Socket connection failed:', error);
+            this.showNotification(error.message || '連接伺服器失敗', 'error');
+            return;
+        }
         
         this.socket.on('connect', () => {
             console.log('Connected to server');
@@ -60,6 +72,18 @@ class RhythmGame {
             this.handleGameStarted(data);
         });
 
+        // 時鐘同步：立即回覆本地單調時鐘時間，伺服器據此估計偏移與 RTT
+        this.socket.on('clock_ping', (data) => {
+            this.socket.emit('clock_pong', {
+                id: data.id,
+                client_time: this.clientNow()
+            });
+        });
+
+        this.socket.on('chart_notes', (data) => {
+            this.handleChartNotes(data);
+        });
+
         this.socket.on('note_judgment', (data) => {
             this.handleNoteJudgment(data);
         });
@@ -259,9 +283,9 @@ class RhythmGame {
         try {
             this.showLoading('載入譜面中...');
             
-            // Load chart data
+            // Load chart header（音符之後依播放進度分段請求）
             // 這裡不要再次編碼，避免 %2F 造成伺服器無法識別路徑
-            const response = await fetch(`/api/chart/${chartPath}`);
+            const response = await fetch(`/api/chart/${chartPath}?notes=0`);
             if (!response.ok) {
                 throw new Error('Failed to load chart');
             }
@@ -274,18 +298,17 @@ class RhythmGame {
             const chartData = responseData.chart;
             this.gameState.chartData = chartData;
             
-            // 載入音符資料到遊戲狀態中（提前載入）
-            if (chartData && chartData.notes) {
-                this.gameState.notes = chartData.notes.slice(); // Make a copy
-                console.log(`Loaded ${this.gameState.notes.length} notes for preview`);
-            }
+            // 先載入第一段音符供開局前預覽
+            this.initNoteStream(chartData);
             
             // Update UI with chart info
             this.songTitleElement.textContent = chartData.song_title || '未知歌曲';
             this.songBpmElement.textContent = `BPM: ${chartData.bpm || 120}`;
             
-            // Load audio
-            await this.loadGameAudio(chartData, false);
+            // Load audio（校準譜面沒有音訊檔，改用節拍器）
+            if (!this.isCalibration()) {
+                await this.loadGameAudio(chartData, false);
+            }
             
             this.hideLoading();
             
@@ -361,11 +384,10 @@ class RhythmGame {
         this.gameState.isWaitingForStart = false;
         this.gameState.isCountingDown = false;
         
-        // 音符已經在 startGame 時載入，這裡不需要重新載入
-        // 但要確保資料同步
-        if (data.chart_data && data.chart_data.notes && this.gameState.notes.length === 0) {
-            this.gameState.notes = data.chart_data.notes.slice();
-            console.log(`Backup loaded ${this.gameState.notes.length} notes from server`);
+        // 譜面標頭已在 startGame 時載入，伺服器只回傳譜面 ID 與標頭
+        if (!this.gameState.chartData && data.chart) {
+            this.gameState.chartData = data.chart;
+            this.initNoteStream(data.chart);
         }
         
         this.gameStartTime = Date.now();
@@ -375,9 +397,18 @@ class RhythmGame {
         // Start audio
         if (this.audio) {
             this.audio.currentTime = 0;
-            this.audio.play().catch(error => {
+            this.audio.play().then(() => {
+                // 回報歌曲 0 秒對應的本地時間，讓伺服器以此為遊戲起點
+                this.socket.emit('audio_started', {
+                    client_ts: this.clientNow() - this.audio.currentTime
+                });
+            }).catch(error => {
                 console.error('Error playing audio:', error);
             });
+        } else if (this.isCalibration()) {
+            this.startMetronome();
+        } else {
+            this.socket.emit('audio_started', { client_ts: this.clientNow() });
         }
         
         // Game loop is already running from countdown, just continue
@@ -453,6 +484,15 @@ class RhythmGame {
             this.gameState.currentTime = (Date.now() - this.gameStartTime) / 1000;
         }
         
+        // 校準譜面沒有音訊的 ended 事件，播完最後一拍後自行結束
+        if (this.isCalibration() && this.gameState.currentTime > (this.gameState.chartData.duration || 0)) {
+            this.endGame();
+            return;
+        }
+        
+        // 在播放位置前預先請求下一段音符
+        this.requestNotesAhead();
+        
         // Check for auto-miss notes
         this.checkAutoMiss();
         
@@ -477,6 +517,114 @@ class RhythmGame {
         }
     }
 
+    initNoteStream(chartData) {
+        const stream = chartData.stream || {};
+        this.noteStream = {
+            chartId: chartData.chart_id,
+            window: stream.window || 10,
+            lookahead: stream.lookahead || 5,
+            loadedUntil: null,
+            pending: false,
+            done: false
+        };
+        // 校準譜面在開局時就要排程所有節拍聲，一次取得全部音符
+        this.requestNotes(null, this.isCalibration() ? null : this.noteStream.window);
+    }
+
+    requestNotes(start, end) {
+        this.noteStream.pending = true;
+        this.socket.emit('request_notes', {
+            chart_id: this.noteStream.chartId,
+            start: start,
+            end: end,
+            packed: !!(this.transport && this.transport.packed_notes)
+        });
+    }
+
+    requestNotesAhead() {
+        const stream = this.noteStream;
+        if (!stream || stream.done || stream.pending || stream.loadedUntil === null) return;
+        if (this.gameState.currentTime + stream.lookahead >= stream.loadedUntil) {
+            this.requestNotes(stream.loadedUntil, stream.loadedUntil + stream.window);
+        }
+    }
+
+    handleChartNotes(data) {
+        const stream = this.noteStream;
+        if (!stream || data.chart_id !== stream.chartId) return;
+        
+        // 精簡編碼：t 為毫秒整數時間、l 為軌道；packed 時為 int32 / uint8 位元組
+        if (data.packed) {
+            const times = RhythmSocket.toDataView(data.notes.t);
+            const lanes = RhythmSocket.toDataView(data.notes.l);
+            for (let i = 0; i < lanes.byteLength; i++) {
+                this.gameState.notes.push({ time: times.getInt32(i * 4, true) / 1000, lane: lanes.getUint8(i) });
+            }
+        } else {
+            const times = data.notes.t;
+            const lanes = data.notes.l;
+            for (let i = 0; i < times.length; i++) {
+                this.gameState.notes.push({ time: times[i] / 1000, lane: lanes[i] });
+            }
+        }
+        stream.loadedUntil = data.end;
+        stream.done = data.done || data.end === null;
+        stream.pending = false;
+    }
+
+    isCalibration() {
+        return !!(this.gameState.chartData && this.gameState.chartData.mode === 'calibration');
+    }
+
+    // 裝置 ID 存在 localStorage，延遲校準結果以此區分裝置
+    getDeviceId() {
+        let deviceId = localStorage.getItem('rhythm_device_id');
+        if (!deviceId) {
+            deviceId = (window.crypto && crypto.randomUUID)
+                ? crypto.randomUUID()
+                : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+            localStorage.setItem('rhythm_device_id', deviceId);
+        }
+        return deviceId;
+    }
+
+    startMetronome() {
+        const AudioContextClass = window.AudioContext || window.webkitAudioContext;
+        if (!AudioContextClass) {
+            this.socket.emit('audio_started', { client_ts: this.clientNow() });
+            return;
+        }
+        
+        const ctx = new AudioContextClass();
+        const lead = 0.1;
+        const startAt = ctx.currentTime + lead;
+        this.gameState.notes.forEach(note => {
+            const osc = ctx.createOscillator();
+            const gain = ctx.createGain();
+            osc.frequency.value = 1000;
+            gain.gain.setValueAtTime(0.5, startAt + note.time);
+            gain.gain.exponentialRampToValueAtTime(0.001, startAt + note.time + 0.05);
+            osc.connect(gain).connect(ctx.destination);
+            osc.start(startAt + note.time);
+            osc.stop(startAt + note.time + 0.06);
+        });
+        this.metronome = ctx;
+        this.gameStartTime = Date.now() + lead * 1000;
+        
+        // 節拍聲實際從喇叭發出的時間＝排程時間加上輸出延遲
+        const outputLatency = ctx.outputLatency || ctx.baseLatency || 0;
+        this.socket.emit('audio_started', {
+            client_ts: this.clientNow() + lead + outputLatency
+        });
+    }
+
+    stopMetronome() {
+        if (this.metronome) {
+            this.metronome.close();
+            this.metronome = null;
+        }
+    }
+
     // 新增：預覽模式的遊戲更新
     updatePreviewGame() {
         const PREVIEW_DURATION = 5.0; // 5秒準備時間
@@ -775,7 +923,7 @@ class RhythmGame {
             this.playHitSound();
             
             if (this.gameState.isPlaying && !this.gameState.isPaused) {
-                this.hitNote(lane);
+                this.hitNote(lane, e.timeStamp);
             }
         }
     }
@@ -844,15 +992,24 @@ class RhythmGame {
         }
     }
 
-    hitNote(lane) {
+    // 本地單調時鐘（秒），與事件的 timeStamp 使用同一時間基準
+    clientNow() {
+        return performance.now() / 1000;
+    }
+
+    hitNote(lane, eventTimestamp) {
         const currentTime = this.gameState.currentTime;
+        const clientTs = (typeof eventTimestamp === 'number' && eventTimestamp > 0)
+            ? eventTimestamp / 1000
+            : this.clientNow();
         
         // Find the closest note in this lane
         let closestNote = null;
         let closestDistance = Infinity;
         
         this.gameState.notes.forEach(note => {
-            if (note.lane === lane) {
+            // 校準時按任意鍵都對應最接近的節拍
+            if (note.lane === lane || this.isCalibration()) {
                 const distance = Math.abs(currentTime - note.time);
                 if (distance < closestDistance) {
                     closestDistance = distance;
@@ -866,6 +1023,7 @@ class RhythmGame {
             this.socket.emit('hit_note', {
                 lane: lane,
                 time: currentTime,
+                client_ts: clientTs,
                 note_time: closestNote.time
             });
         }
@@ -909,7 +1067,8 @@ class RhythmGame {
         // Remove the hit note from display if it was successfully hit
         if (data.hit && data.note_time !== undefined) {
             this.gameState.notes = this.gameState.notes.filter(note => {
-                return !(note.lane === data.lane && Math.abs(note.time - data.note_time) < 0.001);
+                const sameLane = note.lane === data.lane || this.isCalibration();
+                return !(sameLane && Math.abs(note.time - data.note_time) < 0.001);
             });
         }
         
@@ -981,11 +1140,11 @@ class RhythmGame {
     }
 
     pauseGame() {
-        this.socket.emit('pause_game');
+        this.socket.emit('pause_game', { client_ts: this.clientNow() });
     }
 
     resumeGame() {
-        this.socket.emit('resume_game');
+        this.socket.emit('resume_game', { client_ts: this.clientNow() });
     }
 
     restartGame() {
@@ -1008,6 +1167,9 @@ class RhythmGame {
         if (this.audio) {
             this.audio.pause();
         }
+        if (this.metronome) {
+            this.metronome.suspend();
+        }
         this.gamePause.style.display = 'flex';
     }
 
@@ -1016,6 +1178,9 @@ class RhythmGame {
         if (this.audio) {
             this.audio.play();
         }
+        if (this.metronome) {
+            this.metronome.resume();
+        }
         this.gamePause.style.display = 'none';
     }
 
@@ -1023,9 +1188,31 @@ class RhythmGame {
         // Server emits an object in the form { results: { ... } }
         // but showGameResults expects the inner results object.
         // Fallback to the whole data if it already matches the expected shape.
-        this.endGame();
+        // 由客戶端 endGame() 觸發時已送出 end_game，不再重送以免來回觸發
+        if (this.gameState.isPlaying) {
+            this.endGame();
+        }
         const results = data && data.results ? data.results : data;
         this.showGameResults(results);
+        if (data && data.calibration) {
+            this.showCalibrationResult(data.calibration);
+        }
+    }
+
+    showCalibrationResult(calibration) {
+        if (calibration.recommended_offset === null || calibration.recommended_offset === undefined) {
+            if (this.isCalibration()) {
+                this.showNotification('有效按鍵次數不足，請再校準一次', 'error');
+            }
+            return;
+        }
+        const offsetMs = calibration.recommended_offset * 1000;
+        const text = `建議延遲補償 ${offsetMs >= 0 ? '+' : ''}${offsetMs.toFixed(1)}ms`;
+        if (calibration.saved) {
+            this.showNotification(`${text}（已儲存）`, 'success');
+        } else if (this.isCalibration()) {
+            this.showNotification(text, 'info');
+        }
     }
 
     endGame() {
@@ -1040,6 +1227,7 @@ class RhythmGame {
         if (this.audio) {
             this.audio.pause();
         }
+        this.stopMetronome();
         
         this.socket.emit('end_game');
     }
@@ -1101,6 +1289,8 @@ class RhythmGame {
         // Start the game on server
         this.socket.emit('start_game', {
             chart_path: this.chartPath,
+            device_id: this.deviceId,
+            player_name: localStorage.getItem('rhythm_player_name'),
             config: this.config
         });
     }
@@ -8,22 +8,37 @@ class RhythmGameApp {
         this.config = null;
         this.selectedCharts = new Set(); // 追蹤選取的譜面
         this.selectedAudioFiles = new Set(); // 追蹤選取的音樂檔案
+        this.activeJobs = new Set(); // 訂閱中且尚未結束的工作（重新連線後需再訂閱）
+        this.deviceId = this.getDeviceId();
         this.init();
     }
     
     init() {
-        this.initSocket();
+        // 連線建立是非同步的；在此之前的工作訂閱會等 socketReady 完成後才送出
+        this.socketReady = this.initSocket();
         this.initNavigation();
         this.initEventListeners();
         this.loadConfig();
         this.showPage('download');
     }
     
-    initSocket() {
-        this.socket = io();
+    async initSocket() {
+        // 依伺服器設定選擇 JSON 或 msgpack 封包
+        try {
+            const { socket } = await RhythmSocket.connect();
+            this.socket = socket;
+        } catch (error) {
+            console.error('Socket connection failed:', error);
+            this.showNotification(error.message || '連接伺服器失敗', 'error');
+            return;
+        }
         
         this.socket.on('connect', () => {
             console.log('Connected to server');
+            // 重新連線後是新的 Socket.IO 連線，原本加入的工作頻道已失效
+            this.activeJobs.forEach(jobId => {
+                this.socket.emit('subscribe_job', { job_id: jobId });
+            });
         });
 
         this.socket.on('disconnect', () => {
@@ -31,12 +46,38 @@ class RhythmGameApp {
         });
         
         this.socket.on('download_progress', (data) => {
+            this.trackJobStatus(data);
             this.handleDownloadProgress(data);
         });
         
         this.socket.on('chart_progress', (data) => {
+            this.trackJobStatus(data);
             this.handleChartProgress(data);
         });
+        
+        this.socket.on('pipeline_progress', (data) => {
+            this.trackJobStatus(data);
+            this.handlePipelineProgress(data);
+        });
+    }
+
+    // 工作完成或失敗後不必在重新連線時再訂閱
+    trackJobStatus(data) {
+        if (data && data.job_id && (data.status === 'completed' || data.status === 'failed')) {
+            this.activeJobs.delete(data.job_id);
+        }
+    }
+
+    // 下載與譜面產生的進度只送給訂閱該工作的客戶端
+    async subscribeJob(jobId) {
+        if (!jobId) {
+            return;
+        }
+        this.activeJobs.add(jobId);
+        await this.socketReady;
+        if (this.socket && this.socket.connected) {
+            this.socket.emit('subscribe_job', { job_id: jobId });
+        }
     }
 
     initNavigation() {
@@ -89,6 +130,11 @@ class RhythmGameApp {
             this.downloadMusic();
         });
         
+        // 下載並產生譜面按鈕
+        document.getElementById('pipeline-btn').addEventListener('click', () => {
+            this.downloadAndGenerate();
+        });
+        
         // 重新整理音樂檔案
         document.getElementById('refresh-audio-btn').addEventListener('click', () => {
             this.loadAudioFiles();
@@ -126,6 +172,10 @@ class RhythmGameApp {
             this.resetSettings();
         });
         
+        document.getElementById('start-calibration-btn').addEventListener('click', () => {
+            window.location.href = '/play.html?chart=calibration';
+        });
+        
         // 範圍輸入初始化
         this.initRangeInputs();
         
@@ -352,6 +402,38 @@ class RhythmGameApp {
 
     loadSettings() {
         this.updateSettingsUI();
+        this.loadCalibration();
+    }
+
+    // 裝置 ID 存在 localStorage，延遲校準結果以此區分裝置
+    getDeviceId() {
+        let deviceId = localStorage.getItem('rhythm_device_id');
+        if (!deviceId) {
+            deviceId = (window.crypto && crypto.randomUUID)
+                ? crypto.randomUUID()
+                : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+            localStorage.setItem('rhythm_device_id', deviceId);
+        }
+        return deviceId;
+    }
+
+    async loadCalibration() {
+        const valueElement = document.getElementById('calibration-value');
+        const checkbox = document.getElementById('auto-calibrate');
+        try {
+            const response = await fetch(`/api/calibration/${encodeURIComponent(this.deviceId)}`);
+            if (!response.ok) {
+                valueElement.textContent = '尚未校準';
+                checkbox.checked = false;
+                return;
+            }
+            const data = await response.json();
+            const offsetMs = data.calibration.offset * 1000;
+            valueElement.textContent = `${offsetMs >= 0 ? '+' : ''}${offsetMs.toFixed(1)}ms`;
+            checkbox.checked = data.calibration.auto_apply;
+        } catch (error) {
+            console.error('Error loading calibration:', error);
+        }
     }
 
     updateSettingsUI() {
@@ -403,6 +485,15 @@ class RhythmGameApp {
                 body: JSON.stringify(settings)
             });
             
+            // 延遲校準依裝置儲存，不寫入全域設定
+            await fetch(`/api/calibration/${encodeURIComponent(this.deviceId)}`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ auto_apply: document.getElementById('auto-calibrate').checked })
+            });
+            
             if (response.ok) {
                 this.config = settings;
                 this.showNotification('設定已儲存', 'success');
@@ -468,6 +559,7 @@ class RhythmGameApp {
             
             if (response.ok) {
             const data = await response.json();
+            this.subscribeJob(data.job_id);
             this.showNotification('開始下載...', 'info');
                 this.showDownloadProgress();
             } else {
@@ -561,6 +653,90 @@ class RhythmGameApp {
         }
     }
     
+    // 一鍵產生譜面：下載、分析與儲存在伺服器端連續完成，進度只有一個頻道
+    async downloadAndGenerate() {
+        const url = document.getElementById('youtube-url').value.trim();
+        
+        if (!url) {
+            this.showNotification('請輸入 YouTube 連結', 'error');
+            return;
+        }
+        
+        if (!this.isValidYouTubeUrl(url)) {
+            this.showNotification('請輸入有效的 YouTube 連結', 'error');
+            return;
+        }
+        
+        const methodSelect = document.getElementById('generation-method');
+        const method = methodSelect ? methodSelect.value : 'balanced_beat';
+        
+        try {
+            const response = await fetch('/api/pipeline', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ url, method })
+            });
+            
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Pipeline failed');
+            }
+            this.showDownloadProgress();
+            this.subscribeJob(data.job_id);
+            this.showNotification(data.message || '開始下載並產生譜面...', 'info');
+        } catch (error) {
+            console.error('Pipeline error:', error);
+            this.showNotification(`產生譜面失敗: ${error.message}`, 'error');
+        }
+    }
+    
+    handlePipelineProgress(data) {
+        const progressContainer = document.getElementById('download-progress');
+        const progressFill = progressContainer.querySelector('.progress-fill');
+        const progressText = progressContainer.querySelector('.progress-text');
+        const resultContainer = document.getElementById('download-result');
+        
+        if (data.status === 'progress') {
+            progressContainer.style.display = 'block';
+            progressFill.style.width = `${data.progress}%`;
+            progressText.textContent = data.message || `處理中... ${data.progress}%`;
+        } else if (data.status === 'completed') {
+            progressContainer.style.display = 'none';
+            
+            resultContainer.innerHTML = `
+                <div class="success-message">
+                    <h3><i class="fas fa-check-circle"></i> 譜面已完成！</h3>
+                    <p><strong>標題:</strong> ${data.title}</p>
+                    <p><strong>時長:</strong> ${data.duration}</p>
+                    <p><strong>音符數:</strong> ${data.note_count}</p>
+                    <p><strong>耗時:</strong> ${data.elapsed.toFixed(1)} 秒</p>
+                    <button class="btn-primary" onclick="app.playChart('${data.chart_path}')">
+                        <i class="fas fa-play"></i> 開始遊戲
+                    </button>
+                </div>
+            `;
+            
+            this.showNotification('譜面生成完成！', 'success');
+            document.getElementById('youtube-url').value = '';
+        } else if (data.status === 'failed') {
+            progressContainer.style.display = 'none';
+            
+            resultContainer.innerHTML = `
+                <div class="error-message">
+                    <h3><i class="fas fa-exclamation-triangle"></i> ${data.stage === 'download' ? '下載失敗' : '譜面產生失敗'}</h3>
+                    <p>${data.error || '處理失敗'}</p>
+                    <button class="btn-secondary" onclick="app.resetDownloadUI(); app.downloadAndGenerate()">
+                        <i class="fas fa-redo"></i> 重試
+                    </button>
+                </div>
+            `;
+            
+            this.showNotification(`產生譜面失敗: ${data.error}`, 'error');
+        }
+    }
+    
     retryDownload() {
         this.resetDownloadUI();
             this.downloadMusic();
@@ -636,6 +812,7 @@ class RhythmGameApp {
                 <h4>${file.title}</h4>
                 <p>檔案: ${file.filename}</p>
                 <p>時長: ${file.duration || '未知'}</p>
+                <canvas class="waveform" data-filename="${file.filename}" height="48"></canvas>
                 <div class="file-actions">
                     <button class="btn-primary" onclick="app.generateChart('${file.path}', '${file.title}')">
                         <i class="fas fa-waveform-lines"></i> 生成譜面
@@ -647,6 +824,7 @@ class RhythmGameApp {
             </div>
         `).join('');
         
+        RhythmWaveform.renderAll(container);
         this.updateSelectedAudioFilesCount();
     }
     
@@ -669,6 +847,8 @@ class RhythmGameApp {
             });
             
             if (response.ok) {
+                const data = await response.json();
+                this.subscribeJob(data.job_id);
                 this.showNotification('開始生成譜面...', 'info');
             } else {
                 const error = await response.json();
@@ -770,6 +950,10 @@ class RhythmGameApp {
                     <button class="btn-primary" onclick="app.playChart('${chart.path}')">
                         <i class="fas fa-play"></i> 開始遊戲
                     </button>
+                    ${chart.audio_file ? `
+                    <button class="btn-secondary preview-btn" onclick="app.togglePreview('${chart.audio_file}', this)">
+                        <i class="fas fa-headphones"></i> 試聽
+                    </button>` : ''}
                     <button class="btn-danger" onclick="app.deleteChart('${chart.path}', '${chart.title}')">
                         <i class="fas fa-trash-alt"></i> 刪除
                     </button>
@@ -822,6 +1006,37 @@ class RhythmGameApp {
         this.updateSelectedAudioFilesCount();
     }
     
+    // 試聽片段只在按下時才下載（約 20 秒的 MP3），同一時間只播放一首
+    togglePreview(audioFile, button) {
+        if (!this.previewAudio) {
+            this.previewAudio = new Audio();
+            this.previewAudio.preload = 'none';
+            this.previewAudio.addEventListener('ended', () => this.resetPreviewButton());
+        }
+        const wasPlaying = this.previewButton === button && !this.previewAudio.paused;
+        this.previewAudio.pause();
+        this.resetPreviewButton();
+        if (wasPlaying) {
+            return;
+        }
+        
+        this.previewAudio.src = `/api/preview/${encodeURIComponent(audioFile)}`;
+        this.previewButton = button;
+        button.innerHTML = '<i class="fas fa-stop"></i> 停止';
+        this.previewAudio.play().catch(error => {
+            console.error('Preview error:', error);
+            this.showNotification('無法播放試聽片段', 'error');
+            this.resetPreviewButton();
+        });
+    }
+    
+    resetPreviewButton() {
+        if (this.previewButton) {
+            this.previewButton.innerHTML = '<i class="fas fa-headphones"></i> 試聽';
+            this.previewButton = null;
+        }
+    }
+    
     playChart(chartFile) {
         console.log('Playing chart:', chartFile);
         // 跳转到独立的游戏页面
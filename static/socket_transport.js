@@ -0,0 +1,120 @@
+// 節奏遊戲 - Socket.IO 連線建立
+// Rhythm Game - Socket.IO transport selection
+//
+// 伺服器以 RHYTHM_SOCKET_SERIALIZER=msgpack 啟動時，所有封包改為二進位 msgpack，
+// 客戶端必須使用相同的 parser，否則無法解讀任何事件。這裡先查詢伺服器設定，
+// 需要時才載入伺服器提供的 msgpack.js 並建立 parser；載入失敗時不改用 JSON
+// （伺服器仍送出 msgpack，每個事件都會解碼失敗），而是讓 connect() 失敗並顯示錯誤。
+
+const RhythmSocket = (() => {
+    const MSGPACK_URL = 'msgpack.js';
+
+    function loadScript(src) {
+        return new Promise((resolve, reject) => {
+            const script = document.createElement('script');
+            script.src = src;
+            script.onload = resolve;
+            script.onerror = () => reject(new Error(`Failed to load ${src}`));
+            document.head.appendChild(script);
+        });
+    }
+
+    // Socket.IO 的 parser 需要最基本的事件介面（on / off / emit）
+    class Emitter {
+        constructor() {
+            this.listeners = {};
+        }
+
+        on(event, fn) {
+            (this.listeners[event] = this.listeners[event] || []).push(fn);
+            return this;
+        }
+
+        off(event, fn) {
+            if (!event) {
+                this.listeners = {};
+            } else if (!fn) {
+                delete this.listeners[event];
+            } else if (this.listeners[event]) {
+                this.listeners[event] = this.listeners[event].filter(listener => listener !== fn);
+            }
+            return this;
+        }
+
+        emit(event, ...args) {
+            (this.listeners[event] || []).slice().forEach(fn => fn.apply(this, args));
+            return this;
+        }
+    }
+
+    // 與 python-socketio 的 MsgPackPacket 相同：整個封包 {type, data, nsp, id} 以 msgpack 編碼
+    function createMsgpackParser(MessagePack) {
+        class Encoder {
+            encode(packet) {
+                return [MessagePack.encode(packet)];
+            }
+        }
+
+        class Decoder extends Emitter {
+            add(data) {
+                let packet;
+                try {
+                    packet = MessagePack.decode(data);
+                } catch (error) {
+                    console.error('Failed to decode msgpack packet:', error);
+                    throw error;
+                }
+                if (!packet || typeof packet.type !== 'number' || typeof packet.nsp !== 'string') {
+                    console.error('Invalid msgpack packet:', packet);
+                    throw new Error('Invalid msgpack packet');
+                }
+                this.emit('decoded', packet);
+            }
+
+            destroy() {}
+        }
+
+        return { Encoder, Decoder };
+    }
+
+    async function getTransport() {
+        try {
+            const response = await fetch('/api/server/transport');
+            if (response.ok) {
+                return await response.json();
+            }
+        } catch (error) {
+            console.warn('Transport detection failed, using JSON:', error);
+        }
+        return { serializer: 'json', packed_notes: false };
+    }
+
+    // 伺服器使用 msgpack 時必須有相同的 parser，載入失敗時丟出錯誤而不是改用 JSON
+    async function connect() {
+        const transport = await getTransport();
+        const options = {};
+        if (transport.serializer === 'msgpack') {
+            try {
+                if (typeof MessagePack === 'undefined') {
+                    await loadScript(MSGPACK_URL);
+                }
+                options.parser = createMsgpackParser(MessagePack);
+            } catch (error) {
+                console.error('Failed to load msgpack:', error);
+                throw new Error('無法載入 msgpack 解碼器，無法連線到伺服器');
+            }
+        }
+        console.log(`Socket.IO serializer: ${options.parser ? 'msgpack' : 'json'}`);
+        return { socket: io(options), transport };
+    }
+
+    // 將 packed 音符的位元組欄位（msgpack 為 Uint8Array，JSON 附件為 ArrayBuffer）轉為 DataView
+    function toDataView(bytes) {
+        if (bytes instanceof ArrayBuffer) {
+            return new DataView(bytes);
+        }
+        return new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    }
+
+    return { connect, toDataView };
+})();
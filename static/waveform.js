@@ -0,0 +1,107 @@
+// 節奏遊戲 - 波形顯示
+// Rhythm Game - waveform peaks renderer
+//
+// 伺服器預先計算多解析度的 min/max 峰值（GET /api/waveform/<檔名>，格式見 rhythm_game/src/waveform.py），
+// 這裡以 Range 請求先取得標頭與層級表，再只下載最接近畫布寬度的層級，不需下載或解碼音訊。
+
+const RhythmWaveform = (() => {
+    const HEADER_SIZE = 16;
+    const LEVEL_SIZE = 12;
+    // 第一個請求的大小：標頭、層級表與最粗的幾個層級通常都在其中
+    const INITIAL_RANGE = 4096;
+
+    async function fetchRange(url, start, end) {
+        const response = await fetch(url, { headers: { Range: `bytes=${start}-${end - 1}` } });
+        if (!response.ok) {
+            throw new Error(`Waveform request failed: ${response.status}`);
+        }
+        const buffer = await response.arrayBuffer();
+        // 伺服器不支援 Range 時會回傳整個檔案
+        return response.status === 206 ? { buffer, offset: start } : { buffer, offset: 0 };
+    }
+
+    function parseHeader(view) {
+        const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+        if (magic !== 'RFWP') {
+            throw new Error('Invalid waveform data');
+        }
+        const levelCount = view.getUint16(6, true);
+        const levels = [];
+        for (let i = 0; i < levelCount; i++) {
+            const base = HEADER_SIZE + i * LEVEL_SIZE;
+            levels.push({
+                samplesPerPixel: view.getUint32(base, true),
+                length: view.getUint32(base + 4, true),
+                offset: view.getUint32(base + 8, true)
+            });
+        }
+        return {
+            sampleRate: view.getUint32(8, true),
+            sampleCount: view.getUint32(12, true),
+            levels
+        };
+    }
+
+    // 取得像素數不少於 width 的最粗層級（層級由粗到細排列）
+    function pickLevel(levels, width) {
+        return levels.find(level => level.length >= width) || levels[levels.length - 1];
+    }
+
+    async function load(filename, width) {
+        const url = `/api/waveform/${encodeURIComponent(filename)}`;
+        const first = await fetchRange(url, 0, INITIAL_RANGE);
+        const header = parseHeader(new DataView(first.buffer));
+        const level = pickLevel(header.levels, width);
+        const byteLength = level.length * 2;
+
+        let peaks;
+        const firstEnd = first.offset + first.buffer.byteLength;
+        if (level.offset + byteLength <= firstEnd) {
+            peaks = new Int8Array(first.buffer, level.offset - first.offset, byteLength);
+        } else {
+            const part = await fetchRange(url, level.offset, level.offset + byteLength);
+            peaks = new Int8Array(part.buffer, level.offset - part.offset, byteLength);
+        }
+        return { ...header, level, peaks };
+    }
+
+    function draw(canvas, waveform, color = '#64b5f6') {
+        const ctx = canvas.getContext('2d');
+        const { width, height } = canvas;
+        const { peaks } = waveform;
+        const pixels = peaks.length / 2;
+        const mid = height / 2;
+
+        ctx.clearRect(0, 0, width, height);
+        ctx.fillStyle = color;
+        for (let x = 0; x < width; x++) {
+            // 每個畫布像素取對應範圍內的最小與最大值
+            const from = Math.floor(x * pixels / width);
+            const to = Math.max(from + 1, Math.floor((x + 1) * pixels / width));
+            let min = 127;
+            let max = -128;
+            for (let i = from; i < to && i < pixels; i++) {
+                min = Math.min(min, peaks[i * 2]);
+                max = Math.max(max, peaks[i * 2 + 1]);
+            }
+            const top = mid - (max / 128) * mid;
+            const bottom = mid - (min / 128) * mid;
+            ctx.fillRect(x, top, 1, Math.max(1, bottom - top));
+        }
+    }
+
+    // 繪製容器內所有 canvas.waveform（data-filename 為音訊檔名）
+    function renderAll(container) {
+        container.querySelectorAll('canvas.waveform[data-filename]').forEach(async canvas => {
+            canvas.width = canvas.clientWidth || canvas.width;
+            try {
+                draw(canvas, await load(canvas.dataset.filename, canvas.width));
+            } catch (error) {
+                console.warn('Waveform unavailable:', canvas.dataset.filename, error);
+                canvas.style.display = 'none';
+            }
+        });
+    }
+
+    return { load, draw, renderAll };
+})();
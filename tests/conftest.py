@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 與 tools/ 相同，以專案根目錄匯入 rhythm_game.src
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,56 @@
+"""CalibrationStore 的裝置 ID 驗證、容量上限與合併寫入"""
+
+import json
+import time
+
+import pytest
+
+from rhythm_game.src.calibration import CalibrationStore, is_valid_device_id
+
+
+def test_device_id_validation():
+    assert is_valid_device_id('0f8fad5b-d9cb-469f-a165-70867728950e')
+    assert is_valid_device_id('lq2x5k1a-4fzyo82mgbb')
+    assert not is_valid_device_id('short')
+    assert not is_valid_device_id('x' * 65)
+    assert not is_valid_device_id('../../etc/passwd')
+    assert not is_valid_device_id(None)
+
+
+def test_rejects_invalid_device_id(tmp_path):
+    store = CalibrationStore(tmp_path / 'calibration.json')
+    with pytest.raises(ValueError):
+        store.update('not a device id', offset=0.01)
+    assert len(store) == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    store = CalibrationStore(tmp_path / 'calibration.json', max_devices=2)
+    store.update('device-aaaa', offset=0.01)
+    store.update('device-bbbb', offset=0.02)
+    store.get('device-aaaa')
+    store.update('device-cccc', offset=0.03)
+
+    assert len(store) == 2
+    assert store.get('device-bbbb') is None
+    assert store.get('device-aaaa')['offset'] == 0.01
+    store.close()
+
+
+def test_updates_are_coalesced_and_persisted(tmp_path):
+    path = tmp_path / 'calibration.json'
+    store = CalibrationStore(path, save_delay=0.2)
+    store.update('device-aaaa', offset=0.01)
+    store.update('device-aaaa', auto_apply=True)
+    # 更新不會同步寫檔
+    assert not path.exists()
+
+    time.sleep(0.6)
+    with open(path, encoding='utf-8') as f:
+        saved = json.load(f)
+    assert saved['device-aaaa']['offset'] == 0.01
+    assert saved['device-aaaa']['auto_apply'] is True
+
+    store.delete('device-aaaa')
+    store.close()
+    assert CalibrationStore(path).get('device-aaaa') is None
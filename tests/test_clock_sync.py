@@ -0,0 +1,30 @@
+"""ClockSync 狀態保存與還原"""
+
+import json
+
+import pytest
+
+from rhythm_game.src.clock_sync import ClockSync
+
+
+def test_state_round_trip():
+    clock = ClockSync()
+    for index in range(3):
+        ping = clock.create_ping(now=100.0 + index)
+        clock.handle_pong(ping['id'], 5000.0 + index + 0.01 * index, now=100.02 + index + 0.01 * index)
+
+    restored = ClockSync()
+    restored.load_state(json.loads(json.dumps(clock.get_state())))
+
+    assert restored.is_synced
+    assert restored.sample_count == 3
+    assert restored.rtt == pytest.approx(clock.rtt)
+    assert restored.offset == pytest.approx(clock.offset, abs=1e-3)
+    assert restored.to_server_time(5001.5, 102.0) == pytest.approx(clock.to_server_time(5001.5, 102.0), abs=1e-3)
+
+
+def test_empty_state():
+    restored = ClockSync()
+    restored.load_state({})
+    assert not restored.is_synced
+    assert restored.sample_count == 0
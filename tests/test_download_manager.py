@@ -0,0 +1,180 @@
+"""DownloadManager 與 YouTubeDownloader（以本機 http.server 代替影片網站）"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('yt_dlp')
+
+from rhythm_game.src.download_manager import DownloadManager, DownloadQueueFull, download_key
+from rhythm_game.src.downloader import YouTubeDownloader
+
+MEDIA = bytes(range(256)) * 16
+
+
+def media_for(path):
+    """每個路徑回傳不同的內容，用來確認檔案沒有被其他下載覆蓋"""
+    return MEDIA + path.encode()
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """回傳固定的音訊內容；gate 未設定前暫停回應，用來讓下載停在進行中"""
+
+    def _respond(self, body):
+        self.server.gate.wait(10)
+        self.server.requests.append(self.path)
+        content = media_for(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def media_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+    server.daemon_threads = True
+    server.gate = threading.Event()
+    server.gate.set()
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = lambda name: f"http://127.0.0.1:{server.server_address[1]}/{name}.m4a"
+    try:
+        yield server
+    finally:
+        server.gate.set()
+        server.shutdown()
+        server.server_close()
+
+
+class LocalDownloader(YouTubeDownloader):
+    """測試用：不在請求之間隨機等待"""
+
+    def get_ydl_opts(self, output_template, progress_callback=None):
+        opts = super().get_ydl_opts(output_template, progress_callback)
+        for key in ('sleep_interval', 'max_sleep_interval', 'sleep_interval_requests', 'sleep_interval_subtitles'):
+            opts.pop(key, None)
+        opts['quiet'] = True
+        opts['noprogress'] = True
+        return opts
+
+
+@pytest.fixture
+def downloader(tmp_path):
+    return LocalDownloader(str(tmp_path / 'downloads'))
+
+
+def make_manager(tmp_path, **kwargs):
+    return DownloadManager(cache_path=str(tmp_path / 'downloads.json'), **kwargs)
+
+
+def make_job_factory():
+    counter = iter(range(1000))
+    return lambda: f"job-{next(counter)}"
+
+
+def make_task(downloader):
+    return lambda job_id, url: downloader.download_audio(url, extract_audio=False)
+
+
+def test_download_key():
+    assert download_key('https://youtu.be/abc123') == 'youtube:abc123'
+    assert download_key('https://www.youtube.com/watch?v=abc123&t=5') == 'youtube:abc123'
+    assert download_key(' http://127.0.0.1/song.m4a ') == 'http://127.0.0.1/song.m4a'
+
+
+def test_download_from_local_server(media_server, downloader):
+    audio_path, title = downloader.download_audio(media_server.url('song'), extract_audio=False)
+    assert title == 'song'
+    with open(audio_path, 'rb') as f:
+        assert f.read() == media_for('/song.m4a')
+
+
+def test_same_title_does_not_overwrite(media_server, downloader):
+    # 另一部標題清理後相同的影片已下載為 song.m4a
+    existing = downloader.download_dir / 'song.m4a'
+    existing.write_bytes(b'other video')
+
+    audio_path, _ = downloader.download_audio(media_server.url('song'), extract_audio=False)
+    assert audio_path.endswith('/song_song.m4a')
+    assert existing.read_bytes() == b'other video'
+    with open(audio_path, 'rb') as f:
+        assert f.read() == media_for('/song.m4a')
+
+
+def test_concurrent_requests_share_job(tmp_path, media_server, downloader):
+    manager = make_manager(tmp_path)
+    create_job = make_job_factory()
+    task = make_task(downloader)
+    url = media_server.url('song')
+
+    media_server.gate.clear()
+    first, created = manager.submit(url, create_job, task)
+    assert created
+    second, created = manager.submit(url, create_job, task)
+    assert second == first and not created
+    assert manager.pending == 1
+
+    media_server.gate.set()
+    manager.join()
+    metrics = manager.get_metrics()
+    assert metrics['queued'] == 1 and metrics['joined'] == 1
+    assert manager.pending == 0
+    assert (tmp_path / 'downloads' / 'song.m4a').read_bytes() == media_for('/song.m4a')
+
+
+def test_cache_hit(tmp_path, media_server, downloader):
+    manager = make_manager(tmp_path)
+    url = media_server.url('song')
+    assert manager.get_cached(url) is None
+
+    manager.submit(url, make_job_factory(), make_task(downloader))
+    manager.join()
+    requests = len(media_server.requests)
+
+    record = manager.get_cached(url)
+    assert record['title'] == 'song'
+    assert manager.get_metrics()['cached'] == 1
+
+    # 記錄寫入檔案，其他工作者也能使用
+    restored = make_manager(tmp_path).get_cached(url)
+    assert restored['audio_path'] == record['audio_path']
+    assert len(media_server.requests) == requests
+
+    # 檔案被刪除後視為未命中
+    (tmp_path / 'downloads' / 'song.m4a').unlink()
+    assert manager.get_cached(url) is None
+    assert manager.get_metrics()['cached_entries'] == 0
+
+
+def test_full_queue_is_rejected(tmp_path, media_server, downloader):
+    manager = make_manager(tmp_path, max_workers=1, max_pending=1)
+    create_job = make_job_factory()
+    task = make_task(downloader)
+
+    media_server.gate.clear()
+    job_id, _ = manager.submit(media_server.url('first'), create_job, task)
+    with pytest.raises(DownloadQueueFull):
+        manager.submit(media_server.url('second'), create_job, task)
+    # 相同的下載仍可共用進行中的工作
+    assert manager.submit(media_server.url('first'), create_job, task) == (job_id, False)
+    assert manager.get_metrics()['rejected'] == 1
+
+    media_server.gate.set()
+    manager.join()
+    assert manager.submit(media_server.url('second'), create_job, task)[1]
+    manager.join()
+    assert manager.get_cached(media_server.url('second'))['title'] == 'second'
@@ -0,0 +1,82 @@
+"""pipeline_chart_job 的轉檔暫存檔處理與 AnalysisExecutor 的就緒判斷"""
+
+import numpy as np
+import pytest
+
+sf = pytest.importorskip('soundfile')
+pytest.importorskip('librosa')
+
+from rhythm_game.src import jobs
+from rhythm_game.src.waveform import peaks_path
+
+
+class FailingAnalyzer:
+    sr = 22050
+
+    def __init__(self, error=None):
+        self.error = error
+        self.stage_timings = {}
+
+    def generate_chart(self, audio_path, **kwargs):
+        if self.error is not None:
+            raise self.error
+        return None
+
+    def save_chart(self, chart_data):
+        raise AssertionError('不應儲存分析失敗的譜面')
+
+
+@pytest.fixture
+def source(tmp_path):
+    # .aiff 不在瀏覽器可播放的格式中，需轉為 FLAC
+    path = tmp_path / 'song.aiff'
+    t = np.linspace(0, 1, 22050, endpoint=False)
+    sf.write(str(path), 0.5 * np.sin(2 * np.pi * 440 * t), 22050, format='AIFF')
+    return path
+
+
+def use_analyzer(monkeypatch, analyzer):
+    monkeypatch.setattr(jobs, '_get_worker_analyzer', lambda *args: analyzer)
+
+
+def test_transcoded_file_removed_when_analysis_raises(monkeypatch, source):
+    use_analyzer(monkeypatch, FailingAnalyzer(RuntimeError('analysis failed')))
+    with pytest.raises(RuntimeError):
+        jobs.pipeline_chart_job(str(source))
+
+    flac = source.with_suffix('.flac')
+    assert source.exists()
+    assert not flac.exists()
+    assert not peaks_path(flac).exists()
+
+
+def test_transcoded_file_removed_when_analysis_fails(monkeypatch, source):
+    use_analyzer(monkeypatch, FailingAnalyzer())
+    chart_data, chart_path, audio_path, _ = jobs.pipeline_chart_job(str(source))
+
+    assert chart_data is None and chart_path is None
+    assert audio_path == source.as_posix()
+    assert not source.with_suffix('.flac').exists()
+
+
+def test_executor_ready_when_every_worker_reported():
+    executor = jobs.AnalysisExecutor(max_workers=2)
+    # 以一般佇列代替分析行程 initializer 使用的 multiprocessing 佇列
+    executor._ready_queue = jobs.queue.Queue()
+    assert not executor.ready
+
+    # 同一個行程重複回報只算一次
+    executor._ready_queue.put((101, 1.5))
+    executor._ready_queue.put((101, 1.5))
+    assert not executor.ready
+    assert executor.get_status()['warm_workers'] == 1
+
+    executor._ready_queue.put((102, 2.0))
+    assert executor.wait_ready(timeout=1)
+    status = executor.get_status()
+    assert status['ready'] and status['warm_up_seconds'] == [1.5, 2.0]
+
+
+def test_executor_without_warm_up_is_ready():
+    executor = jobs.AnalysisExecutor(max_workers=1, warm_up=False)
+    assert executor.ready and executor.wait_ready(timeout=0)
@@ -0,0 +1,30 @@
+"""min_interval_filter 與逐一比較的迴圈結果一致"""
+
+import numpy as np
+import pytest
+
+from rhythm_game.src.onsets import min_interval_filter
+
+
+def filter_loop(times, min_interval):
+    keep = []
+    for index, value in enumerate(times):
+        if not keep or value - times[keep[-1]] >= min_interval:
+            keep.append(index)
+    return keep
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_min_interval_filter_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    # 以 0.01 秒取整，產生大量重複值與剛好等於最小間隔的邊界
+    times = np.sort(np.round(rng.uniform(0, 30, size=rng.integers(1, 2000)), 2))
+    for min_interval in (0.01, 0.05, 0.07, 0.1, 0.3):
+        assert min_interval_filter(times, min_interval).tolist() == filter_loop(times, min_interval)
+
+
+def test_min_interval_filter_edge_cases():
+    assert min_interval_filter(np.array([]), 0.1).tolist() == []
+    assert min_interval_filter(np.array([1.0]), 0.1).tolist() == [0]
+    times = np.array([0.0, 0.0, 0.1, 0.1, 0.2, 0.30000000000000004, 0.4])
+    assert min_interval_filter(times, 0.1).tolist() == filter_loop(times, 0.1)
@@ -0,0 +1,81 @@
+"""ProgressBroadcaster 的節流、發送順序與頻道清理"""
+
+from rhythm_game.src.progress import ProgressBroadcaster, job_room
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_emits_outside_lock():
+    events = []
+    broadcaster = None
+
+    def emit(event, payload, room):
+        # 發送時共用鎖必須已釋放
+        assert broadcaster._lock.acquire(blocking=False)
+        broadcaster._lock.release()
+        events.append((event, payload['status'], room))
+
+    broadcaster = ProgressBroadcaster(emit, max_rate=0)
+    job_id = broadcaster.create_job('chart_progress')
+    broadcaster.publish(job_id, {'status': 'analyzing'})
+    broadcaster.publish(job_id, {'status': 'completed'})
+    assert events == [('chart_progress', 'analyzing', job_room(job_id)),
+                      ('chart_progress', 'completed', job_room(job_id))]
+
+
+def test_coalesced_progress_is_flushed_but_never_after_final():
+    events = []
+    flushes = []
+    clock = FakeClock()
+    broadcaster = ProgressBroadcaster(
+        lambda event, payload, room: events.append(payload.get('progress', payload['status'])),
+        max_rate=5, clock=clock, spawn=lambda target, *args: flushes.append((target, args)),
+        sleep=lambda delay: None)
+    job_id = broadcaster.create_job('download_progress')
+
+    broadcaster.publish(job_id, {'status': 'progress', 'progress': 10})
+    broadcaster.publish(job_id, {'status': 'progress', 'progress': 20})
+    broadcaster.publish(job_id, {'status': 'progress', 'progress': 30})
+    assert events == [10]
+    target, args = flushes.pop()
+    target(*args)
+    assert events == [10, 30]
+    assert broadcaster.get_metrics()['coalesced'] == 1
+
+    # 補送配號後、送出前被最終狀態超前時，舊進度不再送出
+    clock.now += 0.1
+    broadcaster.publish(job_id, {'status': 'progress', 'progress': 40})
+    channel = broadcaster._channels[job_id]
+    with broadcaster._lock:
+        channel.pending = None
+        stale_seq = broadcaster._claim_emit(channel)
+    broadcaster.publish(job_id, {'status': 'completed'})
+    broadcaster._send(job_id, channel, stale_seq, {'status': 'progress', 'progress': 40})
+    assert events == [10, 30, 'completed']
+
+
+def test_idle_and_finished_channels_are_pruned():
+    clock = FakeClock()
+    broadcaster = ProgressBroadcaster(lambda *args: None, max_rate=0, retain=60, idle_ttl=600, clock=clock)
+    stalled = broadcaster.create_job('download_progress')
+    finished = broadcaster.create_job('download_progress')
+    active = broadcaster.create_job('download_progress')
+    broadcaster.publish(stalled, {'status': 'progress', 'progress': 5})
+    broadcaster.publish(finished, {'status': 'completed'})
+
+    clock.now += 300
+    broadcaster.publish(active, {'status': 'progress', 'progress': 50})
+    assert broadcaster.prune() == 1
+    assert broadcaster.snapshot(finished) is None
+
+    clock.now += 400
+    assert broadcaster.prune() == 1
+    assert broadcaster.snapshot(stalled) is None
+    assert broadcaster.snapshot(active) is not None
+
@@ -0,0 +1,83 @@
+"""ReplayEngine 重新判定的結果與遊戲中的即時判定（WebGameSession）一致"""
+
+import copy
+
+import numpy as np
+import pytest
+
+app = pytest.importorskip('app')
+
+from rhythm_game.src.replay import ReplayEngine, KIND_AUTO_MISS
+
+# 與 play.js 相同：超過 good 判定（0.25s）後送出 auto_miss
+AUTO_MISS_DELAY = 0.25
+
+
+def make_chart(rng, note_count=200):
+    times = np.sort(rng.uniform(1.0, 60.0, size=note_count))
+    return {'notes': [{'time': float(t), 'lane': int(rng.integers(0, 4))} for t in times]}
+
+
+def auto_miss(session, lane, note_time):
+    """與 handle_auto_miss 相同的處理"""
+    for note in session.chart_data['notes']:
+        if note['lane'] == lane and abs(note['time'] - note_time) < 1e-3 and not note.get('hit', False):
+            note['hit'] = True
+            note['judgment'] = 'miss'
+            break
+    session.game_stats.add_judgment('miss')
+    session.record_input(lane, KIND_AUTO_MISS, note_time)
+
+
+def play_live(chart, rng, jitter):
+    """
+    依時間順序送出按鍵，並像瀏覽器一樣對超過判定範圍仍未擊中的音符送出 auto_miss
+
+    Returns:
+        tuple: (即時判定結果, 重播檔路徑)
+    """
+    session = app.WebGameSession('equivalence')
+    session.chart_path = 'equivalence.json'
+    session.chart_data = copy.deepcopy(chart)
+    session.start_game()
+
+    events = []
+    for index, note in enumerate(chart['notes']):
+        if rng.random() < 0.85:
+            events.append((note['time'] + rng.normal(0, jitter), 'tap', note['lane']))
+        events.append((note['time'] + AUTO_MISS_DELAY, 'check', index))
+    # 沒有對應音符的多餘按鍵
+    for _ in range(20):
+        events.append((rng.uniform(0, 60), 'tap', int(rng.integers(0, 4))))
+    events.sort(key=lambda event: event[0])
+
+    for game_time, kind, value in events:
+        if kind == 'tap':
+            session.hit_note(value, game_time, received_at=session.start_mono + game_time)
+        else:
+            note = session.chart_data['notes'][value]
+            if not note.get('hit', False):
+                auto_miss(session, note['lane'], note['time'])
+
+    replay_path = session.replay.path
+    result = session.game_stats.to_dict()
+    session.end_game()
+    return result, replay_path
+
+
+@pytest.mark.parametrize('seed, jitter', [(0, 0.03), (1, 0.08), (2, 0.15), (3, 0.3)])
+def test_rescore_matches_live_judging(tmp_path, monkeypatch, seed, jitter):
+    monkeypatch.setattr(app, 'REPLAY_DIR', str(tmp_path))
+    rng = np.random.default_rng(seed)
+    chart = make_chart(rng)
+
+    live, replay_path = play_live(chart, rng, jitter)
+    engine = ReplayEngine(tolerances=app.config_manager.get('judgment_tolerances', {}),
+                          chart_loader=lambda path: chart)
+    rescored = engine.rescore([replay_path])[0]
+
+    assert rescored['judgments'] == live['judgments']
+    assert rescored['score'] == live['score']
+    assert rescored['max_combo'] == live['max_combo']
+    assert rescored['accuracy'] == pytest.approx(live['accuracy'])
+    assert rescored['grade'] == live['grade']
@@ -0,0 +1,53 @@
+"""ScoreStore 的延遲建立、批次寫入與名次查詢"""
+
+import pytest
+
+from rhythm_game.src.scores import ScoreStore
+
+
+def results(score):
+    return {'score': score, 'max_combo': 10, 'accuracy': 90.0, 'grade': 'A',
+            'judgments': {'perfect': 8, 'great': 1, 'good': 1, 'miss': 0}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ScoreStore(tmp_path / 'scores.db', flush_interval=0.01)
+    yield store
+    store.close()
+
+
+def test_database_created_on_start(tmp_path):
+    store = ScoreStore(tmp_path / 'scores.db')
+    assert not (tmp_path / 'scores.db').exists()
+    assert store.get_metrics()['pending'] == 0
+    store.start()
+    assert (tmp_path / 'scores.db').exists()
+    store.close()
+
+
+def test_personal_best_ranks_match_leaderboard(store):
+    for index, score in enumerate([500, 900, 700, 900, 300]):
+        store.submit('song_a.json', f'player-{index}', results(score))
+    store.submit('song_b.json', 'player-4', results(100))
+    store.submit('song_b.json', 'player-1', results(50))
+    store.flush()
+
+    leaderboard = {entry['player_id']: entry['rank']
+                   for entry in store.get_leaderboard('song_a.json', limit=10)['entries']}
+    assert leaderboard == {'player-1': 1, 'player-3': 2, 'player-2': 3, 'player-0': 4, 'player-4': 5}
+
+    bests = store.get_personal_bests('player-4')['entries']
+    assert [(entry['chart_id'], entry['rank']) for entry in bests] == [('song_a.json', 5), ('song_b.json', 1)]
+    for entry in bests:
+        assert entry['rank'] == store.get_rank(entry['chart_id'], entry['score'], entry['play_id'])
+
+
+def test_dropped_when_queue_full(tmp_path):
+    store = ScoreStore(tmp_path / 'scores.db', max_pending=1, flush_interval=0.5)
+    store.start()
+    accepted = [store.submit('song.json', 'player-0', results(100)) for _ in range(50)]
+    metrics = store.get_metrics()
+    assert metrics['dropped'] == accepted.count(False) > 0
+    store.close()
+    assert store.get_metrics()['written'] == accepted.count(True)
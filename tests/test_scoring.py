@@ -0,0 +1,59 @@
+"""ScoreCalculator 批次 API 與逐筆計分（GameStats + calculate_note_score）一致"""
+
+import numpy as np
+import pytest
+
+from rhythm_game.src.utils import GameStats, ScoreCalculator, JUDGMENT_NAMES
+
+
+def score_per_note(calculator, judgments):
+    """與 WebGameSession.hit_note / handle_auto_miss 相同的逐筆計分"""
+    stats = GameStats()
+    note_scores = []
+    for judgment in judgments:
+        stats.add_judgment(judgment)
+        score = calculator.calculate_note_score(judgment, stats.combo) if judgment != 'miss' else 0
+        stats.add_score(score)
+        note_scores.append(score)
+    return stats.to_dict(), note_scores
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batch_matches_per_note(seed):
+    rng = np.random.default_rng(seed)
+    calculator = ScoreCalculator()
+    # 偏向 hit 的序列，combo 才會超過加成門檻
+    judgments = list(rng.choice(JUDGMENT_NAMES, size=300, p=[0.5, 0.25, 0.15, 0.1]))
+
+    expected, expected_scores = score_per_note(calculator, judgments)
+    batch = calculator.calculate_batch(calculator.encode_judgments(judgments))
+
+    assert batch['note_scores'].tolist() == expected_scores
+    assert int(batch['score'][0]) == expected['score']
+    assert int(batch['max_combo'][0]) == expected['max_combo']
+    assert dict(zip(JUDGMENT_NAMES, batch['judgments'][0].tolist())) == expected['judgments']
+    assert float(batch['accuracy'][0]) == pytest.approx(expected['accuracy'])
+    assert str(batch['grade'][0]) == expected['grade']
+
+
+def test_batch_segments_match_separate_games():
+    rng = np.random.default_rng(42)
+    calculator = ScoreCalculator()
+    # 第 2 場沒有任何判定
+    games = [list(rng.choice(JUDGMENT_NAMES, size=size)) for size in (50, 0, 120, 1)]
+
+    codes = np.concatenate([calculator.encode_judgments(game) for game in games]).astype(np.int64)
+    segment_ids = np.repeat(np.arange(len(games)), [len(game) for game in games])
+    batch = calculator.calculate_batch(codes, segment_ids, len(games))
+
+    for index, game in enumerate(games):
+        expected, _ = score_per_note(calculator, game)
+        assert int(batch['score'][index]) == expected['score']
+        assert int(batch['max_combo'][index]) == expected['max_combo']
+        assert str(batch['grade'][index]) == expected['grade']
+
+
+def test_grade_batch_matches_get_grade():
+    calculator = ScoreCalculator()
+    accuracy = np.concatenate([np.linspace(0, 100, 1001), [threshold for threshold, _ in calculator.grade_thresholds]])
+    assert calculator.get_grade_batch(accuracy).tolist() == [calculator.get_grade(value) for value in accuracy]
@@ -0,0 +1,66 @@
+"""練習範圍譜面由已儲存的整首譜面切出"""
+
+import json
+
+import numpy as np
+import pytest
+
+sf = pytest.importorskip('soundfile')
+pytest.importorskip('librosa')
+
+from rhythm_game.src.analyzer import AudioAnalyzer
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    # 譜面資料夾為相對於工作目錄的 rhythm_game/charts
+    monkeypatch.chdir(tmp_path)
+    return AudioAnalyzer()
+
+
+@pytest.fixture
+def song(tmp_path):
+    path = tmp_path / 'song.wav'
+    sf.write(str(path), np.zeros(22050 * 10, dtype=np.float32), 22050)
+    return path
+
+
+def save_chart(analyzer, name, **fields):
+    chart = {
+        'song_title': name,
+        'audio_file': 'song.wav',
+        'bpm': 120.0,
+        'notes': [{'time': 0.5 * index, 'lane': index % 4} for index in range(1, 20)],
+        'created_method': 'balanced_beat',
+        'analysis_profile': analyzer.profile,
+        **fields
+    }
+    with open(analyzer.charts_dir / f"{name}.json", 'w', encoding='utf-8') as f:
+        json.dump(chart, f)
+    return chart
+
+
+def test_find_song_chart(analyzer, song):
+    assert analyzer.find_song_chart(song) is None
+    save_chart(analyzer, 'energy', created_method='energy')
+    save_chart(analyzer, 'practice', section={'start': 1.0, 'end': 2.0})
+    save_chart(analyzer, 'other', audio_file='other.wav')
+    assert analyzer.find_song_chart(song) is None
+
+    chart = save_chart(analyzer, 'full')
+    assert analyzer.find_song_chart(song) == chart
+    assert analyzer.find_song_chart(song, 'energy')['song_title'] == 'energy'
+
+
+def test_section_sliced_from_saved_chart(analyzer, song):
+    full = save_chart(analyzer, 'full')
+    chart_data, clip, sr = analyzer.generate_section_chart(str(song), 4.0, 6.0)
+
+    # 練習音訊從範圍前 2 秒開始，音符時間以片段開頭為 0
+    expected = [{'time': note['time'] - 2.0, 'lane': note['lane']} for note in full['notes']
+                if 4.0 <= note['time'] < 6.0]
+    assert chart_data['notes'] == expected
+    assert chart_data['bpm'] == 120.0
+    assert chart_data['section'] == {'audio_file': 'song.wav', 'start': 4.0, 'end': 6.0, 'offset': 2.0}
+    assert clip.shape[0] == int(round(5.0 * sr))
+    assert 'slice' in analyzer.stage_timings
@@ -0,0 +1,194 @@
+"""RedisSessionStore 與 SessionRegistry（以 fakeredis 代替 Redis 伺服器）"""
+
+import time
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from rhythm_game.src import session_store
+from rhythm_game.src.session_store import RedisSessionStore, create_session_store
+from rhythm_game.src.sessions import SessionRegistry
+
+
+class FakeSession:
+    """只實作 to_state / from_state 的會話"""
+
+    def __init__(self, session_id, judged=None):
+        self.session_id = session_id
+        self.judged = dict(judged or {})
+
+    def to_state(self):
+        return {'session_id': self.session_id, 'judged': self.judged}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['session_id'], state['judged'])
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_store(server):
+    client = fakeredis.FakeRedis(server=server)
+    return RedisSessionStore('redis://fake', FakeSession.from_state, client=client)
+
+
+def test_round_trip(server):
+    store = make_store(server)
+    store.save('a', FakeSession('a', {'3': 'perfect'}), ttl=60)
+
+    restored = make_store(server).load('a')
+    assert restored.session_id == 'a'
+    assert restored.judged == {'3': 'perfect'}
+    assert store.load('missing') is None
+
+
+def test_delete(server):
+    store = make_store(server)
+    store.save('a', FakeSession('a'), ttl=60)
+    store.delete('a')
+    assert store.load('a') is None
+    assert store.count() == 0
+
+
+def test_expiry(server, monkeypatch):
+    store = make_store(server)
+    store.save('short', FakeSession('short'), ttl=10)
+    store.save('long', FakeSession('long'), ttl=100)
+    assert store.client.ttl(store._key('short')) == 10
+    assert sorted(store.ids()) == ['long', 'short']
+
+    # 索引以 time.time() 判斷到期
+    now = session_store.time.time()
+    monkeypatch.setattr(session_store.time, 'time', lambda: now + 50)
+    assert store.count() == 1
+    assert store.ids() == ['long']
+
+
+def test_corrupt_state_is_ignored(server):
+    store = make_store(server)
+    store.client.set(store._key('bad'), b'{not json')
+    assert store.load('bad') is None
+
+
+def test_create_session_store():
+    assert not create_session_store(None).shared
+    assert not create_session_store('memory').shared
+    with pytest.raises(ValueError):
+        create_session_store('mysql://localhost')
+
+
+def test_capacity_is_shared_between_workers(server):
+    first = SessionRegistry(max_sessions=2, reap_interval=0, store=make_store(server))
+    second = SessionRegistry(max_sessions=2, reap_interval=0, store=make_store(server))
+
+    assert first.add('a', FakeSession('a'))
+    assert second.add('b', FakeSession('b'))
+    assert not first.has_capacity('c')
+    assert not second.add('c', FakeSession('c'))
+    # 已有會話的連線重新開始遊戲不受上限影響
+    assert first.has_capacity('a')
+    assert second.get_metrics()['rejected'] == 1
+
+    first.remove('a')
+    assert second.add('c', FakeSession('c'))
+    assert second.get_metrics()['store_sessions'] == 2
+
+
+def test_restore_from_other_worker(server):
+    first = SessionRegistry(reap_interval=0, store=make_store(server))
+    second = SessionRegistry(reap_interval=0, store=make_store(server))
+    first.add('a', FakeSession('a', {'0': 'great'}))
+
+    restored = second.get('a')
+    assert restored is not None and restored is not first.get('a')
+    assert restored.judged == {'0': 'great'}
+    assert second.get('missing') is None
+
+
+def test_throttled_save(server):
+    store = make_store(server)
+    registry = SessionRegistry(reap_interval=0, save_interval=60, store=store)
+    session = FakeSession('a')
+    registry.add('a', session)
+
+    # 一般儲存只標記為待寫入
+    session.judged['0'] = 'perfect'
+    registry.save('a')
+    assert store.load('a').judged == {}
+    assert registry.get_metrics()['pending_saves'] == 1
+
+    assert registry.flush() == 1
+    assert store.load('a').judged == {'0': 'perfect'}
+    assert registry.get_metrics()['pending_saves'] == 0
+    assert registry.flush() == 0
+
+    # flush=True 立即寫入
+    session.judged['1'] = 'miss'
+    registry.save('a', flush=True)
+    assert store.load('a').judged == {'0': 'perfect', '1': 'miss'}
+
+
+def test_size_estimate_refreshed_on_reap():
+    registry = SessionRegistry(reap_interval=0)
+    session = FakeSession('a')
+    registry.add('a', session)
+    before = registry.get_metrics()['memory_bytes_total']
+
+    # 輸入後的儲存不重新估計，背景清理時才更新
+    session.judged.update({str(index): 'perfect' for index in range(500)})
+    registry.save('a')
+    assert registry.get_metrics()['memory_bytes_total'] == before
+    registry.reap(update_sizes=True)
+    assert registry.get_metrics()['memory_bytes_total'] > before
+
+
+class BlockingStore(session_store.InProcessSessionStore):
+    """save 在 release 設定前不會返回，模擬緩慢的網路寫入"""
+
+    def __init__(self):
+        super().__init__()
+        self.saving = threading.Event()
+        self.release = threading.Event()
+
+    def save(self, session_id, session, ttl=None):
+        if session_id == 'slow':
+            self.saving.set()
+            self.release.wait(5)
+        super().save(session_id, session, ttl)
+
+
+def test_store_io_runs_outside_the_lock():
+    store = BlockingStore()
+    registry = SessionRegistry(reap_interval=0, save_interval=60, store=store)
+    registry.add('fast', FakeSession('fast'))
+    writer = threading.Thread(target=registry.add, args=('slow', FakeSession('slow')))
+    writer.start()
+    try:
+        assert store.saving.wait(5)
+        # 寫入進行中，其他連線仍可取得與標記會話
+        assert registry.get('fast') is not None
+        registry.save('fast')
+        assert registry.get_metrics()['pending_saves'] == 1
+    finally:
+        store.release.set()
+        writer.join(5)
+    assert store.load('slow') is not None
+
+
+def test_reaper_flushes_pending_saves(server):
+    store = make_store(server)
+    registry = SessionRegistry(reap_interval=0, save_interval=0.05, store=store)
+    session = FakeSession('a')
+    registry.add('a', session)
+    session.judged['0'] = 'good'
+    registry.save('a')
+    try:
+        time.sleep(0.5)
+        assert store.load('a').judged == {'0': 'good'}
+    finally:
+        registry.stop()
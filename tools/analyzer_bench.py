@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+譜面分析效能與準確度回歸測試
+Analyzer Benchmark and Accuracy Regression Suite
+
+合成已知答案的測試音訊（節拍器、鼓組、變速、無聲段落與背景噪音，30 秒到 30 分鐘），
+寫成暫存 wav 後以 AudioAnalyzer.generate_chart 產生譜面，記錄每個 lane 分配方法與
+分析設定檔的總時間、各步驟秒數（decode、features、onsets、beats、merge、lanes），
+以及譜面音符相對於實際 onset 的 F-measure（±50 ms）與 BPM 誤差（允許兩倍 / 一半）。
+
+指定 --baseline 時與先前的 JSON 結果比較，變慢或準確度下降超過容許值時以非零狀態結束，
+可放進 CI 防止效能或準確度退化。不需要網路，只需要 requirements.txt 的套件。
+
+用法:
+    python tools/analyzer_bench.py                                   # quick：5 分鐘以內的曲目
+    python tools/analyzer_bench.py --suite full --json baseline.json  # 含 10 與 30 分鐘
+    python tools/analyzer_bench.py --baseline baseline.json --max-slowdown 0.3
+    python tools/analyzer_bench.py --tracks click_30s drums_tempo_change --profiles accurate fast
+"""
+
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import contextlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import soundfile as sf
+
+from rhythm_game.src.analyzer import AudioAnalyzer
+from rhythm_game.src.detectors import ANALYSIS_PROFILES
+from rhythm_game.src.evaluation import synthesize_sections, dominant_tempo, onset_f_measure, tempo_error
+
+SR = 22050
+
+# 測試曲目：sections 為 [(秒數, BPM)]，BPM 為 0 表示無聲段落
+TRACKS = {
+    'click_30s': {'sections': [(30, 120)], 'pattern': 'click', 'noise': 0.0, 'suite': 'quick'},
+    'drums_2min_noise': {'sections': [(120, 96)], 'pattern': 'drums', 'noise': 0.05, 'suite': 'quick'},
+    'drums_tempo_change': {
+        'sections': [(60, 128), (45, 150), (60, 128)], 'pattern': 'drums', 'noise': 0.02, 'suite': 'quick'
+    },
+    'drums_silence_break': {
+        'sections': [(50, 110), (15, 0), (55, 110)], 'pattern': 'drums', 'noise': 0.01, 'suite': 'quick'
+    },
+    'drums_5min': {'sections': [(300, 174)], 'pattern': 'drums', 'noise': 0.02, 'suite': 'quick'},
+    'drums_10min': {'sections': [(600, 140)], 'pattern': 'drums', 'noise': 0.02, 'suite': 'full'},
+    'drums_30min': {
+        'sections': [(900, 124), (30, 0), (870, 132)], 'pattern': 'drums', 'noise': 0.03, 'suite': 'full'
+    },
+}
+
+# 預設量測的 lane 分配方法（'energy_analysis' 與 'energy' 相同）
+METHODS = ['balanced_beat', 'energy']
+SUPPORTED_METHODS = METHODS + ['energy_analysis']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='RhythmForge analyzer benchmark')
+    parser.add_argument('--suite', choices=['quick', 'full'], default='quick',
+                        help='quick 只跑 5 分鐘以內的曲目，full 另含 10 與 30 分鐘')
+    parser.add_argument('--tracks', nargs='+', metavar='track', help=f"只跑指定曲目：{', '.join(TRACKS)}")
+    parser.add_argument('--methods', nargs='+', metavar='method', default=METHODS,
+                        help=f"lane 分配方法（預設 {' '.join(METHODS)}）")
+    parser.add_argument('--profiles', nargs='+', metavar='profile', default=['accurate'],
+                        help=f"分析設定檔：{', '.join(ANALYSIS_PROFILES)}（預設 accurate）")
+    parser.add_argument('--repeat', type=int, default=1, help='每項重複次數（時間取中位數）')
+    parser.add_argument('--json', help='將結果寫入 JSON 檔案（可作為之後的 --baseline）')
+    parser.add_argument('--baseline', help='比較用的先前結果 JSON')
+    parser.add_argument('--max-slowdown', type=float, default=0.25,
+                        help='總時間可比基準慢的比例（預設 0.25 = 25%%）')
+    parser.add_argument('--min-seconds', type=float, default=0.5,
+                        help='基準時間短於此秒數的項目不檢查速度（計時誤差過大）')
+    parser.add_argument('--max-f-drop', type=float, default=0.02, help='onset F-measure 可比基準低多少')
+    parser.add_argument('--max-bpm-error-increase', type=float, default=0.01, help='BPM 相對誤差可比基準高多少')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.tracks or [] if name not in TRACKS]
+    unknown += [name for name in args.methods if name not in SUPPORTED_METHODS]
+    unknown += [name for name in args.profiles if name not in ANALYSIS_PROFILES]
+    if unknown:
+        parser.error(f"未知的曲目、方法或設定檔: {', '.join(unknown)}")
+    return args
+
+
+def select_tracks(args):
+    if args.tracks:
+        return args.tracks
+    suites = ('quick', 'full') if args.suite == 'full' else ('quick',)
+    return [name for name, track in TRACKS.items() if track['suite'] in suites]
+
+
+def write_track(name, track, directory):
+    """合成曲目並寫成 wav，回傳 (路徑, onset 時間, 參考 BPM, 長度)"""
+    y, onset_times, _ = synthesize_sections(
+        track['sections'], sr=SR, pattern=track['pattern'], seed=len(name), noise=track['noise'])
+    path = Path(directory) / f"{name}.wav"
+    sf.write(str(path), y, SR, subtype='FLOAT')
+    return path, onset_times, dominant_tempo(track['sections']), len(y) / SR
+
+
+def run_chart(analyzer, path, method):
+    """產生一次譜面（不儲存），回傳 (譜面資料, 總秒數, 各步驟秒數)"""
+    random.seed(0)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        chart = analyzer.generate_chart(str(path), method=method)
+    return chart, time.perf_counter() - started, dict(analyzer.stage_timings)
+
+
+def bench(analyzer, name, path, onset_times, bpm, duration, method, profile, repeat):
+    analyzer.set_profile(profile)
+    runs = [run_chart(analyzer, path, method) for _ in range(repeat)]
+    chart = runs[-1][0]
+    if chart is None:
+        raise RuntimeError(f"{name} / {method} / {profile}: 譜面產生失敗")
+    stages = {stage: statistics.median(run[2].get(stage, 0.0) for run in runs) for stage in runs[-1][2]}
+    note_times = [note['time'] for note in chart['notes']]
+    return {
+        'track': name,
+        'method': method,
+        'profile': profile,
+        'duration': duration,
+        'seconds': statistics.median(run[1] for run in runs),
+        'stages': stages,
+        'notes': len(note_times),
+        'bpm': chart['bpm'],
+        'reference_bpm': bpm,
+        'bpm_error': tempo_error(bpm, chart['bpm']),
+        **onset_f_measure(onset_times, note_times)
+    }
+
+
+def result_key(result):
+    return result['track'], result['method'], result['profile']
+
+
+def compare(results, baseline, args):
+    """與基準比較，回傳失敗訊息列表"""
+    previous = {result_key(result): result for result in baseline}
+    failures = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        label = '/'.join(result_key(result))
+        if old['seconds'] >= args.min_seconds and result['seconds'] > old['seconds'] * (1 + args.max_slowdown):
+            failures.append(f"{label}: 總時間 {old['seconds']:.2f}s → {result['seconds']:.2f}s")
+        if result['f_measure'] < old['f_measure'] - args.max_f_drop:
+            failures.append(f"{label}: onset F-measure {old['f_measure']:.3f} → {result['f_measure']:.3f}")
+        if result['bpm_error'] > old['bpm_error'] + args.max_bpm_error_increase:
+            failures.append(f"{label}: BPM 誤差 {old['bpm_error']:.3f} → {result['bpm_error']:.3f}")
+    return failures
+
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    analyzer = AudioAnalyzer(debug=False)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='rhythm_bench_') as directory:
+        # 先以短音訊跑過一次，numba 編譯不計入第一項的時間
+        warm_up, _, _, _ = write_track('warm_up', {'sections': [(5, 120)], 'pattern': 'click', 'noise': 0.0}, directory)
+        for profile in args.profiles:
+            analyzer.set_profile(profile)
+            run_chart(analyzer, warm_up, METHODS[0])
+
+        print(f"{'曲目':<22}{'方法':<15}{'設定檔':<10}{'長度':>7}{'總時間':>9}{'音符':>7}"
+              f"{'BPM':>8}{'誤差':>7}{'F':>7}  各步驟")
+        for name in select_tracks(args):
+            path, onset_times, bpm, duration = write_track(name, TRACKS[name], directory)
+            for profile in args.profiles:
+                for method in args.methods:
+                    result = bench(analyzer, name, path, onset_times, bpm, duration, method, profile, args.repeat)
+                    results.append(result)
+                    stages = ' '.join(f"{stage}={seconds:.2f}" for stage, seconds in result['stages'].items())
+                    print(f"{name:<22}{method:<15}{profile:<10}{duration:>6.0f}s{result['seconds']:>8.2f}s"
+                          f"{result['notes']:>7}{result['bpm']:>8.1f}{result['bpm_error']:>7.3f}"
+                          f"{result['f_measure']:>7.3f}  {stages}")
+            path.unlink()
+
+    if args.json:
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'numpy': np.__version__,
+                'librosa': __import__('librosa').__version__
+            },
+            'results': results
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n結果已寫入 {args.json}")
+
+    if baseline is not None:
+        failures = compare(results, baseline, args)
+        if failures:
+            print(f"\n與基準 {args.baseline} 相比退化:", file=sys.stderr)
+            for failure in failures:
+                print(f"  {failure}", file=sys.stderr)
+            return 1
+        print(f"\n與基準 {args.baseline} 相比沒有退化")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+onset / 節拍檢測後端比較
+Onset and Beat Detector Backend Benchmark
+
+以合成的鼓組與節拍器音訊（已知 onset 與節拍時間）比較 detectors 中各後端的
+速度與準確度：onset 後端量測包絡線與峰值挑選的時間及 F-measure（±50 ms），
+節拍後端以同一條包絡線量測時間、BPM 誤差（允許兩倍 / 一半）與節拍 F-measure（±70 ms）。
+不需要網路或任何音訊檔案。
+
+用法:
+    python tools/detector_bench.py
+    python tools/detector_bench.py --seconds 30 300 --bpm 90 128 174
+    python tools/detector_bench.py --noise 0.05 --repeat 5 --json detectors.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rhythm_game.src.detectors import ONSET_BACKENDS, BEAT_BACKENDS, get_onset_backend, get_beat_backend
+from rhythm_game.src.evaluation import synthesize_track, onset_f_measure, tempo_error
+
+SR = 22050
+HOP_LENGTH = 512
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='RhythmForge detector backend benchmark')
+    parser.add_argument('--seconds', type=float, nargs='+', default=[60.0, 300.0], help='合成音訊長度（秒）')
+    parser.add_argument('--bpm', type=float, nargs='+', default=[95.0, 128.0, 174.0], help='合成音訊速度')
+    parser.add_argument('--pattern', choices=['drums', 'click'], default='drums', help='合成音訊的打擊型態')
+    parser.add_argument('--noise', type=float, default=0.02, help='背景噪音振幅')
+    parser.add_argument('--repeat', type=int, default=3, help='每項量測重複次數（取中位數）')
+    parser.add_argument('--json', help='將結果寫入 JSON 檔案')
+    return parser.parse_args()
+
+
+def timed(fn, repeat):
+    """執行 repeat 次，回傳 (最後一次的結果, 秒數中位數)"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return result, statistics.median(times)
+
+
+def bench_track(y, onset_times, beat_times, bpm, repeat):
+    onset_results = []
+    beat_envelopes = {}
+    for name in ONSET_BACKENDS:
+        backend = get_onset_backend(name)
+        envelopes, envelope_seconds = timed(lambda: backend.envelopes(y, SR, HOP_LENGTH), repeat)
+        detected, detect_seconds = timed(lambda: backend.detect(envelopes[0], SR, HOP_LENGTH), repeat)
+        beat_envelopes[name] = envelopes[1]
+        onset_results.append({
+            'backend': name,
+            'envelope_seconds': envelope_seconds,
+            'detect_seconds': detect_seconds,
+            'detected': int(len(detected)),
+            **onset_f_measure(onset_times, detected)
+        })
+
+    beat_results = []
+    for envelope_name, envelope in beat_envelopes.items():
+        for name in BEAT_BACKENDS:
+            backend = get_beat_backend(name)
+            (tempo, beats), seconds = timed(lambda: backend.track(envelope, SR, HOP_LENGTH), repeat)
+            beat_results.append({
+                'backend': name,
+                'envelope': envelope_name,
+                'seconds': seconds,
+                'bpm': tempo,
+                'bpm_error': tempo_error(bpm, tempo),
+                'beat_f_measure': onset_f_measure(beat_times, beats, window=0.07)['f_measure']
+            })
+    return onset_results, beat_results
+
+
+def main():
+    args = parse_args()
+    results = []
+    for seconds in args.seconds:
+        for bpm in args.bpm:
+            y, onset_times, beat_times = synthesize_track(
+                bpm, seconds, sr=SR, pattern=args.pattern, seed=int(bpm), noise=args.noise)
+            onset_results, beat_results = bench_track(y, onset_times, beat_times, bpm, args.repeat)
+            results.append({'seconds': seconds, 'bpm': bpm, 'onsets': onset_results, 'beats': beat_results})
+
+            print(f"\n=== {seconds:.0f} 秒，{bpm:.0f} BPM，{len(onset_times)} 個 onset ===")
+            print(f"{'onset 後端':<12}{'包絡線':>10}{'峰值':>10}{'數量':>8}{'P':>8}{'R':>8}{'F':>8}")
+            for r in onset_results:
+                print(f"{r['backend']:<12}{r['envelope_seconds'] * 1000:>8.1f}ms{r['detect_seconds'] * 1000:>8.1f}ms"
+                      f"{r['detected']:>8}{r['precision']:>8.3f}{r['recall']:>8.3f}{r['f_measure']:>8.3f}")
+            print(f"{'節拍後端':<12}{'包絡線':<10}{'時間':>10}{'BPM':>9}{'誤差':>8}{'F':>8}")
+            for r in beat_results:
+                print(f"{r['backend']:<12}{r['envelope']:<10}{r['seconds'] * 1000:>8.1f}ms"
+                      f"{r['bpm']:>9.2f}{r['bpm_error']:>8.3f}{r['beat_f_measure']:>8.3f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n結果已寫入 {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
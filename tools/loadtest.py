@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Socket.IO 負載測試工具
+Socket.IO Load Testing Harness
+
+模擬 N 位玩家同時遊玩：每個模擬客戶端以 start_game 載入譜面，依譜面音符時間
+（加上類似真人的隨機誤差）送出 hit_note / auto_miss，最後送出 end_game。
+結束後輸出各事件的往返延遲百分位數（p50/p95/p99）、遺失與錯誤事件數，
+以及伺服器行程的 CPU / RSS 變化。
+
+--time-scale 只壓縮送出的時間表，適合量測吞吐量：伺服器以實際的時鐘同步時間戳記判定
+（並限制在收到時間之前），加速時的判定結果沒有意義，因此只有 --time-scale 1 時才統計判定分布。
+
+用法:
+    python tools/loadtest.py --url http://localhost:5000 --clients 50
+    python tools/loadtest.py --url http://localhost:5001 --url http://localhost:5002 \\
+        --clients 200 --server-pid 1234 --server-pid 1235 --json report.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque, defaultdict
+from pathlib import Path
+
+import socketio
+
+
+def percentile(sorted_values, pct):
+    """以線性插值計算百分位數（輸入需已排序）"""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class LatencyRecorder:
+    """執行緒安全的延遲與事件計數紀錄"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.counters = defaultdict(int)
+
+    def add_latency(self, event, seconds):
+        with self._lock:
+            self.latencies[event].append(seconds)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def summary(self):
+        with self._lock:
+            result = {}
+            for event, values in self.latencies.items():
+                values = sorted(values)
+                result[event] = {
+                    'count': len(values),
+                    'p50_ms': percentile(values, 50) * 1000,
+                    'p95_ms': percentile(values, 95) * 1000,
+                    'p99_ms': percentile(values, 99) * 1000,
+                    'max_ms': values[-1] * 1000
+                }
+            return result, dict(self.counters)
+
+
+class ProcessSampler:
+    """定期由 /proc 讀取伺服器行程的 CPU 與 RSS（Linux）"""
+
+    def __init__(self, pids, interval=1.0):
+        self.pids = pids
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def _read_cpu_seconds(self, pid):
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime, stime 為第 14、15 欄（去掉 pid 與 comm 後索引為 11、12）
+        return (int(fields[11]) + int(fields[12])) / self._clock_ticks
+
+    def _read_rss_bytes(self, pid):
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * self._page_size
+
+    def _run(self):
+        last_cpu = {}
+        last_time = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            sample = {'t': time.time(), 'processes': {}}
+            for pid in self.pids:
+                try:
+                    cpu = self._read_cpu_seconds(pid)
+                    rss = self._read_rss_bytes(pid)
+                except OSError:
+                    continue
+                cpu_percent = None
+                if pid in last_cpu and now > last_time:
+                    cpu_percent = (cpu - last_cpu[pid]) / (now - last_time) * 100
+                last_cpu[pid] = cpu
+                sample['processes'][pid] = {'cpu_percent': cpu_percent, 'rss_bytes': rss}
+            last_time = now
+            if sample['processes']:
+                self.samples.append(sample)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if not self.pids:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval * 2)
+
+    def summary(self):
+        result = {}
+        for pid in self.pids:
+            cpu = [s['processes'][pid]['cpu_percent'] for s in self.samples
+                   if pid in s['processes'] and s['processes'][pid]['cpu_percent'] is not None]
+            rss = [s['processes'][pid]['rss_bytes'] for s in self.samples if pid in s['processes']]
+            if not rss:
+                continue
+            result[pid] = {
+                'cpu_percent_avg': sum(cpu) / len(cpu) if cpu else None,
+                'cpu_percent_max': max(cpu) if cpu else None,
+                'rss_mb_start': rss[0] / 1024 / 1024,
+                'rss_mb_end': rss[-1] / 1024 / 1024,
+                'rss_mb_max': max(rss) / 1024 / 1024
+            }
+        return result
+
+
+class SimulatedPlayer:
+    """單一模擬玩家"""
+
+    def __init__(self, player_id, url, chart_path, chart, recorder, args):
+        self.player_id = player_id
+        self.url = url
+        self.chart_path = chart_path
+        self.chart = chart
+        self.recorder = recorder
+        self.args = args
+        self.rng = random.Random(args.seed + player_id if args.seed is not None else None)
+
+        self.sio = socketio.Client(reconnection=False, serializer=args.serializer)
+        # 伺服器依序回應，故以 FIFO 對應送出時間與回應
+        self._pending_judgments = deque()
+        self._pending_lock = threading.Lock()
+        self._started = threading.Event()
+        self._ended = threading.Event()
+        self._start_sent_at = None
+        self._end_sent_at = None
+
+        self.sio.on('game_started', self._on_game_started)
+        self.sio.on('note_judgment', self._on_note_judgment)
+        self.sio.on('game_ended', self._on_game_ended)
+        self.sio.on('game_error', self._on_game_error)
+        self.sio.on('clock_ping', self._on_clock_ping)
+
+    def _on_game_started(self, data):
+        self.recorder.add_latency('start_game', time.perf_counter() - self._start_sent_at)
+        self._started.set()
+
+    def _on_note_judgment(self, data):
+        received_at = time.perf_counter()
+        with self._pending_lock:
+            if not self._pending_judgments:
+                self.recorder.incr('unexpected_judgments')
+                return
+            event, sent_at = self._pending_judgments.popleft()
+        self.recorder.add_latency(event, received_at - sent_at)
+        self.recorder.incr(f'{event}_received')
+        if self.args.time_scale == 1:
+            self.recorder.incr(f"judgment_{data.get('judgment', 'unknown')}")
+
+    def _on_game_ended(self, data):
+        if self._end_sent_at is not None:
+            self.recorder.add_latency('end_game', time.perf_counter() - self._end_sent_at)
+        self._ended.set()
+
+    def _on_clock_ping(self, data):
+        # 與 play.js 相同：立即以本地單調時鐘回覆
+        self.sio.emit('clock_pong', {'id': data.get('id'), 'client_time': time.perf_counter()})
+
+    def _on_game_error(self, data):
+        self.recorder.incr('game_errors')
+        if not self._started.is_set():
+            self._started.set()
+            return
+        # 遊戲中的錯誤回應取代最早送出、尚未回應的 hit_note / auto_miss 的判定，
+        # 必須移出佇列，之後的延遲才不會對應到錯誤的請求
+        with self._pending_lock:
+            if self._pending_judgments:
+                event, _ = self._pending_judgments.popleft()
+                self.recorder.incr(f'{event}_errors')
+
+    def _send(self, event, payload):
+        with self._pending_lock:
+            self._pending_judgments.append((event, time.perf_counter()))
+        self.sio.emit(event, payload)
+        self.recorder.incr(f'{event}_sent')
+
+    def run(self):
+        args = self.args
+        try:
+            self.sio.connect(self.url, transports=args.transports, wait_timeout=args.timeout)
+        except Exception as e:
+            self.recorder.incr('connect_errors')
+            if args.verbose:
+                print(f"[player {self.player_id}] connect failed: {e}", file=sys.stderr)
+            return
+
+        try:
+            self._start_sent_at = time.perf_counter()
+            self.sio.emit('start_game', {'chart_path': self.chart_path})
+            if not self._started.wait(args.timeout):
+                self.recorder.incr('start_timeouts')
+                return
+
+            self._play()
+
+            # 等待所有判定回應
+            deadline = time.perf_counter() + args.timeout
+            while time.perf_counter() < deadline:
+                with self._pending_lock:
+                    if not self._pending_judgments:
+                        break
+                time.sleep(0.05)
+            with self._pending_lock:
+                dropped = len(self._pending_judgments)
+                self._pending_judgments.clear()
+            self.recorder.incr('dropped_events', dropped)
+
+            self._end_sent_at = time.perf_counter()
+            self.sio.emit('end_game')
+            if not self._ended.wait(args.timeout):
+                self.recorder.incr('dropped_events')
+        except Exception as e:
+            self.recorder.incr('client_errors')
+            if args.verbose:
+                print(f"[player {self.player_id}] error: {e}", file=sys.stderr)
+        finally:
+            self.recorder.incr('players_finished')
+            self.sio.disconnect()
+
+    def _play(self):
+        args = self.args
+        # 與 play.js 相同：超過 good 判定（0.15s）再加 0.1s 緩衝後視為漏按
+        miss_delay = 0.25
+
+        notes = sorted(self.chart['notes'], key=lambda n: n['time'])
+        if args.max_song_seconds:
+            notes = [n for n in notes if n['time'] <= args.max_song_seconds]
+
+        events = []
+        for note in notes:
+            if self.rng.random() < args.miss_rate:
+                # 模擬漏按：和瀏覽器一樣在超過判定範圍後送出 auto_miss
+                events.append((note['time'] + miss_delay, 'auto_miss',
+                               {'lane': note['lane'], 'note_time': note['time']}))
+            else:
+                offset = self.rng.gauss(args.bias_ms / 1000.0, args.jitter_ms / 1000.0)
+                events.append((note['time'] + offset, 'hit_note',
+                               {'lane': note['lane'], 'time': note['time'] + offset,
+                                'note_time': note['time']}))
+        events.sort(key=lambda e: e[0])
+
+        game_start = time.perf_counter()
+        self.sio.emit('audio_started', {'client_ts': game_start})
+        for song_time, event, payload in events:
+            delay = game_start + song_time / args.time_scale - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if not self.sio.connected:
+                self.recorder.incr('disconnected_mid_game')
+                return
+            if event == 'hit_note':
+                payload['client_ts'] = time.perf_counter()
+            self._send(event, payload)
+
+
+def load_charts(args):
+    """載入要測試的譜面清單"""
+    if args.chart:
+        paths = [Path(p) for p in args.chart]
+    else:
+        paths = sorted(Path(args.charts_dir).glob('*.json'))
+
+    charts = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                chart = json.load(f)
+            if chart.get('notes'):
+                charts.append((path.as_posix(), chart))
+        except Exception as e:
+            print(f"無法讀取譜面 {path}: {e}", file=sys.stderr)
+    return charts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='RhythmForge Socket.IO load test')
+    parser.add_argument('--url', action='append', help='伺服器網址，可重複指定以分散到多個 worker')
+    parser.add_argument('--clients', type=int, default=10, help='模擬玩家數')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='所有玩家連線完成所需秒數')
+    parser.add_argument('--charts-dir', default='rhythm_game/charts', help='譜面資料夾')
+    parser.add_argument('--chart', action='append', help='指定譜面檔案（可重複）')
+    parser.add_argument('--jitter-ms', type=float, default=25.0, help='按鍵時間誤差標準差（毫秒）')
+    parser.add_argument('--bias-ms', type=float, default=0.0, help='按鍵時間平均偏移（毫秒，正值為偏晚）')
+    parser.add_argument('--miss-rate', type=float, default=0.05, help='漏按機率')
+    parser.add_argument('--max-song-seconds', type=float, help='每首歌只玩前 N 秒')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='時間加速倍率（>1 表示加速播放；只適合量測吞吐量，不統計判定分布）')
+    parser.add_argument('--transports', nargs='+', default=['websocket'], help='Socket.IO 傳輸方式')
+    parser.add_argument('--serializer', choices=['default', 'msgpack'], default='default',
+                        help='封包格式，須與伺服器的 RHYTHM_SOCKET_SERIALIZER 相同')
+    parser.add_argument('--timeout', type=float, default=10.0, help='等待回應的逾時秒數')
+    parser.add_argument('--server-pid', type=int, action='append', default=[], help='要監控 CPU/RSS 的伺服器 PID')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='CPU/RSS 取樣間隔（秒）')
+    parser.add_argument('--seed', type=int, help='隨機種子')
+    parser.add_argument('--json', help='將完整報告寫入 JSON 檔案')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    if not args.url:
+        args.url = ['http://localhost:5000']
+    return args
+
+
+def print_report(report):
+    print("\n=== 負載測試結果 ===")
+    print(f"玩家數: {report['clients']}  執行時間: {report['elapsed_seconds']:.1f}s")
+
+    print("\n事件往返延遲:")
+    print(f"  {'event':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for event, stats in sorted(report['latency'].items()):
+        print(f"  {event:<12}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+
+    print("\n事件計數:")
+    for name, value in sorted(report['counters'].items()):
+        print(f"  {name}: {value}")
+
+    if report['server']:
+        print("\n伺服器資源:")
+        for pid, stats in report['server'].items():
+            cpu_avg = stats['cpu_percent_avg']
+            cpu_max = stats['cpu_percent_max']
+            print(f"  pid {pid}: CPU avg {cpu_avg or 0:.1f}% max {cpu_max or 0:.1f}%, "
+                  f"RSS {stats['rss_mb_start']:.1f} -> {stats['rss_mb_end']:.1f} MB (max {stats['rss_mb_max']:.1f})")
+
+
+def main():
+    args = parse_args()
+    charts = load_charts(args)
+    if not charts:
+        print("找不到可用的譜面，請先產生譜面或使用 --chart 指定", file=sys.stderr)
+        return 1
+
+    recorder = LatencyRecorder()
+    sampler = ProcessSampler(args.server_pid, args.sample_interval)
+    sampler.start()
+
+    players = []
+    for i in range(args.clients):
+        chart_path, chart = charts[i % len(charts)]
+        url = args.url[i % len(args.url)]
+        players.append(SimulatedPlayer(i, url, chart_path, chart, recorder, args))
+
+    started_at = time.perf_counter()
+    threads = []
+    for i, player in enumerate(players):
+        thread = threading.Thread(target=player.run, daemon=True)
+        thread.start()
+        threads.append(thread)
+        if args.clients > 1 and args.ramp_up > 0:
+            time.sleep(args.ramp_up / args.clients)
+
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    sampler.stop()
+
+    latency, counters = recorder.summary()
+    report = {
+        'clients': args.clients,
+        'urls': args.url,
+        'elapsed_seconds': elapsed,
+        'latency': latency,
+        'counters': counters,
+        'server': sampler.summary(),
+        'server_timeline': sampler.samples
+    }
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n報告已儲存: {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
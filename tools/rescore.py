@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+重播批次重新計分工具
+Replay Re-scoring Tool
+
+讀取伺服器記錄的重播檔（rhythm_game/replays/*.rfr），以指定的判定容差
+重新判定所有輸入並計分。調整 ConfigManager 的判定容差前，可先用 --compare
+比較新舊容差下的分數與等級變化。
+
+用法:
+    python tools/rescore.py
+    python tools/rescore.py --perfect 0.05 --great 0.1 --good 0.15 --compare
+    python tools/rescore.py rhythm_game/replays/20240101-*.rfr --json rescored.json
+"""
+
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rhythm_game.src.utils import ConfigManager
+from rhythm_game.src.replay import ReplayEngine, DEFAULT_TOLERANCES
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='RhythmForge replay re-scoring')
+    parser.add_argument('replays', nargs='*', help='重播檔（預設為 --replay-dir 內所有檔案）')
+    parser.add_argument('--replay-dir', default='rhythm_game/replays', help='重播檔資料夾')
+    parser.add_argument('--config', default='rhythm_game/config.json', help='讀取目前判定容差的設定檔')
+    parser.add_argument('--perfect', type=float, help='Perfect 判定容差（秒）')
+    parser.add_argument('--great', type=float, help='Great 判定容差（秒）')
+    parser.add_argument('--good', type=float, help='Good 判定容差（秒）')
+    parser.add_argument('--input-offset', type=float, help='覆寫重播記錄的延遲補償（秒）')
+    parser.add_argument('--compare', action='store_true', help='同時以目前容差計分並比較差異')
+    parser.add_argument('--json', help='將每個重播的結果寫入 JSON 檔案')
+    return parser.parse_args()
+
+
+def summarize(results):
+    scored = [r for r in results if 'error' not in r]
+    grades = Counter(r['grade'] for r in scored)
+    inputs = sum(r['total_notes'] for r in scored)
+    return scored, grades, inputs
+
+
+def main():
+    args = parse_args()
+    paths = [Path(p) for p in args.replays] or sorted(Path(args.replay_dir).glob('*.rfr'))
+    if not paths:
+        print("找不到重播檔", file=sys.stderr)
+        return 1
+
+    current = dict(DEFAULT_TOLERANCES)
+    current.update(ConfigManager(args.config).get('judgment_tolerances', {}))
+    tolerances = dict(current)
+    for name in ('perfect', 'great', 'good'):
+        if getattr(args, name) is not None:
+            tolerances[name] = getattr(args, name)
+
+    started_at = time.perf_counter()
+    results = ReplayEngine(tolerances).rescore(paths, input_offset=args.input_offset)
+    elapsed = time.perf_counter() - started_at
+
+    scored, grades, inputs = summarize(results)
+    print(f"重播數: {len(results)}（成功 {len(scored)}，失敗 {len(results) - len(scored)}）")
+    print(f"判定容差: perfect {tolerances['perfect']}s, great {tolerances['great']}s, good {tolerances['good']}s")
+    print(f"耗時: {elapsed:.2f}s（{len(results) / max(elapsed, 1e-9):.0f} 重播/秒，"
+          f"{inputs / max(elapsed, 1e-9):.0f} 判定/秒）")
+    print("等級分布: " + ', '.join(f"{grade} {grades[grade]}" for grade in ('SS', 'S', 'A', 'B', 'C', 'D')))
+
+    if args.compare:
+        baseline = ReplayEngine(current).rescore(paths, input_offset=args.input_offset)
+        changed_score = changed_grade = 0
+        for before, after in zip(baseline, results):
+            if 'error' in before or 'error' in after:
+                continue
+            after['previous'] = {k: before[k] for k in ('score', 'accuracy', 'grade')}
+            changed_score += before['score'] != after['score']
+            changed_grade += before['grade'] != after['grade']
+        print(f"與目前容差比較: 分數變動 {changed_score} 筆，等級變動 {changed_grade} 筆")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"結果已寫入 {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
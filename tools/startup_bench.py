@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+啟動時間與匯入時間基準測試
+Startup / Import-time Benchmark
+
+在全新的子行程中匯入網頁伺服器（app.py）與分析行程使用的模組，量測匯入時間、
+記憶體用量與最耗時的匯入，並確認網頁行程沒有載入 librosa、numba、scipy、
+matplotlib、yt-dlp 等只有分析或下載才需要的模組。重量級模組被加回網頁行程
+或超過 --budget 時以非零狀態結束，可放進 CI 防止啟動時間退化。
+
+用法:
+    python tools/startup_bench.py
+    python tools/startup_bench.py --runs 10 --top 20
+    python tools/startup_bench.py --budget 1.5 --json startup.json
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 網頁 / Socket.IO 行程不應載入的模組（只在分析行程或下載時才需要）
+HEAVY_MODULES = ('librosa', 'numba', 'scipy', 'sklearn', 'matplotlib', 'yt_dlp', 'soundfile', 'audioread')
+
+# 各目標在子行程中執行的匯入
+TARGETS = {
+    'web': 'import app',
+    'analysis': 'from rhythm_game.src.jobs import _get_worker_analyzer; _get_worker_analyzer()',
+}
+
+CHILD_SCRIPT = '''
+import sys, time, json, resource
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+    "modules": len(sys.modules)
+}}))
+'''
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='RhythmForge startup benchmark')
+    parser.add_argument('targets', nargs='*', metavar='target',
+                        help=f"量測目標：{', '.join(TARGETS)}（預設全部）")
+    parser.add_argument('--runs', type=int, default=5, help='每個目標重複次數')
+    parser.add_argument('--top', type=int, default=15, help='列出最耗時的匯入數量')
+    parser.add_argument('--budget', type=float, help='web 匯入時間中位數上限（秒），超過時失敗')
+    parser.add_argument('--json', help='將結果寫入 JSON 檔案')
+    args = parser.parse_args()
+    unknown = [name for name in args.targets if name not in TARGETS]
+    if unknown:
+        parser.error(f"未知的目標: {', '.join(unknown)}")
+    return args
+
+
+def run_child(statement, importtime=False):
+    """在新的直譯器中執行匯入，回傳 (量測結果, -X importtime 輸出)"""
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', CHILD_SCRIPT.format(statement=statement, heavy=HEAVY_MODULES)]
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, env=dict(os.environ))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else 'child failed')
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    return measurement, result.stderr
+
+
+def slowest_imports(importtime_output, top):
+    """由 -X importtime 輸出取出累積時間最長的模組（含巢狀匯入）"""
+    entries = []
+    for line in importtime_output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            cumulative_us, depth, name = int(match.group(2)), len(match.group(3)), match.group(4)
+            entries.append((cumulative_us / 1e6, depth, name))
+    if not entries:
+        return []
+    root_depth = min(depth for _, depth, _ in entries)
+    entries = [entry for entry in entries if entry[1] > root_depth]
+    entries.sort(reverse=True)
+    return [{'module': name, 'seconds': seconds} for seconds, _, name in entries[:top]]
+
+
+def bench(name, statement, runs, top):
+    samples = [run_child(statement)[0] for _ in range(runs)]
+    _, importtime_output = run_child(statement, importtime=True)
+    times = [sample['seconds'] for sample in samples]
+    return {
+        'target': name,
+        'median': statistics.median(times),
+        'min': min(times),
+        'max': max(times),
+        'rss_mb': statistics.median(sample['rss_mb'] for sample in samples),
+        'modules': samples[-1]['modules'],
+        'heavy': samples[-1]['heavy'],
+        'slowest': slowest_imports(importtime_output, top)
+    }
+
+
+def main():
+    args = parse_args()
+    results = []
+    failed = False
+    for name in args.targets or list(TARGETS):
+        try:
+            result = bench(name, TARGETS[name], args.runs, args.top)
+        except RuntimeError as e:
+            print(f"{name}: 匯入失敗: {e}", file=sys.stderr)
+            return 1
+        results.append(result)
+
+        print(f"\n=== {name}: {TARGETS[name]} ===")
+        print(f"匯入時間: 中位數 {result['median'] * 1000:.0f} ms"
+              f"（{result['min'] * 1000:.0f}-{result['max'] * 1000:.0f} ms，{args.runs} 次）")
+        print(f"記憶體: {result['rss_mb']:.0f} MB，已載入模組 {result['modules']} 個")
+        print(f"重量級模組: {', '.join(result['heavy']) or '無'}")
+        print("最耗時的匯入（累積，含巢狀）:")
+        for entry in result['slowest']:
+            print(f"  {entry['seconds'] * 1000:8.1f} ms  {entry['module']}")
+
+        if name == 'web':
+            if result['heavy']:
+                print(f"失敗: 網頁行程載入了 {', '.join(result['heavy'])}", file=sys.stderr)
+                failed = True
+            if args.budget is not None and result['median'] > args.budget:
+                print(f"失敗: 匯入時間 {result['median']:.2f}s 超過上限 {args.budget:.2f}s", file=sys.stderr)
+                failed = True
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n結果已寫入 {args.json}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())